@@ -1,6 +1,4 @@
 
-import rabbitpy
-import urllib.parse
 import socket
 import traceback
 import logging
@@ -8,12 +6,74 @@ import threading
 import multiprocessing
 import queue
 import time
+import collections
+import sys
+import uuid
+import random
+
+from . import transport
+from . import queues
+from . import connpool
+from . import compression
+from . import serializers
+from . import chunking
+from . import metrics
+from . import spool
+from . import sharding
+from . import topology
+from . import prefetch
+from .delivery import Delivery
+from .delivery import Outgoing
+from .delivery import DEADLINE
+from .delivery import is_expired
 
 class Heartbeat_Timeout_Exception(Exception):
+	'''
+	Raised on the interface thread when a liveness probe isn't answered
+	within `hearbeat_packet_timeout`, to force a reconnect.
+	'''
 	pass
 
+class ConsumerChannel:
+	'''
+	One consuming channel of a ConnectorManager, with the deferred-ack
+	window and counters for that channel.
+	'''
+	def __init__(self, index, channel, consumer, queue, prefetch=None):
+		self.index        = index
+		self.channel      = channel
+		self.consumer     = consumer
+		self.queue        = queue
+
+		# The prefetch window set on the channel, and the one the tuner
+		# wants. Only the rx thread may call basic_qos(), as rabbitpy
+		# channels can't be read from two threads.
+		self.prefetch     = prefetch
+		self.next_prefetch = prefetch
+
+		# Delivery tag -> True once the application has acked it, for every
+		# delivery the broker still considers unacked on this channel.
+		self.unacked      = collections.OrderedDict()
+
+		self.received     = 0
+		self.acked        = 0
+		self.nacked       = 0
+		self.ack_frames   = 0
+
+	def stats(self):
+		return {
+			'channel'    : self.index,
+			'queue'      : self.queue,
+			'received'   : self.received,
+			'acked'      : self.acked,
+			'nacked'     : self.nacked,
+			'ack_frames' : self.ack_frames,
+			'unacked'    : len(self.unacked),
+		}
+
+
 class ConnectorManager:
-	def __init__(self, config, runstate, active, task_queue, response_queue):
+	def __init__(self, config, runstate, active, task_queue, response_queue, tx_event, ack_queue, reassembler, metrics, tuner=None):
 
 		assert 'host'                     in config
 		assert 'userid'                   in config
@@ -38,6 +98,24 @@ class ConnectorManager:
 		assert 'hearbeat_packet_interval' in config
 		assert 'hearbeat_packet_timeout'  in config
 		assert 'ack_rx'                   in config
+		assert 'publisher_confirms'       in config
+		assert 'confirm_window'           in config
+		assert 'transport'                in config
+		assert 'rx_buffer_size'           in config
+		assert 'max_buffered_bytes_in'    in config
+		assert 'ack_mode'                 in config
+		assert 'consumer_channels'        in config
+		assert 'share_connection'         in config
+		assert 'accept_content'           in config
+		assert 'memoryview_bodies'        in config
+		assert 'chunk_spool_size'         in config
+		assert 'chunk_timeout'            in config
+		assert 'task_shards'              in config
+		assert 'consume_shards'           in config
+		assert 'max_priority'             in config
+		assert 'topology_cache_ttl'       in config
+		assert 'expired_action'           in config
+		assert 'adaptive_prefetch'        in config
 
 
 		self.log = logging.getLogger("Main.Connector.Internal(%s)" % config['virtual_host'])
@@ -46,40 +124,109 @@ class ConnectorManager:
 		self.task_queue         = task_queue
 		self.active_connections = active
 		self.response_queue     = response_queue
+		self.tx_event           = tx_event
+		self.ack_queue          = ack_queue
+		self.reassembler        = reassembler
+		self.metrics            = metrics
+		# PrefetchTuner, with adaptive_prefetch. Like the reassembler, it
+		# outlives reconnections.
+		self.tuner              = tuner
 
 
 		self.session_fetched        = 0
 		self.queue_fetched          = 0
 		self.active                 = 0
-		self.last_hearbeat_sent     = time.time()
-		self.last_hearbeat_received = time.time()
+		self.last_hearbeat_sent     = time.monotonic()
+		self.last_hearbeat_received = time.monotonic()
 
 		self.sent_messages = 0
 		self.recv_messages = 0
 
 		self.connection     = None
 		self.channel        = None
+		self.consumers      = []
+		self.rx_threads     = []
+		self.closed         = False
+		self.declarer       = None
+		# Set once the first poll pass completes. A connection that breaks
+		# before then may have been broken by a skipped declare.
+		self.established    = False
 
 		self.keepalive_exchange_name = "keepalive_exchange"+str(id("wat"))
 
-		self.delivered = 0
+		# Liveness probing (see _startHeartbeat()). Each connection gets a
+		# probe queue of its own.
+		self.probe_queue       = "nak.%s.q" % uuid.uuid4().hex
+		self.probe_tx_channel  = None
+		self.probe_channel     = None
+		self.probe_consumer    = None
+		self.probe_lock        = threading.Lock()
+		self.probe_seq         = 0
+		self.probe_outstanding = None
+		self.heartbeat_failed  = None
+		self.heartbeat_stop    = threading.Event()
+		# Set once our hold on the connection is given up, which both the
+		# heartbeat thread and close() may do.
+		self.released          = False
 
-		self._connect()
+		self.delivered = 0
 
+		# Publisher-confirm state. Sequence numbers are per-channel, and
+		# start at 1 after confirm.select.
+		self.publish_seq    = 0
+		self.unconfirmed    = collections.OrderedDict()
+		self.nacked_messages = 0
+		# The message being handed to the channel right now, if any. Kept so
+		# it isn't lost if the publish raises.
+		self.publishing     = None
 
-		if self.config['master']:
-			self.in_queue = self.config['response_queue_name']
-		else:
-			self.in_queue = self.config['task_queue_name']
+		# Deferred acks are tracked per consuming channel (see ConsumerChannel).
+		self.deferred_acks  = self.config['ack_mode'] != 'receive'
 
+		self.active_lock = threading.Lock()
 
-		self.in_q = rabbitpy.Queue(self.connection.channel(), self.in_queue)
-
+		# Local receive buffer limits. Default to holding one prefetch window.
+		self.prefetch       = self.tuner.window if self.tuner else self.config['prefetch']
+		self.rx_buffer_size = self.config['rx_buffer_size']
+		if self.rx_buffer_size is None:
+			self.rx_buffer_size = self.prefetch
 
-		self.rx_thread = threading.Thread(target=self._processReceiving, daemon=False)
-		self.rx_thread.start()
+		self.in_shards = self._wantedShards()
+		self.in_queues = self._wantedQueues(self.in_shards)
+		self.declared_shards = 0
 
-		self.active_lock = threading.Lock()
+		try:
+			started = time.monotonic()
+			self._connect()
+			connected = time.monotonic()
+			self._startConsumers()
+			self._startHeartbeat()
+			self._recordStartup(started, connected)
+		except Exception:
+			# Don't leak a pooled connection reference (or the active flag)
+			# if setup fails part way through.
+			self.close(broken=True)
+			raise
+
+	def _startConsumers(self):
+		# Consume on channels of our own, so the prefetch limit applies to
+		# them and the publishing channel is never blocked behind a delivery.
+		# Each channel gets its own prefetch window and rx thread, all
+		# feeding the same task queue. Every consumed queue (shard) gets
+		# `consumer_channels` channels.
+		self.consumers = []
+		for queue_name in self.in_queues:
+			for _ in range(self.config['consumer_channels']):
+				chan = self.connection.channel()
+				chan.basic_qos(self.prefetch)
+				consumer = chan.consume(queue_name, no_ack=self.no_ack)
+				self.consumers.append(ConsumerChannel(len(self.consumers), chan, consumer, queue_name, self.prefetch))
+
+		self.rx_threads = []
+		for consumer in self.consumers:
+			thread = threading.Thread(target=self._processReceiving, args=(consumer, ), daemon=False)
+			thread.start()
+			self.rx_threads.append(thread)
 
 
 		# config = {
@@ -122,7 +269,10 @@ class ConnectorManager:
 		# Finally, deincrement the active count
 		self.active_connections.value = 0
 
-		self.rx_thread.join()
+		# The last reference can be dropped by an rx thread itself.
+		for thread in self.rx_threads:
+			if thread is not threading.current_thread():
+				thread.join()
 
 	def _connect(self):
 
@@ -130,54 +280,22 @@ class ConnectorManager:
 		self.active_connections.value = 1
 
 		self.log.info("Initializing AMQP connection.")
-		# Connect to server
-		# self.connection = amqp.connection.Connection(host           = self.config['host'],
-		# 											userid          = self.config['userid'],
-		# 											password        = self.config['password'],
-		# 											virtual_host    = self.config['virtual_host'],
-		# 											heartbeat       = self.config['heartbeat'],
-		# 											ssl             = self.config['sslopts'],
-		# 											connect_timeout = self.config['socket_timeout'],
-		# 											read_timeout    = self.config['socket_timeout'],
-		# 											write_timeout   = self.config['socket_timeout'])
-
-		# "cert_reqs" : ssl.CERT_REQUIRED,
-		# "ca_certs" : caCert,
-		# "keyfile"  : keyf,
-		# "certfile"  : cert,
-
-		qs = urllib.parse.urlencode({
-			'cacertfile'           :self.config['sslopts']['ca_certs'],
-			'certfile'             :self.config['sslopts']['certfile'],
-			'keyfile'              :self.config['sslopts']['keyfile'],
-
-			'verify'               : 'ignore',
-			'heartbeat'            : self.config['heartbeat'],
-
-			'connection_timeout'   : self.config['socket_timeout'],
-
-			})
-
-		uri = '{scheme}://{username}:{password}@{host}:{port}/{virtual_host}?{query_str}'.format(
-			scheme       = 'amqps',
-			username     = self.config['userid'],
-			password     = self.config['password'],
-			host         = self.config['host'].split(":")[0],
-			port         = self.config['host'].split(":")[1],
-			virtual_host = self.config['virtual_host'],
-			query_str    = qs,
-			)
-		self.connection = rabbitpy.Connection(uri)
 
-		# self.connection.connect()
+		# Connect to server
+		if self.config['share_connection']:
+			self.connection = connpool.get_pool().acquire(self.config)
+		else:
+			self.connection = transport.get_transport(self.config['transport'])(self.config)
+			self.connection.connect()
 
 		# Channel and exchange setup
-		self.channel = rabbitpy.AMQP(self.connection.channel(blocking_read = True))
-		self.channel.basic_qos(
-				prefetch_size  = 0,
-				prefetch_count = self.config['prefetch'],
-				global_flag    = False
-			)
+		self.channel = self.connection.channel()
+		self.declarer = topology.Declarer(self.channel, self.config, self.config['topology_cache_ttl'])
+		self.connected_at = time.monotonic()
+
+		if self.config['publisher_confirms']:
+			self.log.info("Enabling publisher confirms (window: %s).", self.config['confirm_window'])
+			self.channel.confirm_select()
 
 
 		self.log.info("Connection established. Setting up consumer.")
@@ -196,31 +314,205 @@ class ConnectorManager:
 
 
 	def _setupQueues(self):
-
-		self.channel.exchange_declare(self.config['task_exchange'],     exchange_type=self.config['task_exchange_type'],     auto_delete=False, durable=self.config['durable'])
-		self.channel.exchange_declare(self.config['response_exchange'], exchange_type=self.config['response_exchange_type'], auto_delete=False, durable=self.config['durable'])
+		# Declares go through the topology cache, so anything this process
+		# already declared on the broker is skipped (see topology.py).
+		durable = self.config['durable']
+		self.declarer.exchange(self.config['task_exchange'],     self.config['task_exchange_type'],     durable=durable)
+		self.declarer.exchange(self.config['response_exchange'], self.config['response_exchange_type'], durable=durable)
 
 		# set up consumer and response queues
 		if self.config['master']:
 			# Master has to declare the response queue so it can listen for responses
-			self.channel.queue_declare(self.config['response_queue_name'], auto_delete=False, durable=self.config['durable'])
-			self.channel.queue_bind(   self.config['response_queue_name'], exchange=self.config['response_exchange'], routing_key=self.config['response_queue_name'].split(".")[0])
+			self.declarer.queue(self.config['response_queue_name'], durable=durable)
+			self.declarer.bind( self.config['response_queue_name'], self.config['response_exchange'], self.config['response_queue_name'].split(".")[0], durable=durable)
 			self.log.info("Binding queue %s to exchange %s.", self.config['response_queue_name'], self.config['response_exchange'])
 
 		if not self.config['master']:
 			# Clients need to declare their task queues, so the master can publish into them.
-			self.channel.queue_declare(self.config['task_queue_name'], auto_delete=False, durable=self.config['durable'])
-			self.channel.queue_bind(   self.config['task_queue_name'], exchange=self.config['task_exchange'], routing_key=self.config['task_queue_name'].split(".")[0])
-			self.log.info("Binding queue %s to exchange %s.", self.config['task_queue_name'], self.config['task_exchange'])
+			for shard in self.in_shards:
+				self._declareTaskQueue(shard)
+
+		if self.config['master'] and self.config['task_shards'] > 1:
+			self._declareShards()
+
+	def _recordStartup(self, started, connected):
+		now = time.monotonic()
+		timings = {
+			'startup_connect_seconds' : self.connected_at - started,
+			'startup_declare_seconds' : connected - self.connected_at,
+			'startup_consume_seconds' : now - connected,
+			'startup_total_seconds'   : now - started,
+		}
+		for name, value in timings.items():
+			self.metrics.set(name, value)
+		self.metrics.incr(declares_sent=self.declarer.sent, declares_cached=self.declarer.cached)
+		self.log.info("Connection ready in %0.3fs (connect %0.3fs, declare %0.3fs with %s declare(s) sent and %s cached, consume %0.3fs).",
+			timings['startup_total_seconds'], timings['startup_connect_seconds'], timings['startup_declare_seconds'],
+			self.declarer.sent, self.declarer.cached, timings['startup_consume_seconds'])
+
+	def _startHeartbeat(self):
+		'''
+		Every `hearbeat_packet_interval` seconds, publish a probe to our probe
+		queue and time how long it takes to come back. A probe that isn't
+		back within `hearbeat_packet_timeout` means the connection is dead,
+		even if the socket looks open (e.g. a half-open TLS connection), so
+		the connection is torn down and rebuilt.
+
+		The probes have channels and threads of their own, so they keep
+		going while the interface thread is busy (or stuck) publishing.
+		'''
+		if not self.config['hearbeat_packet_interval']:
+			return
+
+		# "NAK" queue, used for the liveness probes. Probes go out through
+		# the keepalive exchange and are consumed straight back, so a round
+		# trip shows the connection still works end to end. Both are
+		# auto-deleted, so they're always declared.
+		self.declarer.exchange(self.keepalive_exchange_name, "direct", auto_delete=True, arguments={"x-expires" : 5*60*1000})
+		self.declarer.queue(self.probe_queue, auto_delete=True, arguments={"x-expires" : 5*60*1000})
+		self.declarer.bind(self.probe_queue, self.keepalive_exchange_name, self.probe_queue, auto_delete=True)
 
-		# "NAK" queue, used for keeping the event loop ticking when we
-		# purposefully do not want to receive messages
-		# THIS IS A SHITTY WORKAROUND for keepalive issues.
-		self.channel.exchange_declare(self.keepalive_exchange_name, exchange_type="direct", auto_delete=True, durable=False, arguments={"x-expires" : 5*60*1000})
-		self.channel.queue_declare('nak.q', auto_delete=False, durable=False)
-		self.channel.queue_bind('nak.q',    exchange=self.keepalive_exchange_name, routing_key="nak")
+		self.probe_tx_channel = self.connection.channel()
+		self.probe_channel    = self.connection.channel()
+		self.probe_consumer   = self.probe_channel.consume(self.probe_queue, no_ack=True)
+		self.last_hearbeat_sent = time.monotonic()
 
+		for target in (self._processProbes, self._heartbeatLoop):
+			threading.Thread(target=target, daemon=True).start()
 
+	def _processProbes(self):
+		try:
+			for item in self.probe_consumer:
+				now = time.monotonic()
+				try:
+					seq = int(item.body)
+				except ValueError:
+					continue
+				with self.probe_lock:
+					if seq != self.probe_outstanding:
+						# Answered after it timed out.
+						continue
+					self.probe_outstanding      = None
+					self.last_hearbeat_received = now
+					rtt = now - self.last_hearbeat_sent
+				self.metrics.observe(self.metrics.heartbeat_rtt, rtt)
+				self.metrics.set('heartbeat_last_rtt', rtt)
+		except Exception as e:
+			if not self.heartbeat_stop.is_set():
+				self.log.error("Heartbeat consumer failed: %s", e)
+
+	def _heartbeatLoop(self):
+		interval = self.config['hearbeat_packet_interval']
+		timeout  = self.config['hearbeat_packet_timeout']
+		while not self.heartbeat_stop.wait(min(interval, timeout) / 4):
+			now = time.monotonic()
+			with self.probe_lock:
+				waiting = self.probe_outstanding is not None
+				age     = now - self.last_hearbeat_sent
+				if not waiting and age >= interval:
+					self.probe_seq += 1
+					self.probe_outstanding  = self.probe_seq
+					self.last_hearbeat_sent = now
+				seq = self.probe_outstanding
+
+			if waiting and age > timeout:
+				self._heartbeatFailed("No response to heartbeat probe in %0.1f seconds" % age)
+				return
+			if not waiting and age >= interval:
+				try:
+					self.probe_tx_channel.basic_publish(exchange=self.keepalive_exchange_name, routing_key=self.probe_queue, body=str(seq).encode("ascii"))
+				except Exception as e:
+					self._heartbeatFailed("Sending heartbeat probe failed: %s" % e)
+					return
+
+	def _heartbeatFailed(self, reason):
+		if self.heartbeat_stop.is_set():
+			return
+		self.log.error("%s! Dropping the connection.", reason)
+		self.heartbeat_failed = reason
+		self.metrics.incr(heartbeat_timeouts=1)
+		self.tx_event.set()
+		# The interface thread may be blocked on the dead socket, and closing
+		# it is the only way to wake it up. poll() raises once it's back.
+		self._releaseConnection(broken=True)
+
+	def _releaseConnection(self, broken=False):
+		'''
+		Give up this manager's hold on the connection. A shared connection
+		is only released back to the pool (after closing our channels on
+		it), as other connectors may still be using it. The pool closes it
+		once the last of them lets go. Only the first call does anything.
+		'''
+		with self.probe_lock:
+			if self.released or not self.connection:
+				return
+			self.released = True
+
+		if not self.config['share_connection']:
+			try:
+				self.connection.close()
+			except Exception as e:
+				self.log.error("Error closing connection: %s", e)
+			return
+
+		for chan in [self.channel, self.probe_tx_channel, self.probe_channel] + [consumer.channel for consumer in self.consumers]:
+			if chan:
+				try:
+					chan.close()
+				except Exception as e:
+					self.log.error("Error closing channel: %s", e)
+		connpool.get_pool().release(self.connection, broken=broken)
+
+	def _declareTaskQueue(self, shard):
+		# RabbitMQ refuses to redeclare an existing queue with different
+		# arguments, so max_priority has to match however the queue was
+		# first declared.
+		queue_name = sharding.shard_queue_name(self.config['task_queue_name'], shard)
+		arguments  = {'x-max-priority' : self.config['max_priority']} if self.config['max_priority'] else None
+		self.declarer.queue(queue_name, durable=self.config['durable'], arguments=arguments)
+		self.declarer.bind( queue_name, self.config['task_exchange'], sharding.shard_routing_key(self.config['task_queue_name'], shard), durable=self.config['durable'])
+		self.log.info("Binding queue %s to exchange %s.", queue_name, self.config['task_exchange'])
+
+	def _declareShards(self):
+		'''
+		Declare every task queue shard from the master, so tasks routed to a
+		shard no worker has claimed yet wait there rather than being dropped.
+		'''
+		for shard in range(self.config['task_shards']):
+			self._declareTaskQueue(shard)
+		self.declared_shards = self.config['task_shards']
+
+	def _wantedShards(self):
+		if self.config['master']:
+			return []
+		shards = self.config['consume_shards']
+		if shards is None:
+			shards = range(self.config['task_shards'])
+		return list(shards)
+
+	def _wantedQueues(self, shards):
+		if self.config['master']:
+			return [self.config['response_queue_name']]
+		return [sharding.shard_queue_name(self.config['task_queue_name'], shard) for shard in shards]
+
+	def _restartConsumers(self, shards):
+		'''
+		Move the consumers over to a new set of queues. Anything delivered
+		on the old channels and not acked yet is redelivered by the broker.
+		'''
+		wanted = self._wantedQueues(shards)
+		self.log.info("Consumed queues changed from %s to %s. Restarting consumers.", self.in_queues, wanted)
+		self._stopConsuming()
+		for consumer in self.consumers:
+			try:
+				consumer.channel.close()
+			except Exception as e:
+				self.log.error("Error closing channel: %s", e)
+		self.in_shards = shards
+		self.in_queues = wanted
+		for shard in shards:
+			self._declareTaskQueue(shard)
+		self._startConsumers()
 
 	def poll(self):
 		'''
@@ -229,7 +521,9 @@ class ConnectorManager:
 		Received messages are ack-ed, and then placed into the appropriate local queue.
 		messages in the outgoing queue are transmitted.
 
-		NOTE: Maximum throughput is 4 messages-second, limited by the internal poll-rate.
+		The loop sleeps on `tx_event`, which `Connector.putMessage()` sets, so
+		outgoing messages are published as soon as they're queued. `poll_rate`
+		is only the idle heartbeat interval when nothing is being sent.
 		'''
 
 		# _connect() is called in _poll_proxy before _poll is called, so
@@ -245,15 +539,35 @@ class ConnectorManager:
 
 		# When run is false, don't halt until
 		# we've flushed the outgoing items out the queue
-		while self.runstate.value or self.response_queue.qsize():
+		while self.runstate.value or self.response_queue.qsize() or self.ack_queue.qsize():
 
 			if not connected:
 				self._connect()
 				connected = True
 
-			time.sleep(loop_delay)
+			# Clear before draining, so a put that lands while we're
+			# publishing re-arms the event rather than being missed.
+			self.tx_event.wait(loop_delay)
+			self.tx_event.clear()
 
+			if self.heartbeat_failed:
+				raise Heartbeat_Timeout_Exception(self.heartbeat_failed)
+
+			# Snapshot the pending acks before publishing, so any response
+			# that was put before its task was acked goes out first.
+			acks = self.ack_queue.get_many(sys.maxsize)
 			self._publishOutgoing()
+			if acks:
+				self._processAcks(acks)
+			self.reassembler.expire()
+			self._tunePrefetch()
+			self._updateGauges()
+			self.established = True
+
+			if not self.config['master']:
+				wanted = self._wantedShards()
+				if wanted != self.in_shards:
+					self._restartConsumers(wanted)
 			# Reset the print integrator.
 			if integrator > 5:
 				integrator = 0
@@ -262,49 +576,327 @@ class ConnectorManager:
 		self.log.info("AMQP Thread Exiting")
 		self.close()
 
-	def close(self):
-		# Stop the flow of new items
-		self.channel.basic_qos(
-				prefetch_size  = 0,
-				prefetch_count = 0,
-				global_flag    = False
-			)
+	def _tunePrefetch(self):
+		if not self.tuner:
+			return
+		window = self.tuner.update(self.metrics)
+		if window is None:
+			return
+		self.prefetch = window
+		# Each rx thread applies it before handling its next delivery.
+		for consumer in self.consumers:
+			consumer.next_prefetch = window
+		if self.config['rx_buffer_size'] is None:
+			# Wake the rx threads, so a bigger window is used straight away.
+			with self.task_queue.not_full:
+				self.rx_buffer_size = window
+				self.task_queue.not_full.notify_all()
+
+	def _updateGauges(self):
+		self.metrics.tick()
+		self.metrics.set('prefetch',        self.prefetch)
+		self.metrics.set('unconfirmed',     len(self.unconfirmed))
+		self.metrics.set('active',          self.active)
+		self.metrics.set('session_fetched', self.session_fetched)
+
+	def close(self, broken=False):
+		'''
+		Tear down the interface. `broken` flags the connection as dead, so a
+		pooled connection is not handed out again.
+		'''
+		if self.closed:
+			return
+		self.closed = True
+		self.heartbeat_stop.set()
+
+		if broken:
+			self._salvageOutgoing()
+			# The broker may have restarted, or lost something we skipped
+			# declaring, so don't trust the cache for it any more.
+			topology.get_cache().forget(topology.TopologyCache.key(self.config), durable=not self.established)
 
-		# Close the connection once it's empty.
 		try:
-			self.in_q.stop_consuming()
-			self.connection.close()
-		except rabbitpy.exceptions.RabbitpyException as e:
-			# We don't really care about exceptions on teardown
-			self.log.error("Error on interface teardown!")
-			self.log.error("	%s", e)
-			# for line in traceback.format_exc().split('\n'):
-			# 	self.log.error(line)
+			# Stop the flow of new items, and close the connection once it's empty.
+			self._stopConsuming()
 
+			self._releaseConnection(broken)
+		finally:
+			# Always free the slot, so the next manager can connect.
+			self.active_connections.value = 0
 		self.log.info("AMQP Thread exited")
 
-	def _processReceiving(self):
-		for item in self.in_q:
+	def _salvageOutgoing(self):
+		'''
+		Put everything the broker hasn't confirmed back at the head of the
+		outgoing queue, so the next connection republishes it.
+
+		With publisher confirms, that's every unconfirmed message (some of
+		which the broker may have taken, so they can be published twice).
+		Without them, only a publish that failed part way can be recovered.
+		'''
+		outbox = list(self.unconfirmed.values())
+		if self.publishing is not None and self.publishing not in outbox:
+			outbox.append(self.publishing)
+		self.unconfirmed.clear()
+		self.publishing = None
+		if outbox:
+			self.log.warning("Requeueing %s unconfirmed message(s) for republishing.", len(outbox))
+			self.response_queue.put_front(outbox)
+			self.metrics.incr(republished=len(outbox))
+
+	def _stopConsuming(self):
+		channels = [consumer.channel for consumer in self.consumers]
+		if self.probe_channel:
+			channels.append(self.probe_channel)
+		for chan in channels:
+			try:
+				chan.stop_consuming()
+			except Exception as e:
+				# We don't really care about exceptions on teardown
+				self.log.error("Error on interface teardown!")
+				self.log.error("	%s", e)
+
+	def channelStats(self):
+		'''
+		Per consuming channel counters.
+		'''
+		with self.active_lock:
+			return [consumer.stats() for consumer in self.consumers]
+
+	def _applyPrefetch(self, consumer):
+		window = consumer.next_prefetch
+		if window != consumer.prefetch:
+			consumer.channel.basic_qos(window)
+			consumer.prefetch = window
+
+	def _processReceiving(self, consumer):
+		for item in consumer.consumer:
 			# Prevent never breaking from the loop if the feeding queue is backed up.
 
 			if item:
-				self.log.info("Received packet from queue '%s'! Processing.", self.in_queue)
-				self.task_queue.put(item.body)
-				self.recv_messages += 1
+				self._applyPrefetch(consumer)
+				self.log.info("Received packet from queue '%s'! Processing.", consumer.queue)
+				self.metrics.incr(received=1, received_bytes=len(item.body))
+				try:
+					body, properties = compression.decompress(item.body, item.properties)
+					transfer_id = chunking.transfer_id(properties)
+					if transfer_id:
+						done = self.reassembler.add(transfer_id, properties, body)
+				except Exception as e:
+					self._rejectUndecodable(consumer, item, e)
+					continue
+				if transfer_id:
+					self._settleEarly(consumer, item)
+					if not done:
+						continue
+					body, properties, nbytes = done
+					# Chunks are only checked once the whole transfer is in,
+					# as dropping some of them would just strand the rest.
+					if is_expired(properties):
+						self.metrics.incr(expired=1, expired_bytes=nbytes)
+						body.close()
+						continue
+					delivery = Delivery(body, properties, item.delivery_tag, item.redelivered, consumer.channel, nbytes=nbytes)
+					# The chunks were acked as they were spooled, so there's nothing
+					# left to send, but deferred-ack users still expect to settle it.
+					delivery.settled = not self.deferred_acks
+				elif is_expired(properties):
+					# Nobody is waiting for the result any more. Drop it before
+					# it takes up room in the task queue.
+					self.metrics.incr(expired=1, expired_bytes=len(item.body))
+					self._settleEarly(consumer, item, None if self.config['expired_action'] == 'drop' else False)
+					continue
+				else:
+					nbytes = len(body)
+					try:
+						body = serializers.loads(body, properties, self.config['accept_content'], self.config['memoryview_bodies'])
+					except Exception as e:
+						self._rejectUndecodable(consumer, item, e)
+						continue
+					if self.deferred_acks:
+						with self.active_lock:
+							consumer.unacked[item.delivery_tag] = False
+						delivery = Delivery(body, properties, item.delivery_tag, item.redelivered, consumer.channel, self.ack_queue, self.tx_event, nbytes=nbytes)
+					else:
+						delivery = Delivery(body, properties, item.delivery_tag, item.redelivered, consumer.channel, nbytes=nbytes)
+				if not self._queueDelivery(consumer, delivery):
+					if not self.no_ack and not transfer_id:
+						# The broker has requeued it with the channel, so queueing
+						# it would process it twice (and the ack can't go out).
+						self.log.info("Channel closed while waiting for room. Dropping delivery %s.", item.delivery_tag)
+						break
+					# Chunks were acked already, and with no_ack nothing is
+					# requeued, so those are still handed over.
+					self.task_queue.put(delivery)
 
 				with self.active_lock:
-					self.active += 1
+					self.recv_messages   += 1
+					self.active          += 1
+					self.session_fetched += 1
+					consumer.received    += 1
 
-				self.session_fetched += 1
-				item.ack()
+				if not self.no_ack and not self.deferred_acks and not transfer_id:
+					item.ack()
 
-				while self.task_queue.qsize() > self.config['prefetch']:
-					time.sleep(1)
+				if not self._waitForRoom(consumer):
+					break
 
 				if self.atFetchLimit():
 					self.log.info("Session fetch limit reached. Not fetching any additional content.")
+					self._stopConsuming()
+					break
+
+
+	def _rejectUndecodable(self, consumer, item, e):
+		'''
+		A corrupt body, malformed chunk headers or a body that doesn't match
+		its content_type. Redelivering it won't help, so reject it
+		(dead-lettering it, if the queue has a dead letter exchange) and
+		carry on with the next one.
+		'''
+		self.log.error("Failed to decode message %s from queue '%s' (%s: %s)! Rejecting it.",
+			item.delivery_tag, consumer.queue, type(e).__name__, e)
+		self.metrics.incr(rejected=1, rejected_bytes=len(item.body))
+		self._settleEarly(consumer, item, False)
+
+	def _settleEarly(self, consumer, item, requeue=None):
+		'''
+		Settle a message that never reaches the task queue: a chunk once it's
+		been spooled (chunks are never held unacked, as a large transfer can
+		be many times the prefetch window), an expired task, or one that
+		couldn't be decoded. `requeue` is
+		as for `Delivery._settle()`: None acks, otherwise nacks.
+		'''
+		if self.no_ack:
+			return
+		if not self.deferred_acks:
+			if requeue is None:
+				item.ack()
+			else:
+				item.nack(requeue=requeue)
+			return
+		with self.active_lock:
+			consumer.unacked[item.delivery_tag] = False
+		Delivery(b'', item.properties, item.delivery_tag, item.redelivered, consumer.channel, self.ack_queue, self.tx_event)._settle(requeue)
+
+	def _processAcks(self, acks):
+		'''
+		Send the acks and nacks the application has queued up through
+		`Delivery.ack()`/`nack()`.
+
+		Nacks go out individually. Acks are coalesced: the run of acked
+		tags at the head of the unacked window is settled with a single
+		`multiple=True` ack, and anything acked behind a still-outstanding
+		delivery is acked on its own, so it doesn't hold a prefetch slot.
+		'''
+		by_channel = {id(consumer.channel) : consumer for consumer in self.consumers}
+		touched = []
+
+		now = time.monotonic()
+		self.metrics.observe(self.metrics.task_duration, *[now - delivery.handed_at for delivery, _ in acks if delivery.handed_at is not None])
+
+		with self.active_lock:
+			for delivery, requeue in acks:
+				consumer = by_channel.get(id(delivery.channel))
+				if consumer is None or delivery.delivery_tag not in consumer.unacked:
+					# Delivered on a previous connection. The broker has
+					# already requeued it, so there's nothing to settle.
+					self.log.warning("Dropping settle for stale delivery %s.", delivery.delivery_tag)
+					continue
+				if requeue is None:
+					consumer.unacked[delivery.delivery_tag] = True
+					if consumer not in touched:
+						touched.append(consumer)
+				else:
+					del consumer.unacked[delivery.delivery_tag]
+					consumer.channel.basic_nack(delivery.delivery_tag, requeue=requeue)
+					consumer.nacked += 1
+
+			for consumer in touched:
+				self._flushAcks(consumer)
+
+	def _flushAcks(self, consumer):
+		head = None
+		for tag, done in consumer.unacked.items():
+			if not done:
+				break
+			head = tag
+
+		if head is not None:
+			while consumer.unacked:
+				tag, done = consumer.unacked.popitem(last=False)
+				consumer.acked += 1
+				if tag == head:
 					break
+			consumer.channel.basic_ack(head, multiple=True)
+			consumer.ack_frames += 1
+
+		stragglers = [tag for tag, done in consumer.unacked.items() if done]
+		for tag in stragglers:
+			del consumer.unacked[tag]
+			consumer.channel.basic_ack(tag)
+			consumer.ack_frames += 1
+			consumer.acked      += 1
 
+	def _queueDelivery(self, consumer, delivery):
+		'''
+		Queue `delivery` for the application once it fits within
+		max_buffered_bytes_in (or, for one bigger than the whole budget, once
+		the task queue is empty). The room is checked and taken under the
+		queue's lock, so with several consumer_channels the rx threads can't
+		all squeeze into the same gap and overshoot the budget.
+
+		Returns False, without queueing it, if `consumer`'s channel was torn
+		down in the meantime.
+		'''
+		limit = self.config['max_buffered_bytes_in']
+		if limit is None:
+			self.task_queue.put(delivery)
+			return True
+		gone = lambda: self._consumerGone(consumer)
+		queued = self._waitFor(consumer, lambda timeout: self.task_queue.put_within(delivery, limit, timeout, gone))
+		if queued is None:
+			# Shutting down with the channel still up. Hand it over anyway,
+			# as before the budget applied.
+			self.task_queue.put(delivery)
+			return True
+		return queued
+
+	def _waitForRoom(self, consumer):
+		'''
+		Block consumption until the application has drained the local task
+		queue back under the message limit.
+
+		Returns False if `consumer`'s channel was torn down in the meantime
+		(the manager closed, or the consumers restarted), in which case the
+		rx thread should stop.
+		'''
+		done = self._waitFor(consumer, lambda timeout: self.task_queue.wait_for_room(max_items=self.rx_buffer_size, timeout=timeout))
+		return done is not False
+
+	def _waitFor(self, consumer, attempt):
+		'''
+		Retry `attempt(timeout)` until it returns True. Wakes as soon as
+		something is fetched, and periodically to check for shutdown.
+
+		Returns True once it succeeds, False if `consumer`'s channel is torn
+		down first, or None if the connector stopped first.
+		'''
+		if attempt(0):
+			return True
+		started = time.monotonic()
+		done = None
+		while self.runstate.value and not self._consumerGone(consumer):
+			if attempt(self.config['poll_rate']):
+				done = True
+				break
+		self.metrics.incr(rx_paused_seconds=time.monotonic() - started)
+		if done:
+			return True
+		return False if self._consumerGone(consumer) else None
+
+	def _consumerGone(self, consumer):
+		return self.closed or consumer not in self.consumers
 
 	def _publishOutgoing(self):
 		if self.config['master']:
@@ -314,21 +906,93 @@ class ConnectorManager:
 			out_queue = self.config['response_exchange']
 			out_key   = self.config['response_queue_name'].split(".")[0]
 
+		if self.config['master'] and self.declared_shards < self.config['task_shards'] > 1:
+			self._declareShards()
+
+		sent = []
 		while 1:
 			try:
 				put = self.response_queue.get_nowait()
-				# self.log.info("Publishing message of len '%0.3f'K to exchange '%s'", len(put)/1024, out_queue)
-				# message = amqp.basic_message.Message(body=put)
-				self.sent_messages += 1
-				msg_prop = {}
-				if self.config['durable']:
-					msg_prop["delivery_mode"] = 2
-				self.channel.basic_publish(body=put, exchange=out_queue, routing_key=out_key, properties=msg_prop)
+			except queue.Empty:
+				break
+
+			# self.log.info("Publishing message of len '%0.3f'K to exchange '%s'", len(put)/1024, out_queue)
+			self.publishing = put
+			self._publishMessage(put, out_queue, put.routing_key or out_key)
+			self.publishing = None
+			if not self.config['publisher_confirms']:
+				sent.append(put)
+				if len(sent) >= 100:
+					self.response_queue.published(sent)
+					sent = []
+
+			# Keep at most confirm_window messages in flight.
+			if self.config['publisher_confirms']:
+				while len(self.unconfirmed) >= self.config['confirm_window']:
+					self._processConfirm()
+
+		if sent:
+			self.response_queue.published(sent)
+
+		# Don't return until everything in this batch has been settled, so
+		# stop() can't exit with messages the broker never took.
+		if self.config['publisher_confirms']:
+			while self.unconfirmed:
+				self._processConfirm()
+
+	def _publishMessage(self, put, out_queue, out_key):
+		msg_prop = dict(put.properties)
+		if self.config['durable']:
+			msg_prop["delivery_mode"] = 2
+		put.sent_at = time.monotonic()
+		self.channel.basic_publish(body=put.body, exchange=out_queue, routing_key=out_key, properties=msg_prop)
+		self.sent_messages += 1
+		self.metrics.incr(published=1, published_bytes=len(put))
+		self.metrics.observe(self.metrics.tx_dwell, put.sent_at - put.queued_at)
+
+		if self.config['publisher_confirms']:
+			self.publish_seq += 1
+			self.unconfirmed[self.publish_seq] = put
+		else:
+			# Without confirms, all we can time is handing it to the socket.
+			self.metrics.observe(self.metrics.publish_latency, time.monotonic() - put.sent_at)
+			with self.active_lock:
+				self.active -= 1
+
+	def _processConfirm(self):
+		'''
+		Block for one Basic.Ack or Basic.Nack from the broker, and settle the
+		in-flight messages it covers. Nacked messages are put back on the
+		outgoing queue to be retried.
+		'''
+		acked, tag, multiple = self.channel.wait_for_confirm()
+
+		if multiple:
+			settled = []
+			for seq in self.unconfirmed:
+				if seq > tag:
+					break
+				settled.append(seq)
+		else:
+			settled = [tag] if tag in self.unconfirmed else []
+
+		now = time.monotonic()
+		puts = [self.unconfirmed.pop(seq) for seq in settled]
+		for put in puts:
+			if not acked:
+				self.nacked_messages += 1
+				self.response_queue.put(put)
+				self.tx_event.set()
+			else:
 				with self.active_lock:
 					self.active -= 1
 
-			except queue.Empty:
-				break
+		if acked:
+			self.response_queue.published(puts)
+			self.metrics.observe(self.metrics.publish_latency, *[now - put.sent_at for put in puts])
+		else:
+			self.metrics.incr(publish_nacks=len(puts))
+			self.log.warning("Broker nacked %s message(s). Requeueing for retry.", len(settled))
 
 	def atFetchLimit(self):
 		'''
@@ -343,7 +1007,15 @@ class ConnectorManager:
 
 
 
-def run_fetcher(config, runstate, tx_q, rx_q):
+def _reconnect_delay(config, attempt):
+	'''
+	Exponential backoff with jitter: somewhere between half and all of
+	reconnect_delay * 2^(attempt - 1), capped at reconnect_max_delay.
+	'''
+	delay = min(config['reconnect_max_delay'], config['reconnect_delay'] * 2 ** (attempt - 1))
+	return random.uniform(delay / 2, delay)
+
+def run_fetcher(config, runstate, task_q, response_q, tx_event, ack_q, stats):
 	'''
 	bleh
 
@@ -354,30 +1026,75 @@ def run_fetcher(config, runstate, tx_q, rx_q):
 
 	log = logging.getLogger("Main.Connector.Manager")
 
+	# Partially received chunked transfers. Their chunks have already been
+	# acked, so this has to outlive reconnections.
+	reassembler = chunking.Reassembler(config['chunk_spool_size'], config['chunk_timeout'])
+
+	tuner = None
+	if config['adaptive_prefetch']:
+		tuner = prefetch.PrefetchTuner(config['prefetch'], config['prefetch_min'], config['prefetch_max'], config['prefetch_tune_interval'])
+
 	log.info("Worker thread starting up.")
 	connection = False
-	while runstate.value != 0:
+	attempt    = 0
+	failed_at  = None
+	unsent     = None
+
+	# Once stopped, keep trying for a little while if there are still
+	# responses to flush.
+	while runstate.value != 0 or (response_q.qsize() and attempt < config['reconnect_attempts_on_stop']):
+		if runstate.value == 0:
+			# Give up once a reconnection gets nothing more out.
+			if unsent is not None and response_q.qsize() >= unsent:
+				break
+			unsent = response_q.qsize()
 		try:
 			if connection is False:
-				connection = ConnectorManager(config, runstate, active, tx_q, rx_q)
+				connection = ConnectorManager(config, runstate, active, task_q, response_q, tx_event, ack_q, reassembler, stats, tuner)
+				if failed_at is not None:
+					duration = time.monotonic() - failed_at
+					stats.observe(stats.reconnect_duration, duration)
+					log.info("Reconnected after %0.2f seconds.", duration)
+				attempt   = 0
+				failed_at = None
 			connection.poll()
+			# poll() only returns once stopped and flushed, and the manager
+			# has closed itself by then.
+			break
 
 		except Exception:
 			log.error("Exception in connector! Terminating connection...")
 			for line in traceback.format_exc().split('\n'):
 				log.error(line)
 			try:
-				del connection
+				if connection:
+					connection.close(broken=True)
 			except Exception:
 				log.info("")
 				log.error("Failed pre-emptive closing before reconnection. May not be a problem?")
 				for line in traceback.format_exc().split('\n'):
 					log.error(line)
-			if runstate.value != 0:
-				connection = False
-				log.error("Triggering reconnection...")
+			connection = False
+			active.value = 0
+
+			if failed_at is None:
+				failed_at = time.monotonic()
+			attempt += 1
+			stats.incr(reconnects=1)
+
+			delay = _reconnect_delay(config, attempt)
+			log.error("Triggering reconnection in %0.2f seconds (attempt %s)...", delay, attempt)
+			# Sleep in slices, so a stop() doesn't wait out the whole delay.
+			deadline = time.monotonic() + delay
+			was_running = runstate.value
+			while time.monotonic() < deadline and runstate.value == was_running:
+				time.sleep(min(config['poll_rate'], max(0, deadline - time.monotonic())))
 
+	if response_q.qsize():
+		log.error("Worker thread exiting with %s unsent message(s)!", response_q.qsize())
 
+
+	reassembler.close()
 	log.info("")
 	log.info("Worker thread has terminated.")
 	log.info("")
@@ -414,9 +1131,106 @@ class Connector:
 			'durable'                  : kwargs.get('durable',                  False),
 			'socket_timeout'           : kwargs.get('socket_timeout',            10),
 
-			'hearbeat_packet_interval' : kwargs.get('hearbeat_packet_interval',  10),
+			# Liveness probe interval and timeout, in seconds. A probe that
+			# isn't answered in time forces a reconnect. Probing is off unless
+			# an interval is given.
+			'hearbeat_packet_interval' : kwargs.get('hearbeat_packet_interval',  None),
 			'hearbeat_packet_timeout'  : kwargs.get('hearbeat_packet_timeout',  120),
 			'ack_rx'                   : kwargs.get('ack_rx',                   True),
+
+			'publisher_confirms'       : kwargs.get('publisher_confirms',       False),
+			'confirm_window'           : kwargs.get('confirm_window',           256),
+
+			'transport'                : kwargs.get('transport',                'rabbitpy'),
+
+			# Max messages held in the local task queue before consumption pauses.
+			'rx_buffer_size'           : kwargs.get('rx_buffer_size',           None),
+
+			# Memory budgets for the local queues, in payload bytes. Consumption
+			# pauses rather than take the task queue over max_buffered_bytes_in,
+			# and putMessage() blocks rather than take the outgoing queue over
+			# max_buffered_bytes_out. None for no limit. rx_buffer_bytes is the
+			# old name of max_buffered_bytes_in.
+			'max_buffered_bytes_in'    : kwargs.get('max_buffered_bytes_in',    kwargs.get('rx_buffer_bytes', None)),
+			'max_buffered_bytes_out'   : kwargs.get('max_buffered_bytes_out',   None),
+
+			# 'receive' acks on arrival. 'manual' and 'response' defer the ack
+			# until the application settles the Delivery (see delivery.py).
+			'ack_mode'                 : kwargs.get('ack_mode',                 'receive'),
+
+			# Number of channels (each with its own prefetch window and rx thread) to consume on.
+			'consumer_channels'        : kwargs.get('consumer_channels',        1),
+
+			# Share one broker connection with other Connectors in this process
+			# that use the same connection parameters (see connpool.py).
+			'share_connection'         : kwargs.get('share_connection',         False),
+
+			# Compress outgoing bodies of at least compression_threshold bytes
+			# with 'zlib', 'bz2' or 'lzma'. Received bodies are always decompressed.
+			'compression'              : kwargs.get('compression',              None),
+			'compression_threshold'    : kwargs.get('compression_threshold',    1024),
+			'compression_level'        : kwargs.get('compression_level',        None),
+
+			# Default serializer for outgoing messages ('raw', 'json', 'pickle',
+			# 'marshal'), recorded in content_type. Received messages are decoded
+			# by their content_type, if it's listed in accept_content.
+			'serializer'               : kwargs.get('serializer',               None),
+			'accept_content'           : kwargs.get('accept_content',           serializers.DEFAULT_ACCEPT),
+
+			# Hand out undecoded bodies as memoryviews, so they can be sliced without copying.
+			'memoryview_bodies'        : kwargs.get('memoryview_bodies',        False),
+
+			# Split outgoing payloads larger than chunk_size bytes into a
+			# sequence of chunk messages (workers only). Received transfers are
+			# reassembled into a temp file (in memory up to chunk_spool_size
+			# bytes), and dropped if no chunk arrives for chunk_timeout seconds.
+			'chunk_size'               : kwargs.get('chunk_size',               None),
+			'chunk_spool_size'         : kwargs.get('chunk_spool_size',         16 * 1024 * 1024),
+			'chunk_timeout'            : kwargs.get('chunk_timeout',            600),
+
+			# Serve stats() in the Prometheus text format on this port (see metrics.py).
+			'metrics_port'             : kwargs.get('metrics_port',             None),
+			'metrics_host'             : kwargs.get('metrics_host',             '127.0.0.1'),
+
+			# Reconnect backoff, in seconds. Doubles per failed attempt, with jitter.
+			'reconnect_delay'          : kwargs.get('reconnect_delay',          0.5),
+			'reconnect_max_delay'      : kwargs.get('reconnect_max_delay',      30),
+			# Reconnect attempts made after stop() to flush unsent messages.
+			'reconnect_attempts_on_stop' : kwargs.get('reconnect_attempts_on_stop', 3),
+
+			# Keep at most spool_max_items (and spool_max_bytes) outgoing messages
+			# in memory, and spool the rest to segment files in spool_dir (see spool.py).
+			'spool_dir'                : kwargs.get('spool_dir',                None),
+			'spool_max_items'          : kwargs.get('spool_max_items',          10000),
+			'spool_max_bytes'          : kwargs.get('spool_max_bytes',          None),
+			'spool_segment_size'       : kwargs.get('spool_segment_size',       64 * 1024 * 1024),
+
+			# Spread tasks over this many task queues (see sharding.py). Workers
+			# consume the shards listed in consume_shards, or all of them if None.
+			'task_shards'              : kwargs.get('task_shards',              1),
+			'consume_shards'           : kwargs.get('consume_shards',           None),
+
+			# Declare the task queues as priority queues (x-max-priority), with
+			# priorities 0 to max_priority. None for plain FIFO queues.
+			'max_priority'             : kwargs.get('max_priority',             None),
+
+			# Skip declaring exchanges, queues and bindings this process has
+			# already declared on the broker within this many seconds. 0 or
+			# None to always declare everything.
+			'topology_cache_ttl'       : kwargs.get('topology_cache_ttl',       300),
+
+			# What to do with received tasks whose deadline (see putMessage's
+			# ttl) has passed: 'drop' acks them, 'dead_letter' rejects them
+			# without requeueing, so a queue with a dead letter exchange keeps them.
+			'expired_action'           : kwargs.get('expired_action',           'drop'),
+
+			# Tune the prefetch window at runtime, between prefetch_min and
+			# prefetch_max, from the measured task rate, task duration and
+			# broker round trip (see prefetch.py). `prefetch` is the starting point.
+			'adaptive_prefetch'        : kwargs.get('adaptive_prefetch',        False),
+			'prefetch_min'             : kwargs.get('prefetch_min',             1),
+			'prefetch_max'             : kwargs.get('prefetch_max',             1000),
+			'prefetch_tune_interval'   : kwargs.get('prefetch_tune_interval',   1.0),
 		}
 
 		self.log.info("Fetch limit: '%s'", config['session_fetch_limit'])
@@ -431,16 +1245,56 @@ class Connector:
 		assert     config['task_exchange'].endswith(".e") is True
 		assert config['response_exchange'].endswith(".e") is True
 
+		self.compression = compression.get_encoding(config['compression'])
+		self.serializer  = serializers.get_content_type(config['serializer'])
+		config['accept_content'] = frozenset(serializers.get_content_type(tmp) for tmp in config['accept_content'])
+
+		if config['chunk_size'] is not None and config['chunk_size'] < 1:
+			raise ValueError("chunk_size must be at least 1!")
+		if config['chunk_size'] is not None and config['master']:
+			# The task queue is shared by every worker, so the broker would
+			# spread a transfer's chunks over them, and none could reassemble it.
+			raise ValueError("chunk_size is only supported on workers, as chunked tasks would be split across them!")
+		if config['task_shards'] < 1:
+			raise ValueError("There must be at least one task shard!")
+		if config['consume_shards'] is not None:
+			config['consume_shards'] = sorted(set(config['consume_shards']))
+		self._checkShardExchange(config, config['task_shards'], config['consume_shards'])
+		self.router = sharding.ShardRouter(config['task_queue_name'], config['task_shards']) if config['master'] else None
+
+		for key in ('max_buffered_bytes_in', 'max_buffered_bytes_out'):
+			if config[key] is not None and config[key] < 1:
+				raise ValueError("%s must be at least 1!" % (key, ))
+
+		if config['max_priority'] is not None and not 1 <= config['max_priority'] <= 255:
+			raise ValueError("max_priority must be between 1 and 255!")
+
+		if config['consumer_channels'] < 1:
+			raise ValueError("consumer_channels must be at least 1!")
+		if config['ack_mode'] not in ('receive', 'manual', 'response'):
+			raise ValueError("Invalid ack_mode: '%s'" % (config['ack_mode'], ))
+		if config['adaptive_prefetch'] and not 1 <= config['prefetch_min'] <= config['prefetch_max']:
+			raise ValueError("Prefetch bounds must satisfy 1 <= prefetch_min <= prefetch_max!")
+		if config['expired_action'] not in ('drop', 'dead_letter'):
+			raise ValueError("Invalid expired_action: '%s'" % (config['expired_action'], ))
+		if config['ack_mode'] != 'receive' and not config['ack_rx']:
+			raise ValueError("Deferred acks (ack_mode='%s') require ack_rx!" % (config['ack_mode'], ))
+
 		# Patch in the port number to the host name if it's not present.
 		# This is really clumsy, but you can't explicitly specify the port
 		# in the amqp library
 		if not ":" in config['host']:
-			if config['ssl']:
+			if config['sslopts']:
 				config['host'] += ":5671"
 			else:
 				config['host'] += ":5672"
 
 		self.session_fetch_limit = config['session_fetch_limit']
+		self.prefetch            = config['prefetch']
+		self.poll_rate           = config['poll_rate']
+		self.master              = config['master']
+		self.max_priority        = config['max_priority']
+		self.expired_action      = config['expired_action']
 		self.queue_fetched       = 0
 		self.queue_put           = 0
 
@@ -448,23 +1302,72 @@ class Connector:
 		# These need to be multiprocessing queues because
 		# messages can sometimes be inserted from a different process
 		# then the interface is created in.
-		self.taskQueue = queue.Queue()
-		self.responseQueue = queue.Queue()
+		self.taskQueue = self._makeTaskQueue()
+		if config['spool_dir']:
+			# Spooling never blocks the caller, so the outgoing budget caps
+			# what's kept in memory instead.
+			self.responseQueue = spool.SpoolQueue(config['spool_dir'],
+					max_items    = config['spool_max_items'],
+					max_bytes    = config['spool_max_bytes'] if config['spool_max_bytes'] is not None else config['max_buffered_bytes_out'],
+					segment_size = config['spool_segment_size'],
+				)
+		else:
+			self.responseQueue = queues.BatchQueue()
+
+		# Settled Deliveries waiting for the interface thread to ack them.
+		self.ackQueue = queues.BatchQueue()
+		self.ack_mode = config['ack_mode']
+
+		# Deliveries each thread has fetched but not settled, in fetch order.
+		# With ack_mode='response', putMessage() settles the oldest one.
+		self._fetched = threading.local()
+		# Set once a worker is handed a message with a correlation id, after
+		# which responses without one are logged as errors.
+		self.rpc_seen = False
 
 		self.runstate = multiprocessing.Value("b", 1)
 
+		# Set whenever something is put into responseQueue, so the
+		# interface thread wakes up and publishes it immediately.
+		self.txEvent = threading.Event()
+
 		self.log.info("Starting AMQP interface thread.")
 
 		self.forwarded = 0
 
+		self.metrics = metrics.Metrics()
+
 		self.thread = None
 		self.__config = config
 		self.checkLaunchThread()
 
+		self.metricsServer = None
+		if config['metrics_port'] is not None:
+			labels = {
+				'vhost' : config['virtual_host'],
+				'queue' : config['response_queue_name'] if config['master'] else config['task_queue_name'],
+			}
+			self.metricsServer = metrics.start_exporter(self.stats, labels, config['metrics_host'], config['metrics_port'])
+
+	def _makeTaskQueue(self):
+		'''
+		Build the local queue received messages are placed in. Subclasses
+		can override this to get notified of deliveries.
+
+		With priority queues, prefetched messages are handed out by
+		priority too, so a buffered backlog doesn't hold up urgent ones.
+		'''
+		if self.max_priority:
+			return queues.PriorityBatchQueue()
+		return queues.BatchQueue()
+
 	def checkLaunchThread(self):
-		if self.thread and self.thread.isAlive():
+		if self.thread and self.thread.is_alive():
+			return
+		# Don't resurrect the interface after stop().
+		if self.thread and not self.runstate.value:
 			return
-		if self.thread and not self.thread.isAlive():
+		if self.thread and not self.thread.is_alive():
 			self.thread.join()
 			self.log.error("")
 			self.log.error("")
@@ -474,7 +1377,7 @@ class Connector:
 			self.log.error("")
 			self.log.error("")
 
-		self.thread = threading.Thread(target=run_fetcher, args=(self.__config, self.runstate, self.taskQueue, self.responseQueue), daemon=False)
+		self.thread = threading.Thread(target=run_fetcher, args=(self.__config, self.runstate, self.taskQueue, self.responseQueue, self.txEvent, self.ackQueue, self.metrics), daemon=False)
 		self.thread.start()
 
 	def atQueueLimit(self):
@@ -489,43 +1392,431 @@ class Connector:
 		return self.queue_fetched >= self.session_fetch_limit
 
 
-	def getMessage(self):
+	def getMessage(self, timeout=None):
 		'''
 		Try to fetch a message from the receiving Queue.
-		Returns the method if there is one, False if there is not.
-		Non-Blocking.
+		Returns the message if there is one, None if there is not.
+
+		Non-Blocking by default. If `timeout` is given, waits up to
+		`timeout` seconds for a message to arrive.
 		'''
 		self.checkLaunchThread()
 		if self.atQueueLimit():
 			raise ValueError("Out of fetchable items!")
 
-		try:
-			put = self.taskQueue.get_nowait()
-			self.queue_fetched += 1
-			self.forwarded += 1
-			if self.forwarded >= 25:
-				self.log.info("Fetched item from proxy queue. Total received: %s, total sent: %s", self.queue_fetched, self.queue_put)
-				self.forwarded = 0
-			return put
-		except queue.Empty:
-			return None
-
-	def putMessage(self, message, synchronous=False):
+		endtime = time.monotonic() + timeout if timeout else None
+		while True:
+			try:
+				if endtime:
+					put = self.taskQueue.get(timeout=max(0, endtime - time.monotonic()))
+				else:
+					put = self.taskQueue.get_nowait()
+			except queue.Empty:
+				self.metrics.incr(rx_starved=1)
+				return None
+			if self._dropExpired([put]):
+				break
+
+		self._noteFetched(1)
+		return self._handOut([put])[0]
+
+	def getMessages(self, max_n=100, timeout=None):
+		'''
+		Fetch up to `max_n` messages from the receiving Queue in one
+		operation. Returns a (possibly empty) list.
+
+		Non-Blocking by default. If `timeout` is given, waits up to
+		`timeout` seconds for at least one message to arrive.
+		'''
+		ret = self._fetch(max_n, timeout)
+		if ret:
+			ret = self._handOut(ret)
+		return ret
+
+	def _fetch(self, max_n, timeout=None):
+		'''
+		Take up to `max_n` raw Deliveries off the receiving queue.
+		'''
+		self.checkLaunchThread()
+		if self.atQueueLimit():
+			raise ValueError("Out of fetchable items!")
+
+		if self.session_fetch_limit:
+			max_n = min(max_n, self.session_fetch_limit - self.queue_fetched)
+
+		ret = self._dropExpired(self.taskQueue.get_many(max_n, timeout=timeout or None))
+		if ret:
+			self._noteFetched(len(ret))
+		else:
+			self.metrics.incr(rx_starved=1)
+		return ret
+
+	def _dropExpired(self, deliveries):
+		'''
+		Filter out (and settle) deliveries whose deadline passed while they
+		sat in the local queue, and stamp the rest as handed out.
+		'''
+		now = time.time()
+		handed_at = time.monotonic()
+		live = []
+		for delivery in deliveries:
+			if not delivery.expired(now):
+				delivery.handed_at = handed_at
+				live.append(delivery)
+				continue
+			self.metrics.incr(expired=1, expired_bytes=delivery.nbytes)
+			if self.expired_action == 'drop':
+				delivery.ack()
+			else:
+				delivery.nack(requeue=False)
+		return live
+
+	def _noteFetched(self, count):
+		self.queue_fetched += count
+		self.forwarded += count
+		if self.forwarded >= 25:
+			self.log.info("Fetched item from proxy queue. Total received: %s, total sent: %s", self.queue_fetched, self.queue_put)
+			self.forwarded = 0
+
+	def _handOut(self, deliveries):
+		'''
+		Convert fetched deliveries to what getMessage() returns: the bare
+		body when acks happen on receive, the Delivery itself otherwise.
+		'''
+		now = time.monotonic()
+		self.metrics.observe(self.metrics.rx_dwell, *[now - tmp.received_at for tmp in deliveries])
+		if not self.master and not self.rpc_seen:
+			self.rpc_seen = any(tmp.correlation_id is not None for tmp in deliveries)
+		if self.ack_mode == 'receive':
+			return [tmp.body for tmp in deliveries]
+		if self.ack_mode == 'response':
+			pending = self._pendingDeliveries()
+			# Drop the ones the application settled itself, so this doesn't
+			# grow if it acks directly rather than through putMessage().
+			while pending and pending[0].settled:
+				pending.popleft()
+			pending.extend(deliveries)
+		return deliveries
+
+	def _pendingDeliveries(self):
+		if not hasattr(self._fetched, 'pending'):
+			self._fetched.pending = collections.deque()
+		return self._fetched.pending
+
+	def _correlationIdsFor(self, ack, count):
+		'''
+		Work out the correlation ids to echo on `count` responses. They only
+		come from an explicit `ack` Delivery (or list of them), as responses
+		needn't be published in the order their messages were fetched.
+		Masters don't echo anything.
+		'''
+		ids = []
+		if self.master:
+			pass
+		elif isinstance(ack, Delivery):
+			ids = [ack.correlation_id]
+		elif ack:
+			ids = [tmp.correlation_id for tmp in ack]
+		elif self.rpc_seen:
+			self.log.error("Publishing %s response(s) without a correlation id, but this worker has received RPC requests! "
+					"Pass the Delivery answered as `ack`, or `correlation_id`, to putMessage().", count)
+		return (ids + [None] * count)[:count]
+
+	def _settleFor(self, ack, count):
+		'''
+		Settle the deliveries a response answers. `ack` is a Delivery or a
+		list of them. If it's None with ack_mode='response', the oldest
+		`count` unsettled deliveries this thread fetched are acked.
+		'''
+		if ack is False or self.ack_mode == 'receive':
+			return
+		if isinstance(ack, Delivery):
+			ack.ack()
+			return
+		if ack is not None:
+			for delivery in ack:
+				delivery.ack()
+			return
+
+		if self.ack_mode == 'response':
+			pending = self._pendingDeliveries()
+			while pending and count:
+				if pending.popleft().ack():
+					count -= 1
+
+	def _makeOutgoing(self, message, serializer=None, correlation_id=None, shard_key=None, priority=None, ttl=None):
+		'''
+		Encode a message for the outgoing queue. This runs on the calling
+		thread, so serializing and compressing don't hold up the interface thread.
+		'''
+		content_type = serializers.get_content_type(serializer) if serializer else self.serializer
+		body, content_type = serializers.dumps(message, content_type)
+		routing_key = self.router.route(shard_key) if self.router else None
+		properties = {}
+		if content_type:
+			properties['content_type'] = content_type
+		if correlation_id:
+			properties['correlation_id'] = correlation_id
+		if priority is not None:
+			properties['priority'] = priority
+		if ttl is not None:
+			properties['headers'] = {DEADLINE : time.time() + ttl}
+		if self._isLarge(body):
+			return self._makeChunks(body, properties, routing_key)
+		if ttl is not None:
+			# Lets the broker drop it too, while it's still queued. Chunks
+			# don't get this, as the broker could drop part of a transfer.
+			properties['expiration'] = str(max(0, int(ttl * 1000)))
+		body, encoding = compression.compress(body, self.compression,
+				threshold = self.__config['compression_threshold'],
+				level     = self.__config['compression_level'],
+			)
+		if encoding:
+			properties['content_encoding'] = encoding
+		return Outgoing(body, properties, routing_key)
+
+	def _isLarge(self, body):
+		chunk_size = self.__config['chunk_size']
+		if not chunk_size:
+			return False
+		return hasattr(body, 'read') or len(body) > chunk_size
+
+	def _makeChunks(self, body, base_properties, routing_key):
+		'''
+		Lazily split a large payload into chunk messages, each with a copy of
+		`base_properties`. Chunks aren't compressed, and the receiver gets the
+		reassembled payload as a file.
+		'''
+		tid = uuid.uuid4().hex
+		for offset, chunk, is_last in chunking.iter_chunks(body, self.__config['chunk_size']):
+			properties = dict(base_properties)
+			properties['headers'] = dict(base_properties.get('headers', {}), **chunking.chunk_headers(tid, offset, chunk, is_last))
+			yield Outgoing(chunk, properties, routing_key)
+
+	def _queueOutgoing(self, outgoing):
+		'''
+		Put the output of _makeOutgoing() into the outgoing queue. Chunks are
+		fed in a few at a time, so a large payload is never queued whole.
+		'''
+		if isinstance(outgoing, Outgoing):
+			self._waitForOutRoom(len(outgoing))
+			self.responseQueue.put(outgoing)
+			return
+		window = self.__config['chunk_size'] * chunking.SEND_WINDOW
+		for chunk in outgoing:
+			if not self.responseQueue.bounded_memory:
+				self.responseQueue.wait_for_room(max_bytes=window)
+			self._waitForOutRoom(len(chunk))
+			self.responseQueue.put(chunk)
+			self.txEvent.set()
+
+	def _putMayBlock(self):
+		'''
+		Whether putMessage() can block for reasons other than `synchronous`:
+		chunked payloads are fed in a few chunks at a time, and
+		max_buffered_bytes_out waits for room.
+		'''
+		if self.__config['chunk_size']:
+			return True
+		return self.__config['max_buffered_bytes_out'] is not None and not self.responseQueue.bounded_memory
+
+	def _claimAck(self, ack=None):
+		'''
+		Resolve the Delivery a putMessage() call on this thread would settle,
+		so the publish can be handed to another thread without losing track
+		of the fetching thread's messages.
+		'''
+		if ack is None and self.ack_mode == 'response':
+			ack = False
+			pending = self._pendingDeliveries()
+			while pending:
+				delivery = pending.popleft()
+				if not delivery.settled:
+					ack = delivery
+					break
+		return ack
+
+	def _waitForOutRoom(self, nbytes):
+		'''
+		Block until `nbytes` more fit in the outgoing queue without taking it
+		over max_buffered_bytes_out. Something bigger than the whole budget
+		waits for the queue to empty instead. Spooling queues never block.
+		'''
+		budget = self.__config['max_buffered_bytes_out']
+		if budget is None or self.responseQueue.bounded_memory:
+			return
+		max_bytes = max(0, budget - nbytes)
+		if self.responseQueue.wait_for_room(max_bytes=max_bytes, timeout=0):
+			return
+		started = time.monotonic()
+		self.txEvent.set()
+		self.responseQueue.wait_for_room(max_bytes=max_bytes)
+		self.metrics.incr(tx_blocked_seconds=time.monotonic() - started)
+
+	def putMessage(self, message, synchronous=False, ack=None, serializer=None, correlation_id=None, shard_key=None, priority=None, ttl=None):
 		'''
 		Place a message into the outgoing queue.
 
 		if synchronous is true, this call will block until
 		the items in the outgoing queue are less then the
 		value of synchronous
+
+		With deferred acks, `ack` is the Delivery (or list of Deliveries)
+		this message answers, which is acked once the message has been
+		published. With ack_mode='response' it defaults to the oldest
+		unsettled Delivery this thread fetched. Pass ack=False to not ack
+		anything.
+
+		`serializer` overrides the connector's default serializer for this
+		message.
+
+		`correlation_id` is set on the published message. On workers it
+		defaults to the correlation id of the `ack` Delivery, so RPC callers
+		get their ids echoed back. Nothing else is guessed: a worker that
+		has received RPC requests logs an error for a response with neither.
+
+		On a master with `task_shards` > 1, `shard_key` picks the task shard by
+		consistent hash, so tasks with the same key go to the same shard.
+		Without one, tasks are spread round-robin.
+
+		`priority` sets the AMQP priority. It only changes the delivery order
+		on queues declared with `max_priority`.
+
+		`ttl` (seconds) gives the message a deadline. The broker drops it if
+		it's still queued by then, and the receiving connector skips it
+		(see `expired_action`) if it arrives or is fetched after it.
+
+		With `max_buffered_bytes_out` set, this blocks until the message fits
+		in the outgoing queue's memory budget.
 		'''
+		if correlation_id is None:
+			correlation_id = self._correlationIdsFor(ack, 1)[0]
+		self._putMessage(message, synchronous, ack, serializer, correlation_id, shard_key, priority, ttl)
+
+	def _putMessage(self, message, synchronous, ack, serializer, correlation_id, shard_key, priority, ttl):
 		self.checkLaunchThread()
 		if synchronous:
-			while self.responseQueue.qsize() > synchronous:
-				time.sleep(0.1)
+			self.responseQueue.wait_below(synchronous)
 		self.queue_put += 1
-		self.responseQueue.put(message)
+		self._queueOutgoing(self._makeOutgoing(message, serializer, correlation_id, shard_key, priority, ttl))
+		self._settleFor(ack, 1)
+		self.txEvent.set()
+
+	def putMessages(self, messages, synchronous=False, ack=None, serializer=None, correlation_ids=None, shard_keys=None, priority=None, ttl=None):
+		'''
+		Place every message in the iterable `messages` into the outgoing
+		queue in one operation. `synchronous` and `ack` behave as for
+		`putMessage()`, except one Delivery is settled per message.
+		`serializer`, `priority` and `ttl` apply to every message, and
+		`correlation_ids` and `shard_keys` are optional lists with one value
+		per message.
+		'''
+		self.checkLaunchThread()
+		if synchronous:
+			self.responseQueue.wait_below(synchronous)
+		messages = list(messages)
+		if correlation_ids is None:
+			correlation_ids = self._correlationIdsFor(ack, len(messages))
+		if shard_keys is None:
+			shard_keys = [None] * len(messages)
+		outgoing = [self._makeOutgoing(message, serializer, cid, key, priority, ttl) for message, cid, key in zip(messages, correlation_ids, shard_keys)]
+		if all(isinstance(tmp, Outgoing) for tmp in outgoing):
+			# The batch is queued whole, so it waits for room for all of it.
+			self._waitForOutRoom(sum(len(tmp) for tmp in outgoing))
+			count = self.responseQueue.put_many(outgoing)
+		else:
+			# Chunked payloads are fed in gradually, so queue everything in order.
+			for tmp in outgoing:
+				self._queueOutgoing(tmp)
+			count = len(outgoing)
+		self.queue_put += count
+		self._settleFor(ack, count)
+		if count:
+			self.txEvent.set()
+		return count
+
+	def serve(self, handler, processes=None, max_in_flight=None, stop_event=None):
+		'''
+		Run received messages through `handler` on a pool of worker
+		processes, publishing whatever it returns as the response.
+		Blocks until `stop_event` is set or the connector is stopped.
+
+		See `AmqpConnector.procpool.serve()` for the details.
+		'''
+		from . import procpool
+		return procpool.serve(self, handler, processes=processes, max_in_flight=max_in_flight, stop_event=stop_event)
+
+	def setTaskShards(self, shards):
+		'''
+		Change the number of task queue shards. On a master this applies to
+		every task put from now on (tasks already in the dropped shards stay
+		there until a worker consumes them). On a worker without
+		`consume_shards`, it changes the shards consumed.
+		'''
+		if shards < 1:
+			raise ValueError("There must be at least one task shard!")
+		self._checkShardExchange(self.__config, shards, self.__config['consume_shards'])
+		if self.router:
+			self.router.resize(shards)
+		self.__config['task_shards'] = shards
+		self.txEvent.set()
+
+	@staticmethod
+	def _checkShardExchange(config, task_shards, consume_shards):
+		'''
+		Shards are picked by routing key alone, so on a fanout (or topic)
+		exchange every shard queue would get a copy of every task.
+		'''
+		if config['task_exchange_type'] == 'direct':
+			return
+		# Shard 0 is the plain task queue, which works with any exchange.
+		if task_shards > 1 or any(consume_shards or ()):
+			raise ValueError("Task shards need a direct task exchange, not '%s'!" % (config['task_exchange_type'], ))
 
+	def setConsumedShards(self, shards):
+		'''
+		Change the task queue shards a worker consumes. None means all of
+		them. The interface thread switches over on its next poll.
+		'''
+		self._checkShardExchange(self.__config, self.__config['task_shards'], shards)
+		self.__config['consume_shards'] = sorted(set(shards)) if shards is not None else None
+		self.txEvent.set()
 
+	def rpcClient(self, max_in_flight=1000, timeout=None):
+		'''
+		Build an `AmqpConnector.rpc.RpcClient` on this (master) connector,
+		for submitting tasks and getting futures for their responses.
+		'''
+		from . import rpc
+		return rpc.RpcClient(self, max_in_flight=max_in_flight, timeout=timeout)
+
+	def stats(self):
+		'''
+		Snapshot of the connector's counters, rates (per second, averaged
+		over the last few seconds), local queue depths and latency
+		histograms. Histograms are dicts with count, sum, approximate p50
+		and p99, and cumulative (upper bound, count) buckets, in seconds.
+
+		`rx_dwell` is the time received messages spend in the local queue
+		before being fetched, `tx_dwell` is the time outgoing messages wait
+		to be published, and `publish_latency` is the time from publish to
+		broker confirm (or just the publish call, without publisher confirms).
+		'''
+		ret = self.metrics.snapshot()
+		ret.update({
+			'rx_queue_depth'  : self.taskQueue.qsize(),
+			'rx_queue_bytes'  : self.taskQueue.qbytes(),
+			'tx_queue_depth'  : self.responseQueue.qsize(),
+			'tx_queue_bytes'  : self.responseQueue.qbytes(),
+			'rx_budget_bytes' : self.__config['max_buffered_bytes_in'],
+			'tx_budget_bytes' : self.__config['max_buffered_bytes_out'],
+			'tx_spooled'      : self.responseQueue.spooled() if self.responseQueue.bounded_memory else 0,
+			'ack_queue_depth' : self.ackQueue.qsize(),
+			'fetched'         : self.queue_fetched,
+			'queued'          : self.queue_put,
+			'running'         : bool(self.runstate.value),
+		})
+		return ret
 
 	def stop(self):
 		'''
@@ -534,18 +1825,27 @@ class Connector:
 		'''
 		self.log.info("Stopping AMQP interface thread.")
 		self.runstate.value = 0
-		while self.responseQueue.qsize() > 0:
+		self.txEvent.set()
+		while self.responseQueue.qsize() > 0 and self.thread.is_alive():
 			self.log.info("%s remaining outgoing AMQP items.", self.responseQueue.qsize())
 			time.sleep(1)
 
 		self.log.info("%s remaining outgoing AMQP items.", self.responseQueue.qsize())
 
 		self.thread.join()
+		if self.responseQueue.bounded_memory:
+			# Whatever couldn't be published stays on disk for next time.
+			self.responseQueue.close()
+		if self.metricsServer:
+			self.metricsServer.shutdown()
+			self.metricsServer.server_close()
+			self.metricsServer = None
 		self.log.info("AMQP interface thread halted.")
 
 	def __del__(self):
 		# print("deleter: ", self.runstate, self.runstate.value)
-		if self.runstate.value:
+		# runstate is missing if __init__() rejected the config.
+		if getattr(self, 'runstate', None) and self.runstate.value:
 			self.stop()
 
 def test():
@@ -0,0 +1,139 @@
+import asyncio
+import functools
+import queue
+
+from . import Connector
+from . import queues
+
+class _WakeMixin:
+	'''
+	Makes a BatchQueue call `on_put` every time an item is added.
+	'''
+	def __init__(self, on_put):
+		super().__init__()
+		self.on_put = on_put
+
+	def _put(self, item):
+		super()._put(item)
+		self.on_put()
+
+class _WakeQueue(_WakeMixin, queues.BatchQueue):
+	pass
+
+class _PriorityWakeQueue(_WakeMixin, queues.PriorityBatchQueue):
+	pass
+
+
+class AsyncConnector(Connector):
+	'''
+	asyncio interface to the connector. Takes the same keyword arguments as
+	`Connector`, and must be constructed from inside a running event loop.
+
+		con = AsyncConnector(host=..., master=False)
+		async for task in con:
+			await con.put_message(handle(task))
+
+	The AMQP I/O still runs on the connector's interface thread (rabbitpy
+	is a blocking library), but deliveries are pushed into the event loop
+	as they arrive, so any number of coroutines can wait on one connector
+	without polling.
+	'''
+
+	def __init__(self, *args, **kwargs):
+		self.loop         = asyncio.get_running_loop()
+		self._rx_ready    = asyncio.Event()
+		self._wake_queued = False
+		self._stopped     = False
+		super().__init__(*args, **kwargs)
+
+	def _makeTaskQueue(self):
+		if self.max_priority:
+			return _PriorityWakeQueue(self._onDelivery)
+		return _WakeQueue(self._onDelivery)
+
+	def _onDelivery(self):
+		# Called on the interface thread. Only keep one wake-up in flight,
+		# so a burst of deliveries doesn't flood the loop with callbacks.
+		if not self._wake_queued:
+			self._wake_queued = True
+			self.loop.call_soon_threadsafe(self._wake)
+
+	def _wake(self):
+		self._wake_queued = False
+		self._rx_ready.set()
+
+	async def _next_message(self):
+		while True:
+			# Clear before checking, so a delivery that lands after the
+			# check still wakes us.
+			self._rx_ready.clear()
+			if self._stopped:
+				# Hand out whatever is already buffered, but don't let
+				# getMessage() relaunch the interface thread.
+				try:
+					put = self.taskQueue.get_nowait()
+					self._noteFetched(1)
+					return self._handOut([put])[0]
+				except queue.Empty:
+					return None
+			put = self.getMessage()
+			if put is not None:
+				return put
+			await self._rx_ready.wait()
+
+	async def get_message(self, timeout=None):
+		'''
+		Wait for a message from the receiving queue. Returns None if
+		`timeout` seconds pass first, or once the connector is stopped.
+		'''
+		if timeout is None:
+			return await self._next_message()
+		try:
+			return await asyncio.wait_for(self._next_message(), timeout)
+		except asyncio.TimeoutError:
+			return None
+
+	async def put_message(self, message, synchronous=False, ack=None, serializer=None, correlation_id=None, shard_key=None, priority=None, ttl=None):
+		'''
+		Place a message into the outgoing queue. Takes the same arguments
+		as `putMessage()`. Handlers that answer tasks concurrently must pass
+		the Delivery they answer as `ack` (or its `correlation_id`), as
+		that's the only thing responses are matched to.
+
+		If synchronous is set, waits (without blocking the loop) until
+		the outgoing queue is no longer than synchronous. Chunked payloads
+		and `max_buffered_bytes_out` can also make putMessage() wait, so
+		with either configured it's always run off the loop.
+		'''
+		if correlation_id is None:
+			correlation_id = self._correlationIdsFor(ack, 1)[0]
+		if synchronous or self._putMayBlock():
+			# The Delivery settled is worked out here, as putMessage()
+			# defaults to the oldest one the calling thread fetched.
+			ack = self._claimAck(ack)
+			await self.loop.run_in_executor(None, functools.partial(self._putMessage, message, synchronous,
+					ack, serializer, correlation_id, shard_key, priority, ttl))
+		else:
+			self._putMessage(message, synchronous, ack, serializer, correlation_id, shard_key, priority, ttl)
+
+	def __aiter__(self):
+		return self
+
+	async def __anext__(self):
+		put = await self._next_message()
+		if put is None:
+			raise StopAsyncIteration
+		return put
+
+	async def stop(self):
+		'''
+		Stop the connector. Pending `get_message()` calls return None, and
+		this waits (off the loop) until the outgoing queue has been flushed.
+		'''
+		self._stopped = True
+		self._rx_ready.set()
+		await self.loop.run_in_executor(None, Connector.stop, self)
+
+	def __del__(self):
+		if getattr(self, 'runstate', None) and self.runstate.value:
+			Connector.stop(self)
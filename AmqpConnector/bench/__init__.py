@@ -0,0 +1,182 @@
+'''
+Throughput and round-trip latency benchmarks for the connector.
+
+A master `Connector` publishes timestamped tasks, N worker `Connector`s echo
+them back as responses, and the master measures the round-trip time of each
+one. By default everything runs against the in-process loopback broker, so
+results only reflect the connector itself.
+
+Run with `python -m AmqpConnector.bench --help`.
+'''
+
+import itertools
+import logging
+import platform
+import struct
+import threading
+import time
+import sys
+
+import AmqpConnector
+from AmqpConnector import loopback
+
+# Task header: sequence number, send timestamp.
+HEADER = struct.Struct("!Qd")
+
+_run_counter = itertools.count()
+
+def percentile(values, pct):
+	'''
+	Nearest-rank percentile of an already sorted list.
+	'''
+	if not values:
+		return None
+	idx = min(len(values) - 1, max(0, int(round(pct / 100.0 * len(values) + 0.5)) - 1))
+	return values[idx]
+
+
+def _worker_loop(connector, runflag, batch):
+	while runflag.is_set():
+		msgs = connector.getMessages(batch, timeout=0.1)
+		if msgs:
+			connector.putMessages(msgs)
+
+
+def _wait_for_topology(transport, host, vhost, queue_names, timeout):
+	'''
+	Tasks published before a worker has declared the task queue are dropped
+	as unroutable, so hold off until the loopback broker has both queues.
+	There's no way to tell for a real broker, so just give it a moment.
+	'''
+	if transport != 'loopback':
+		time.sleep(1)
+		return
+
+	if ":" not in host:
+		host += ":5672"
+	broker = loopback.get_broker(host, vhost)
+	deadline = time.monotonic() + timeout
+	while time.monotonic() < deadline:
+		with broker.lock:
+			if all(name in broker.queues for name in queue_names):
+				return
+		time.sleep(0.01)
+
+
+def run_once(workers=1, prefetch=10, poll_rate=0.25, payload_size=64, messages=5000, window=1000,
+			transport='loopback', host='bench', batch=1, timeout=120, **connector_kwargs):
+	'''
+	Run a single benchmark pass, and return a dict of its parameters and results.
+
+	`window` caps the number of tasks the master keeps outstanding, so the
+	latency numbers reflect the connector rather than how deep a backlog
+	was queued up front. `batch` is the most messages a worker handles per
+	getMessages()/putMessages() call.
+	'''
+	log = logging.getLogger("Main.Connector.Bench")
+
+	vhost = "bench-%s" % next(_run_counter)
+	common = dict(connector_kwargs)
+	common.update(
+			host         = host,
+			virtual_host = vhost,
+			transport    = transport,
+			prefetch     = prefetch,
+			poll_rate    = poll_rate,
+		)
+
+	master  = AmqpConnector.Connector(master=True, **common)
+	workers_c = [AmqpConnector.Connector(master=False, **common) for _ in range(workers)]
+
+	queue_names = (common.get('task_queue', 'task.q'), common.get('response_queue', 'response.q'))
+	_wait_for_topology(transport, host, vhost, queue_names, timeout)
+
+	runflag = threading.Event()
+	runflag.set()
+	threads = [threading.Thread(target=_worker_loop, args=(con, runflag, batch), daemon=True) for con in workers_c]
+	for thread in threads:
+		thread.start()
+
+	padding   = b"\0" * max(0, payload_size - HEADER.size)
+	latencies = []
+	sent      = 0
+	timed_out = False
+
+	start = time.perf_counter()
+	while len(latencies) < messages:
+		while sent < messages and sent - len(latencies) < window:
+			master.putMessage(HEADER.pack(sent, time.perf_counter()) + padding)
+			sent += 1
+
+		resps = master.getMessages(window, timeout=0.1)
+		if not resps:
+			if time.perf_counter() - start > timeout:
+				log.error("Benchmark pass timed out with %s of %s responses.", len(latencies), messages)
+				timed_out = True
+				break
+			continue
+
+		now = time.perf_counter()
+		for resp in resps:
+			_, sent_at = HEADER.unpack_from(resp)
+			latencies.append(now - sent_at)
+
+	elapsed = time.perf_counter() - start
+
+	runflag.clear()
+	for thread in threads:
+		thread.join()
+	for con in workers_c:
+		con.stop()
+	master.stop()
+
+	if transport == 'loopback':
+		loopback.reset_brokers()
+
+	latencies.sort()
+	return {
+		'workers'      : workers,
+		'prefetch'     : prefetch,
+		'poll_rate'    : poll_rate,
+		'payload_size' : payload_size,
+		'messages'     : messages,
+		'window'       : window,
+		'batch'        : batch,
+		'transport'    : transport,
+		'completed'    : len(latencies),
+		'timed_out'    : timed_out,
+		'elapsed'      : elapsed,
+		'msgs_per_sec' : len(latencies) / elapsed if elapsed else None,
+		'latency_p50'  : percentile(latencies, 50),
+		'latency_p99'  : percentile(latencies, 99),
+		'latency_p999' : percentile(latencies, 99.9),
+		'latency_max'  : latencies[-1] if latencies else None,
+	}
+
+
+def sweep(workers=(1, ), prefetch=(10, ), poll_rate=(0.25, ), payload_size=(64, ), **kwargs):
+	'''
+	Run `run_once()` over the cartesian product of the parameter lists.
+	Yields each result dict as it completes.
+	'''
+	for w, p, r, s in itertools.product(workers, prefetch, poll_rate, payload_size):
+		yield run_once(workers=w, prefetch=p, poll_rate=r, payload_size=s, **kwargs)
+
+
+def environment():
+	'''
+	Describe where the benchmark ran, so saved results can be compared sensibly.
+	'''
+	try:
+		import importlib.metadata
+		version = importlib.metadata.version("AmqpConnector")
+	except Exception:
+		version = None
+
+	return {
+		'version'   : version,
+		'python'    : sys.version,
+		'platform'  : platform.platform(),
+		'processor' : platform.processor(),
+		'timestamp' : time.time(),
+	}
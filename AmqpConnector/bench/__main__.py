@@ -0,0 +1,60 @@
+import argparse
+import json
+import logging
+
+from AmqpConnector import bench
+
+def int_list(val):
+	return [int(tmp) for tmp in val.split(",")]
+
+def float_list(val):
+	return [float(tmp) for tmp in val.split(",")]
+
+def main():
+	parser = argparse.ArgumentParser(prog="python -m AmqpConnector.bench",
+		description="Measure connector throughput and round-trip latency. Comma-separated values are swept.")
+	parser.add_argument('--workers',   type=int_list,   default=[1],      help="Worker connector counts (default: 1)")
+	parser.add_argument('--prefetch',  type=int_list,   default=[10],     help="Prefetch values (default: 10)")
+	parser.add_argument('--poll-rate', type=float_list, default=[0.25],   help="Poll rates, in seconds (default: 0.25)")
+	parser.add_argument('--payload',   type=int_list,   default=[64],     help="Payload sizes, in bytes (default: 64)")
+	parser.add_argument('--messages',  type=int,        default=5000,     help="Round trips per pass (default: 5000)")
+	parser.add_argument('--window',    type=int,        default=1000,     help="Max outstanding tasks (default: 1000)")
+	parser.add_argument('--batch',     type=int,        default=1,        help="Messages per worker get/put call (default: 1)")
+	parser.add_argument('--consumer-channels', type=int, default=1,       help="Consumer channels per connector (default: 1)")
+	parser.add_argument('--transport', default='loopback',                help="Connector transport (default: loopback)")
+	parser.add_argument('--host',      default='bench',                   help="Broker host (default: bench)")
+	parser.add_argument('--output',    default=None,                      help="Write results to this JSON file")
+	parser.add_argument('--verbose',   action='store_true')
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+	results = []
+	runs = bench.sweep(
+			workers      = args.workers,
+			prefetch     = args.prefetch,
+			poll_rate    = args.poll_rate,
+			payload_size = args.payload,
+			messages     = args.messages,
+			window       = args.window,
+			batch        = args.batch,
+			consumer_channels = args.consumer_channels,
+			transport    = args.transport,
+			host         = args.host,
+		)
+
+	print("%8s %8s %9s %8s %12s %10s %10s %10s" % ("workers", "prefetch", "poll_rate", "payload", "msgs/sec", "p50 ms", "p99 ms", "p999 ms"))
+	for res in runs:
+		results.append(res)
+		print("%8s %8s %9s %8s %12.1f %10.3f %10.3f %10.3f" % (
+				res['workers'], res['prefetch'], res['poll_rate'], res['payload_size'], res['msgs_per_sec'] or 0,
+				(res['latency_p50'] or 0) * 1000, (res['latency_p99'] or 0) * 1000, (res['latency_p999'] or 0) * 1000,
+			))
+
+	if args.output:
+		with open(args.output, "w") as fp:
+			json.dump({'environment' : bench.environment(), 'results' : results}, fp, indent=4)
+		print("Results written to '%s'" % args.output)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,98 @@
+import argparse
+import json
+import random
+import time
+
+from AmqpConnector import compression
+
+def sample_payload(size, seed=0):
+	'''
+	Generate roughly `size` bytes of JSON-wrapped HTML, which is about what
+	real task and response bodies look like. Zero padding would compress
+	far better than anything we actually send.
+	'''
+	rnd   = random.Random(seed)
+	words = ["item", "price", "title", "href", "div", "span", "class", "content", "table", "row",
+		"description", "value", "link", "nav", "footer", "header", "section", "article"]
+	parts = []
+	total = 0
+	while total < size:
+		tag  = rnd.choice(words)
+		text = " ".join(rnd.choice(words) + str(rnd.randint(0, 9999)) for _ in range(rnd.randint(3, 12)))
+		frag = '<%s class="%s-%s">%s</%s>' % (tag, rnd.choice(words), rnd.randint(0, 99), text, tag)
+		parts.append(frag)
+		total += len(frag)
+	return json.dumps({'url' : 'http://example.org/page', 'content' : "".join(parts)}).encode("utf-8")[:size]
+
+def measure(body, encoding, level=None, min_time=0.25):
+	'''
+	Time compressing and decompressing `body`. Returns a dict with the
+	compressed size and the throughput in each direction, in MB/s.
+	'''
+	compress, decompress = compression.CODECS[encoding]
+
+	count = 0
+	start = time.perf_counter()
+	while True:
+		packed = compress(body, level)
+		count += 1
+		elapsed = time.perf_counter() - start
+		if elapsed >= min_time:
+			break
+	comp_rate = len(body) * count / elapsed / 1e6
+
+	count = 0
+	start = time.perf_counter()
+	while True:
+		decompress(packed)
+		count += 1
+		elapsed = time.perf_counter() - start
+		if elapsed >= min_time:
+			break
+	decomp_rate = len(body) * count / elapsed / 1e6
+
+	return {
+		'encoding'         : encoding,
+		'level'            : level,
+		'raw_bytes'        : len(body),
+		'compressed_bytes' : len(packed),
+		'ratio'            : len(packed) / len(body),
+		'compress_mb_s'    : comp_rate,
+		'decompress_mb_s'  : decomp_rate,
+	}
+
+def main():
+	parser = argparse.ArgumentParser(prog="python -m AmqpConnector.bench.compression",
+		description="Compare payload codecs: bytes saved on the wire against CPU spent per message.")
+	parser.add_argument('--payload', default="1024,16384,262144",       help="Generated payload sizes, in bytes (default: 1024,16384,262144)")
+	parser.add_argument('--file',    default=None,                      help="Use this file as the payload instead")
+	parser.add_argument('--levels',  default=None,                      help="Compression levels to try (default: the codec defaults)")
+	parser.add_argument('--output',  default=None,                      help="Write results to this JSON file")
+	args = parser.parse_args()
+
+	if args.file:
+		with open(args.file, "rb") as fp:
+			payloads = [fp.read()]
+	else:
+		payloads = [sample_payload(int(tmp)) for tmp in args.payload.split(",")]
+	levels = [int(tmp) for tmp in args.levels.split(",")] if args.levels else [None]
+
+	results = []
+	print("%8s %8s %6s %12s %8s %12s %12s" % ("payload", "codec", "level", "compressed", "ratio", "comp MB/s", "decomp MB/s"))
+	for body in payloads:
+		for encoding in sorted(compression.CODECS):
+			for level in levels:
+				res = measure(body, encoding, level)
+				results.append(res)
+				print("%8s %8s %6s %12s %8.3f %12.1f %12.1f" % (
+						res['raw_bytes'], res['encoding'], "-" if level is None else level, res['compressed_bytes'],
+						res['ratio'], res['compress_mb_s'], res['decompress_mb_s'],
+					))
+
+	if args.output:
+		with open(args.output, "w") as fp:
+			json.dump(results, fp, indent=4)
+		print("Results written to '%s'" % args.output)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,199 @@
+'''
+Worker utilisation with static and adaptive prefetch.
+
+A master queues a backlog of tasks, each carrying how long it takes to
+"process" (the worker sleeps that long), and N workers with
+ack_mode='manual' work through it. The loopback broker is wrapped so every
+delivery takes `rtt` seconds to reach the consumer, like a real network.
+
+Too small a window leaves workers waiting on that round trip between
+tasks. Too large a window lets one worker hoard a run of slow tasks while
+the others go idle at the end. Each run reports the makespan, and
+utilisation: the fraction of worker time spent processing.
+
+Run with `python -m AmqpConnector.bench.prefetch --help`.
+'''
+
+import argparse
+import itertools
+import json
+import logging
+import queue
+import random
+import struct
+import threading
+import time
+
+import AmqpConnector
+from AmqpConnector import loopback
+
+# Task body: processing time, in seconds.
+TASK = struct.Struct("!d")
+
+_run_counter = itertools.count()
+
+class _DelayedChannel(loopback.LoopbackChannel):
+	'''
+	Loopback channel whose deliveries arrive `rtt` seconds after the broker
+	hands them out. A pump thread keeps pulling from the broker (as far as
+	the prefetch window allows), so deliveries are pipelined like they
+	would be on a real connection.
+	'''
+
+	def __init__(self, broker, rtt):
+		super().__init__(broker)
+		self.rtt = rtt
+
+	def consume(self, queue_name, no_ack=False):
+		inner = super().consume(queue_name, no_ack)
+		return self._delayed(inner)
+
+	def _delayed(self, inner):
+		pipe = queue.Queue()
+
+		def pump():
+			for item in inner:
+				pipe.put((time.monotonic() + self.rtt, item))
+			pipe.put((None, None))
+
+		threading.Thread(target=pump, daemon=True).start()
+		while True:
+			due, item = pipe.get()
+			if item is None:
+				return
+			delay = due - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+			yield item
+
+
+def delayed_transport(rtt):
+	class _DelayedTransport(loopback.LoopbackTransport):
+		def channel(self):
+			chan = _DelayedChannel(self.broker, rtt)
+			self.channels = [tmp for tmp in self.channels if not tmp.closed]
+			self.channels.append(chan)
+			return chan
+	return _DelayedTransport
+
+
+def task_durations(scenario, count, seed=0):
+	'''
+	'uniform': every task takes 5ms.
+	'mixed':   90% take 2ms, 10% take 100ms.
+	'''
+	rnd = random.Random(seed)
+	if scenario == 'uniform':
+		return [0.005] * count
+	if scenario == 'mixed':
+		return [0.1 if rnd.random() < 0.1 else 0.002 for _ in range(count)]
+	raise ValueError("Unknown scenario: '%s'" % scenario)
+
+
+def _worker_loop(connector, done, busy, lock, total):
+	spent = 0.0
+	while True:
+		with lock:
+			if done[0] >= total:
+				break
+		delivery = connector.getMessage(timeout=0.01)
+		if delivery is None:
+			continue
+		duration, = TASK.unpack(delivery.body)
+		time.sleep(duration)
+		spent += duration
+		delivery.ack()
+		with lock:
+			done[0] += 1
+	busy.append(spent)
+
+
+def run_once(scenario='uniform', workers=4, prefetch=10, adaptive=False, rtt=0.02, tasks=1000, timeout=120):
+	'''
+	Run one pass, and return a dict of its parameters and results.
+	'''
+	log = logging.getLogger("Main.Connector.Bench")
+	durations = task_durations(scenario, tasks)
+
+	common = dict(
+			host                     = 'bench-prefetch',
+			virtual_host             = "bench-prefetch-%s" % next(_run_counter),
+			transport                = delayed_transport(rtt),
+			poll_rate                = 0.05,
+			prefetch                 = prefetch,
+			hearbeat_packet_interval = 0.2,
+			topology_cache_ttl       = 0,
+		)
+	workers_c = [AmqpConnector.Connector(master=False, ack_mode='manual', adaptive_prefetch=adaptive,
+			prefetch_tune_interval=0.2, **common) for _ in range(workers)]
+	master = AmqpConnector.Connector(master=True, **common)
+	# Give the workers time to declare their queues, and measure an rtt.
+	time.sleep(0.5)
+
+	master.putMessages([TASK.pack(tmp) for tmp in durations])
+
+	done, busy, lock = [0], [], threading.Lock()
+	threads = [threading.Thread(target=_worker_loop, args=(con, done, busy, lock, tasks), daemon=True) for con in workers_c]
+	start = time.perf_counter()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join(timeout)
+	elapsed = time.perf_counter() - start
+	if done[0] < tasks:
+		log.error("Benchmark pass timed out with %s of %s tasks done.", done[0], tasks)
+
+	final = [con.stats().get('prefetch') for con in workers_c]
+	for con in workers_c:
+		con.stop()
+	master.stop()
+	loopback.reset_brokers()
+
+	return {
+		'scenario'       : scenario,
+		'workers'        : workers,
+		'prefetch'       : "adaptive" if adaptive else prefetch,
+		'rtt'            : rtt,
+		'tasks'          : tasks,
+		'completed'      : done[0],
+		'makespan'       : elapsed,
+		'ideal'          : sum(durations) / workers,
+		'utilisation'    : sum(busy) / (workers * elapsed),
+		'final_prefetch' : final,
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(prog="python -m AmqpConnector.bench.prefetch",
+		description="Compare worker utilisation with static and adaptive prefetch.")
+	parser.add_argument('--scenarios', default="uniform,mixed",   help="Task duration mixes: uniform, mixed (default: both)")
+	parser.add_argument('--prefetch',  default="1,10,100",        help="Static prefetch values to compare (default: 1,10,100)")
+	parser.add_argument('--adaptive-start', type=int, default=1,  help="Starting prefetch for the adaptive run (default: 1)")
+	parser.add_argument('--workers',   type=int,   default=4,     help="Worker connectors (default: 4)")
+	parser.add_argument('--rtt',       type=float, default=0.02,  help="Simulated delivery latency, in seconds (default: 0.02)")
+	parser.add_argument('--tasks',     type=int,   default=1000,  help="Tasks per pass (default: 1000)")
+	parser.add_argument('--output',    default=None,              help="Write results to this JSON file")
+	parser.add_argument('--verbose',   action='store_true')
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+	results = []
+	print("%8s %9s %10s %9s %12s  %s" % ("scenario", "prefetch", "makespan s", "ideal s", "utilisation", "final prefetch"))
+	for scenario in args.scenarios.split(","):
+		configs = [(int(tmp), False) for tmp in args.prefetch.split(",")] + [(args.adaptive_start, True)]
+		for prefetch, adaptive in configs:
+			res = run_once(scenario, args.workers, prefetch, adaptive, args.rtt, args.tasks)
+			results.append(res)
+			print("%8s %9s %10.3f %9.3f %11.1f%%  %s" % (
+					res['scenario'], res['prefetch'], res['makespan'], res['ideal'], res['utilisation'] * 100,
+					",".join(str(tmp) for tmp in res['final_prefetch']),
+				))
+
+	if args.output:
+		with open(args.output, "w") as fp:
+			json.dump(results, fp, indent=4)
+		print("Results written to '%s'" % args.output)
+
+if __name__ == '__main__':
+	main()
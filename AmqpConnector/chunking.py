@@ -0,0 +1,154 @@
+import logging
+import tempfile
+import threading
+import time
+
+# Chunk headers. Every chunk carries the transfer id and its byte offset
+# into the payload; the last one also carries the total size.
+TRANSFER_ID     = 'x-transfer-id'
+TRANSFER_OFFSET = 'x-transfer-offset'
+TRANSFER_SIZE   = 'x-transfer-size'
+
+# How many chunks of a transfer the sender lets queue up locally before
+# it waits for the interface thread to publish them.
+SEND_WINDOW = 4
+
+def transfer_id(properties):
+	'''
+	Return the transfer id if `properties` belong to a chunk, otherwise None.
+	'''
+	headers = properties.get('headers') if properties else None
+	if not headers or TRANSFER_ID not in headers:
+		return None
+	tid = headers[TRANSFER_ID]
+	if isinstance(tid, bytes):
+		tid = tid.decode("ascii")
+	return tid
+
+def iter_chunks(source, chunk_size):
+	'''
+	Split `source` (bytes-like, or a file-like object with `read()`) into
+	chunks of at most `chunk_size` bytes. Yields (offset, chunk, is_last).
+
+	Bytes-like sources are sliced with memoryviews, so no copies are made.
+	File-like sources are read one chunk at a time. At least one chunk is
+	always yielded, even for an empty payload.
+	'''
+	if hasattr(source, 'read'):
+		offset = 0
+		chunk = source.read(chunk_size)
+		while True:
+			following = source.read(chunk_size) if len(chunk) == chunk_size else b''
+			yield offset, chunk, not following
+			if not following:
+				return
+			offset += len(chunk)
+			chunk = following
+
+	if isinstance(source, str):
+		source = source.encode("utf-8")
+	view = memoryview(source).cast('B')
+	size = len(view)
+	for offset in range(0, max(size, 1), chunk_size):
+		yield offset, view[offset:offset + chunk_size], offset + chunk_size >= size
+
+def chunk_headers(tid, offset, chunk, is_last):
+	headers = {
+		TRANSFER_ID     : tid,
+		TRANSFER_OFFSET : offset,
+	}
+	if is_last:
+		headers[TRANSFER_SIZE] = offset + len(chunk)
+	return headers
+
+def _strip_headers(properties):
+	properties = dict(properties)
+	headers = {key : val for key, val in properties['headers'].items()
+			if key not in (TRANSFER_ID, TRANSFER_OFFSET, TRANSFER_SIZE)}
+	if headers:
+		properties['headers'] = headers
+	else:
+		del properties['headers']
+	return properties
+
+
+class _Transfer:
+	def __init__(self, spool_size):
+		self.file      = tempfile.SpooledTemporaryFile(max_size=spool_size)
+		self.offsets   = set()
+		self.received  = 0
+		self.size      = None
+		self.last_seen = time.monotonic()
+
+
+class Reassembler:
+	'''
+	Collects chunks into a `SpooledTemporaryFile` per transfer. Transfers
+	are kept in memory up to `spool_size` bytes, and on disk past that.
+
+	Chunks may arrive out of order (a nacked publish is retried after the
+	chunks behind it), and duplicates (redeliveries) are ignored. Transfers
+	that see no new chunks for `timeout` seconds are dropped by `expire()`.
+	'''
+
+	def __init__(self, spool_size, timeout):
+		self.log        = logging.getLogger("Main.Connector.Chunking")
+		self.spool_size = spool_size
+		self.timeout    = timeout
+		self.lock       = threading.Lock()
+		self.transfers  = {}
+
+		self.completed  = 0
+		self.expired    = 0
+
+	def add(self, tid, properties, body):
+		'''
+		Store a chunk. Once the transfer is complete, returns
+		(file, properties, size), with the file rewound to the start and
+		the chunk headers removed from properties. Otherwise returns None.
+		'''
+		headers = properties['headers']
+		offset  = int(headers[TRANSFER_OFFSET])
+		with self.lock:
+			transfer = self.transfers.get(tid)
+			if transfer is None:
+				transfer = self.transfers[tid] = _Transfer(self.spool_size)
+			transfer.last_seen = time.monotonic()
+
+			if offset not in transfer.offsets:
+				transfer.offsets.add(offset)
+				transfer.file.seek(offset)
+				transfer.file.write(body)
+				transfer.received += len(body)
+			if TRANSFER_SIZE in headers:
+				transfer.size = int(headers[TRANSFER_SIZE])
+
+			if transfer.size is None or transfer.received < transfer.size:
+				return None
+			del self.transfers[tid]
+			self.completed += 1
+
+		transfer.file.seek(0)
+		return transfer.file, _strip_headers(properties), transfer.size
+
+	def expire(self):
+		'''
+		Drop transfers that have been idle for longer than the timeout.
+		'''
+		cutoff = time.monotonic() - self.timeout
+		with self.lock:
+			stale = [tid for tid, transfer in self.transfers.items() if transfer.last_seen < cutoff]
+			for tid in stale:
+				transfer = self.transfers.pop(tid)
+				self.log.warning("Transfer %s timed out with %s bytes received. Discarding it.", tid, transfer.received)
+				transfer.file.close()
+				self.expired += 1
+
+	def close(self):
+		'''
+		Discard every incomplete transfer.
+		'''
+		with self.lock:
+			for transfer in self.transfers.values():
+				transfer.file.close()
+			self.transfers = {}
@@ -0,0 +1,65 @@
+import zlib
+import bz2
+import lzma
+
+# content_encoding value -> (compress(data, level), decompress(data))
+CODECS = {
+	'deflate' : (lambda data, level: zlib.compress(data, 6 if level is None else level), zlib.decompress),
+	'bzip2'   : (lambda data, level: bz2.compress(data, 9 if level is None else level),  bz2.decompress),
+	'xz'      : (lambda data, level: lzma.compress(data, preset=level),                 lzma.decompress),
+}
+
+# Option names accepted for the `compression` connector argument.
+ALIASES = {
+	'zlib'    : 'deflate',
+	'deflate' : 'deflate',
+	'bz2'     : 'bzip2',
+	'bzip2'   : 'bzip2',
+	'lzma'    : 'xz',
+	'xz'      : 'xz',
+}
+
+def get_encoding(name):
+	'''
+	Resolve a `compression` option to its content_encoding name.
+	'''
+	if name is None:
+		return None
+	if name not in ALIASES:
+		raise ValueError("Unknown compression codec: '%s'. Valid options: %s" % (name, sorted(ALIASES)))
+	return ALIASES[name]
+
+def compress(body, encoding, threshold=0, level=None):
+	'''
+	Compress `body` with `encoding` if it's at least `threshold` bytes long
+	and compressing actually makes it smaller.
+
+	Returns (body, content_encoding), where content_encoding is None if the
+	body was left alone.
+	'''
+	if not encoding:
+		return body, None
+	if isinstance(body, str):
+		body = body.encode("utf-8")
+	if len(body) < threshold:
+		return body, None
+
+	packed = CODECS[encoding][0](body, level)
+	if len(packed) >= len(body):
+		return body, None
+	return packed, encoding
+
+def decompress(body, properties):
+	'''
+	Undo any compression flagged in `properties['content_encoding']`.
+
+	Returns (body, properties). If the body was decompressed, the returned
+	properties are a copy without the content_encoding key. Encodings we
+	don't know are passed through untouched.
+	'''
+	encoding = properties.get('content_encoding') if properties else None
+	if encoding in CODECS:
+		properties = dict(properties)
+		del properties['content_encoding']
+		return CODECS[encoding][1](body), properties
+	return body, properties
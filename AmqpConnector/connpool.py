@@ -0,0 +1,109 @@
+import logging
+import threading
+
+from . import transport
+
+class ConnectionPool:
+	'''
+	Process-wide pool of broker connections, shared between Connectors.
+
+	Connectors created with `share_connection=True` whose connection
+	parameters (transport, host, vhost, credentials, ssl options, heartbeat
+	and socket timeout) match get the same underlying `Transport`. Each
+	still opens its own channels on it. Connections are reference counted,
+	and closed when the last user releases them.
+
+	A connection released as broken is dropped from the pool right away,
+	so the next acquire opens a fresh one. Any other users of the old
+	connection will fail on their own, and reconnect through the pool.
+	'''
+
+	def __init__(self):
+		self.log         = logging.getLogger("Main.Connector.Pool")
+		self.lock        = threading.Lock()
+		# key -> Transport
+		self.connections = {}
+		# id(Transport) -> (key, refcount)
+		self.refs        = {}
+
+	@staticmethod
+	def key(config):
+		sslopts = config['sslopts']
+		if sslopts:
+			sslopts = tuple(sorted((name, repr(val)) for name, val in sslopts.items()))
+
+		return (
+			config['transport'] if callable(config['transport']) else str(config['transport']),
+			config['host'],
+			config['virtual_host'],
+			config['userid'],
+			config['password'],
+			sslopts,
+			config['heartbeat'],
+			config['socket_timeout'],
+		)
+
+	def acquire(self, config):
+		'''
+		Get a connected Transport for `config`, opening one if there's no
+		live pooled connection for it yet.
+		'''
+		key = self.key(config)
+		with self.lock:
+			conn = self.connections.get(key)
+			if conn is None:
+				self.log.info("Opening pooled connection to %s%s.", config['host'], config['virtual_host'])
+				conn = transport.get_transport(config['transport'])(config)
+				conn.connect()
+				self.connections[key] = conn
+				self.refs[id(conn)] = (key, 0)
+
+			key, count = self.refs[id(conn)]
+			self.refs[id(conn)] = (key, count + 1)
+			return conn
+
+	def release(self, conn, broken=False):
+		'''
+		Drop a reference to `conn`, closing it if nothing else uses it.
+		'''
+		with self.lock:
+			if id(conn) not in self.refs:
+				return
+			key, count = self.refs[id(conn)]
+			count -= 1
+
+			if broken and self.connections.get(key) is conn:
+				del self.connections[key]
+
+			if count > 0:
+				self.refs[id(conn)] = (key, count)
+				return
+
+			del self.refs[id(conn)]
+			if self.connections.get(key) is conn:
+				del self.connections[key]
+
+		self.log.info("Closing pooled connection (no remaining users).")
+		conn.close()
+
+	def stats(self):
+		'''
+		Open pooled connections, and how many connectors use each of them.
+		'''
+		with self.lock:
+			return [
+					{
+						'host'         : key[1],
+						'virtual_host' : key[2],
+						'userid'       : key[3],
+						'users'        : count,
+						'pooled'       : id(self.connections.get(key)) == ident,
+					}
+				for ident, (key, count) in self.refs.items()
+			]
+
+
+_pool = ConnectionPool()
+
+def get_pool():
+	return _pool
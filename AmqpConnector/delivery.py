@@ -0,0 +1,132 @@
+import time
+
+# Header carrying a message's deadline, as a Unix timestamp. Wall clock
+# time, as it's compared across machines.
+DEADLINE = 'x-deadline'
+
+def deadline(properties):
+	'''
+	Return the deadline from a message's properties, or None if it has none.
+	'''
+	headers = properties.get('headers') if properties else None
+	if not headers or DEADLINE not in headers:
+		return None
+	value = headers[DEADLINE]
+	if isinstance(value, bytes):
+		value = value.decode("ascii")
+	return float(value)
+
+def is_expired(properties, now=None):
+	when = deadline(properties)
+	return when is not None and when <= (time.time() if now is None else now)
+
+
+class Delivery:
+	'''
+	A message received from the broker.
+
+	With `ack_mode='receive'` (the default) messages are acked as soon as
+	they're queued locally, and `Connector.getMessage()` returns just the
+	body. In the deferred ack modes, `getMessage()` returns the Delivery
+	itself, and the message stays unacked on the broker until `ack()` or
+	`nack()` is called (or, with `ack_mode='response'`, until the matching
+	`putMessage()` response has been published).
+
+	`body` is decoded according to the message's content_type (see
+	serializers.py), so it isn't necessarily bytes. `nbytes` is always the
+	size of the body as received.
+
+	Settling only queues the ack. The interface thread sends it, coalescing
+	runs of contiguous delivery tags into a single `multiple=True` ack.
+	'''
+
+	__slots__ = ('body', 'properties', 'delivery_tag', 'redelivered', 'channel', 'nbytes', 'received_at', 'handed_at', 'settled', '_ack_queue', '_tx_event')
+
+	def __init__(self, body, properties, delivery_tag, redelivered, channel, ack_queue=None, tx_event=None, nbytes=None):
+		self.body         = body
+		self.properties   = properties
+		self.delivery_tag = delivery_tag
+		self.redelivered  = redelivered
+		self.channel      = channel
+		self.nbytes       = len(body) if nbytes is None else nbytes
+		self.received_at  = time.monotonic()
+		# When the application fetched it.
+		self.handed_at    = None
+
+		# Nothing to settle if there's nowhere to send the ack.
+		self.settled      = ack_queue is None
+		self._ack_queue   = ack_queue
+		self._tx_event    = tx_event
+
+	def __len__(self):
+		return self.nbytes
+
+	@property
+	def correlation_id(self):
+		cid = self.properties.get('correlation_id') if self.properties else None
+		if isinstance(cid, bytes):
+			cid = cid.decode("utf-8")
+		return cid
+
+	@property
+	def priority(self):
+		return self.properties.get('priority') if self.properties else None
+
+	@property
+	def deadline(self):
+		return deadline(self.properties)
+
+	def expired(self, now=None):
+		return is_expired(self.properties, now)
+
+	def __repr__(self):
+		return "<Delivery tag=%s len=%s settled=%s>" % (self.delivery_tag, self.nbytes, self.settled)
+
+	def ack(self):
+		'''
+		Acknowledge the message, so the broker drops it.
+		'''
+		return self._settle(None)
+
+	def nack(self, requeue=True):
+		'''
+		Reject the message. If requeue is true, the broker will redeliver
+		it (possibly to another worker), otherwise it's dropped or
+		dead-lettered.
+		'''
+		return self._settle(bool(requeue))
+
+	def _settle(self, requeue):
+		if self.settled:
+			return False
+		self.settled = True
+		# A reassembled chunked transfer has no ack of its own to send.
+		if self._ack_queue is not None:
+			self._ack_queue.put((self, requeue))
+			self._tx_event.set()
+		return True
+
+
+class Outgoing:
+	'''
+	A message waiting in the outgoing queue: the (already encoded) body,
+	the AMQP properties to publish it with, and the routing key, if it
+	isn't the connector's default. `spool_position` is set on messages
+	read back from a disk spool.
+	'''
+
+	__slots__ = ('body', 'properties', 'routing_key', 'queued_at', 'sent_at', 'spool_position')
+
+	def __init__(self, body, properties=None, routing_key=None):
+		self.body        = body
+		self.properties  = properties or {}
+		self.routing_key = routing_key
+		self.queued_at  = time.monotonic()
+		self.sent_at    = None
+		self.spool_position = None
+
+	def __len__(self):
+		return len(self.body)
+
+	def __repr__(self):
+		return "<Outgoing len=%s properties=%s>" % (len(self.body), self.properties)
@@ -0,0 +1,370 @@
+import threading
+import collections
+import itertools
+import time
+
+from . import transport
+
+class LoopbackBroker:
+	'''
+	A minimal in-process AMQP broker.
+
+	Implements just enough of the broker side for the connector to run
+	without a network: direct, fanout and topic exchanges, the default
+	exchange, queue bindings, per-channel prefetch, acks, nacks and
+	redelivery of unacked messages when a channel is closed.
+
+	Everything is guarded by one lock, and consumers block on a single
+	condition that is notified whenever a queue or channel changes state.
+	'''
+
+	def __init__(self):
+		self.lock      = threading.RLock()
+		self.changed   = threading.Condition(self.lock)
+
+		# exchange name -> exchange type
+		self.exchanges = {'' : 'direct'}
+		# exchange name -> list of (queue name, routing key)
+		self.bindings  = collections.defaultdict(list)
+		# queue name -> deque of _Envelope
+		self.queues    = {}
+
+		self.published       = 0
+		self.published_bytes = 0
+		self.delivered       = 0
+		self.expired         = 0
+
+	def exchange_declare(self, exchange, exchange_type):
+		with self.lock:
+			self.exchanges.setdefault(exchange, exchange_type)
+
+	def queue_declare(self, queue, arguments=None):
+		with self.lock:
+			if queue not in self.queues:
+				max_priority = (arguments or {}).get('x-max-priority')
+				self.queues[queue] = _PriorityDeque(max_priority) if max_priority else collections.deque()
+
+	def queue_bind(self, queue, exchange, routing_key):
+		with self.lock:
+			if exchange not in self.exchanges:
+				raise ValueError("No such exchange: '%s'" % exchange)
+			if (queue, routing_key) not in self.bindings[exchange]:
+				self.bindings[exchange].append((queue, routing_key))
+
+	def queue_purge(self, queue):
+		with self.lock:
+			if queue in self.queues:
+				self.queues[queue].clear()
+
+	def queue_depth(self, queue):
+		with self.lock:
+			return len(self.queues.get(queue, ()))
+
+	def _route(self, exchange, routing_key):
+		if exchange == '':
+			return [routing_key] if routing_key in self.queues else []
+
+		if exchange not in self.exchanges:
+			raise ValueError("No such exchange: '%s'" % exchange)
+
+		ex_type = self.exchanges[exchange]
+		ret = []
+		for queue, key in self.bindings[exchange]:
+			if ex_type == 'fanout':
+				match = True
+			elif ex_type == 'topic':
+				match = _topic_match(key, routing_key)
+			else:
+				match = key == routing_key
+			if match and queue not in ret:
+				ret.append(queue)
+		return ret
+
+	def publish(self, exchange, routing_key, body, properties):
+		'''
+		Route a message into the bound queues. Returns the number of queues
+		the message was delivered to.
+		'''
+		if isinstance(body, str):
+			body = body.encode("utf-8")
+		with self.lock:
+			targets = self._route(exchange, routing_key)
+			for queue in targets:
+				self.queues[queue].append(_Envelope(body, dict(properties), exchange, routing_key))
+			self.published += 1
+			self.published_bytes += len(body)
+			if targets:
+				self.changed.notify_all()
+			return len(targets)
+
+	def requeue(self, queue, envelope):
+		'''
+		Return a message to the head of its queue, flagged as redelivered.
+		'''
+		with self.lock:
+			envelope.redelivered = True
+			if queue in self.queues:
+				self.queues[queue].appendleft(envelope)
+			self.changed.notify_all()
+
+
+class _PriorityDeque:
+	'''
+	Contents of a queue declared with `x-max-priority`: a deque per
+	priority level, drained highest first. Priorities above the maximum
+	are treated as the maximum, as RabbitMQ does.
+	'''
+
+	def __init__(self, max_priority):
+		self.max_priority = max_priority
+		self.levels = [collections.deque() for _ in range(max_priority + 1)]
+
+	def _level(self, envelope):
+		priority = envelope.properties.get('priority') or 0
+		return self.levels[min(max(int(priority), 0), self.max_priority)]
+
+	def append(self, envelope):
+		self._level(envelope).append(envelope)
+
+	def appendleft(self, envelope):
+		self._level(envelope).appendleft(envelope)
+
+	def popleft(self):
+		for level in reversed(self.levels):
+			if level:
+				return level.popleft()
+		raise IndexError("pop from an empty queue")
+
+	def clear(self):
+		for level in self.levels:
+			level.clear()
+
+	def __len__(self):
+		return sum(len(level) for level in self.levels)
+
+
+class _Envelope:
+	__slots__ = ('body', 'properties', 'exchange', 'routing_key', 'redelivered', 'expires_at')
+
+	def __init__(self, body, properties, exchange, routing_key):
+		self.body        = body
+		self.properties  = properties
+		self.exchange    = exchange
+		self.routing_key = routing_key
+		self.redelivered = False
+		# Per-message TTL. The AMQP `expiration` property is in milliseconds.
+		expiration = properties.get('expiration')
+		self.expires_at  = time.monotonic() + int(expiration) / 1000 if expiration is not None else None
+
+	def expired(self):
+		return self.expires_at is not None and self.expires_at <= time.monotonic()
+
+
+class LoopbackMessage:
+	'''
+	A delivered message. Mirrors the parts of `rabbitpy.Message` the
+	connector uses.
+	'''
+
+	def __init__(self, channel, delivery_tag, envelope):
+		self.channel      = channel
+		self.delivery_tag = delivery_tag
+		self.body         = envelope.body
+		self.properties   = envelope.properties
+		self.exchange     = envelope.exchange
+		self.routing_key  = envelope.routing_key
+		self.redelivered  = envelope.redelivered
+
+	def ack(self, all_previous=False):
+		self.channel.basic_ack(self.delivery_tag, multiple=all_previous)
+
+	def nack(self, requeue=False, all_previous=False):
+		self.channel.basic_nack(self.delivery_tag, multiple=all_previous, requeue=requeue)
+
+	def reject(self, requeue=False):
+		self.channel.basic_nack(self.delivery_tag, requeue=requeue)
+
+
+_brokers      = {}
+_brokers_lock = threading.Lock()
+
+def get_broker(host, virtual_host):
+	'''
+	Fetch the process-wide loopback broker for a host/vhost pair, creating
+	it if needed. Connectors with the same host and vhost share a broker.
+	'''
+	with _brokers_lock:
+		key = (host, virtual_host)
+		if key not in _brokers:
+			_brokers[key] = LoopbackBroker()
+		return _brokers[key]
+
+def reset_brokers():
+	'''
+	Throw away all loopback brokers, and everything queued in them.
+	'''
+	with _brokers_lock:
+		_brokers.clear()
+
+
+class LoopbackTransport(transport.Transport):
+	'''
+	Transport that talks to an in-process `LoopbackBroker`, selected with
+	`transport='loopback'`.
+	'''
+
+	def __init__(self, config):
+		super().__init__(config)
+		self.broker   = None
+		self.channels = []
+
+	def connect(self):
+		self.broker = get_broker(self.config['host'], self.config['virtual_host'])
+
+	def channel(self):
+		chan = LoopbackChannel(self.broker)
+		self.channels = [tmp for tmp in self.channels if not tmp.closed]
+		self.channels.append(chan)
+		return chan
+
+	def close(self):
+		for chan in self.channels:
+			chan.close()
+		self.channels = []
+
+
+class LoopbackChannel(transport.TransportChannel):
+
+	def __init__(self, broker):
+		self.broker      = broker
+		self.closed      = False
+		self.prefetch    = 0
+		self.consuming   = False
+
+		self._tags       = itertools.count(1)
+		# delivery tag -> (queue name, envelope)
+		self.unacked     = collections.OrderedDict()
+
+		self.confirming  = False
+		self.publish_seq = 0
+		self.confirms    = collections.deque()
+
+	def exchange_declare(self, exchange, exchange_type='direct', durable=False, auto_delete=False, arguments=None):
+		self.broker.exchange_declare(exchange, exchange_type)
+
+	def queue_declare(self, queue, durable=False, auto_delete=False, arguments=None):
+		self.broker.queue_declare(queue, arguments)
+
+	def queue_bind(self, queue, exchange, routing_key=''):
+		self.broker.queue_bind(queue, exchange, routing_key)
+
+	def queue_purge(self, queue):
+		self.broker.queue_purge(queue)
+
+	def basic_qos(self, prefetch_count):
+		with self.broker.lock:
+			self.prefetch = prefetch_count
+			self.broker.changed.notify_all()
+
+	def confirm_select(self):
+		self.confirming = True
+
+	def wait_for_confirm(self):
+		# The loopback broker takes every message synchronously, so the
+		# confirm is always already there.
+		return self.confirms.popleft()
+
+	def basic_publish(self, exchange, routing_key, body, properties=None):
+		self.broker.publish(exchange, routing_key, body, properties or {})
+		if self.confirming:
+			self.publish_seq += 1
+			self.confirms.append((True, self.publish_seq, False))
+
+	def _settle(self, delivery_tag, multiple):
+		with self.broker.lock:
+			if multiple:
+				tags = [tag for tag in self.unacked if tag <= delivery_tag]
+			else:
+				tags = [delivery_tag] if delivery_tag in self.unacked else []
+			ret = [self.unacked.pop(tag) for tag in tags]
+			self.broker.changed.notify_all()
+			return ret
+
+	def basic_ack(self, delivery_tag, multiple=False):
+		self._settle(delivery_tag, multiple)
+
+	def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+		for queue, envelope in self._settle(delivery_tag, multiple):
+			if requeue:
+				self.broker.requeue(queue, envelope)
+
+	def consume(self, queue, no_ack=False):
+		with self.broker.lock:
+			self.broker.queue_declare(queue)
+			self.consuming = True
+		return self._consume(queue, no_ack)
+
+	def _consume(self, queue, no_ack):
+		broker = self.broker
+		while True:
+			with broker.lock:
+				while True:
+					if not self.consuming or self.closed:
+						return
+					has_room = no_ack or not self.prefetch or len(self.unacked) < self.prefetch
+					if has_room and broker.queues.get(queue):
+						break
+					broker.changed.wait()
+
+				envelope = broker.queues[queue].popleft()
+				if envelope.expired():
+					# Dropped when it reaches the head of the queue, as RabbitMQ does.
+					broker.expired += 1
+					continue
+				tag = next(self._tags)
+				if not no_ack:
+					self.unacked[tag] = (queue, envelope)
+				broker.delivered += 1
+
+			yield LoopbackMessage(self, tag, envelope)
+
+	def stop_consuming(self):
+		with self.broker.lock:
+			self.consuming = False
+			self.broker.changed.notify_all()
+
+	def close(self):
+		'''
+		Close the channel. Anything still unacked goes back to its queue,
+		the same as a real broker does when a channel dies.
+		'''
+		with self.broker.lock:
+			if self.closed:
+				return
+			self.closed    = True
+			self.consuming = False
+			pending = list(self.unacked.values())
+			self.unacked.clear()
+			# Requeue in reverse, so the queue head ends up in the original order.
+			for queue, envelope in reversed(pending):
+				self.broker.requeue(queue, envelope)
+			self.broker.changed.notify_all()
+
+
+def _topic_match(pattern, routing_key):
+	'''
+	AMQP topic matching: words are '.' separated, '*' matches exactly one
+	word and '#' matches zero or more.
+	'''
+	def match(pat, key):
+		if not pat:
+			return not key
+		if pat[0] == '#':
+			return any(match(pat[1:], key[i:]) for i in range(len(key) + 1))
+		if not key:
+			return False
+		if pat[0] == '*' or pat[0] == key[0]:
+			return match(pat[1:], key[1:])
+		return False
+
+	return match(pattern.split("."), routing_key.split("."))
@@ -0,0 +1,204 @@
+import bisect
+import collections
+import http.server
+import logging
+import threading
+import time
+
+# Histogram bucket upper bounds, in seconds.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+		0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Rates are averaged over this many seconds.
+RATE_WINDOW = 10
+
+class Histogram:
+	'''
+	Fixed-bucket histogram, in the Prometheus style: bucket counts are
+	cumulative, with an implicit +Inf bucket.
+	'''
+
+	def __init__(self, buckets=LATENCY_BUCKETS):
+		self.buckets = buckets
+		self.counts  = [0] * (len(buckets) + 1)
+		self.count   = 0
+		self.sum     = 0.0
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.count += 1
+		self.sum   += value
+
+	def quantile(self, q):
+		'''
+		Estimate a quantile, as the upper bound of the bucket it falls in.
+		'''
+		if not self.count:
+			return None
+		rank = q * self.count
+		seen = 0
+		for bound, count in zip(self.buckets, self.counts):
+			seen += count
+			if seen >= rank:
+				return bound
+		return float('inf')
+
+	def snapshot(self):
+		cumulative = []
+		seen = 0
+		for bound, count in zip(self.buckets + (float('inf'), ), self.counts):
+			seen += count
+			cumulative.append((bound, seen))
+		return {
+			'count'   : self.count,
+			'sum'     : self.sum,
+			'p50'     : self.quantile(0.5),
+			'p99'     : self.quantile(0.99),
+			'buckets' : cumulative,
+		}
+
+
+class Metrics:
+	'''
+	Counters and histograms for one `Connector`. Updated from the
+	interface thread, the rx threads and the application's threads, so
+	everything goes through one lock.
+	'''
+
+	COUNTERS = ('published', 'published_bytes', 'received', 'received_bytes', 'publish_nacks', 'reconnects', 'republished', 'heartbeat_timeouts',
+			'declares_sent', 'declares_cached', 'expired', 'expired_bytes', 'rx_starved',
+			'rejected', 'rejected_bytes', 'rx_paused_seconds', 'tx_blocked_seconds')
+
+	def __init__(self):
+		self.lock     = threading.Lock()
+		self.started  = time.monotonic()
+		self.counters = dict.fromkeys(self.COUNTERS, 0)
+		# Point-in-time values owned by the interface thread.
+		self.gauges   = {}
+
+		self.rx_dwell        = Histogram()
+		self.tx_dwell        = Histogram()
+		self.publish_latency = Histogram()
+		# Time from losing the connection to having a working one again.
+		self.reconnect_duration = Histogram()
+		# Round trip time of the liveness probes.
+		self.heartbeat_rtt      = Histogram()
+		# Time from handing a delivery to the application to its ack.
+		self.task_duration      = Histogram()
+
+		# (time, published, received) samples, for the rates.
+		self.samples  = collections.deque(maxlen=RATE_WINDOW + 1)
+		self.samples.append((self.started, 0, 0))
+
+	def incr(self, **counts):
+		with self.lock:
+			for name, count in counts.items():
+				self.counters[name] += count
+
+	def set(self, name, value):
+		with self.lock:
+			self.gauges[name] = value
+
+	def observe(self, histogram, *values):
+		with self.lock:
+			for value in values:
+				histogram.observe(value)
+
+	def tick(self):
+		'''
+		Record a rate sample, at most once a second. Called from the
+		interface thread's poll loop.
+		'''
+		now = time.monotonic()
+		with self.lock:
+			if now - self.samples[-1][0] >= 1:
+				self.samples.append((now, self.counters['published'], self.counters['received']))
+
+	def snapshot(self):
+		now = time.monotonic()
+		with self.lock:
+			ret = dict(self.counters)
+			ret.update(self.gauges)
+			then, published, received = self.samples[0]
+			elapsed = now - then
+			ret['publish_rate'] = (self.counters['published'] - published) / elapsed if elapsed > 0 else 0.0
+			ret['receive_rate'] = (self.counters['received']  - received)  / elapsed if elapsed > 0 else 0.0
+			ret['uptime']          = now - self.started
+			ret['rx_dwell']        = self.rx_dwell.snapshot()
+			ret['tx_dwell']        = self.tx_dwell.snapshot()
+			ret['publish_latency'] = self.publish_latency.snapshot()
+			ret['reconnect_duration'] = self.reconnect_duration.snapshot()
+			ret['heartbeat_rtt']      = self.heartbeat_rtt.snapshot()
+			ret['task_duration']      = self.task_duration.snapshot()
+		return ret
+
+
+def _format_value(value):
+	if value == float('inf'):
+		return "+Inf"
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+def format_prometheus(stats, labels, prefix="amqpconnector"):
+	'''
+	Render a `Connector.stats()` dict in the Prometheus text exposition
+	format. Numeric values become gauges (or counters, for the ones in
+	`Metrics.COUNTERS`), and histogram snapshots become histograms.
+	'''
+	label_str = ",".join('%s="%s"' % (key, str(val).replace('\\', '\\\\').replace('"', '\\"')) for key, val in sorted(labels.items()))
+
+	def with_labels(extra=None):
+		parts = [label_str] if label_str else []
+		if extra:
+			parts.append(extra)
+		return "{%s}" % ",".join(parts) if parts else ""
+
+	lines = []
+	for key, value in sorted(stats.items()):
+		name = "%s_%s" % (prefix, key)
+		if isinstance(value, dict) and 'buckets' in value:
+			name += "_seconds"
+			lines.append("# TYPE %s histogram" % name)
+			for bound, count in value['buckets']:
+				lines.append('%s_bucket%s %s' % (name, with_labels('le="%s"' % _format_value(bound)), count))
+			lines.append("%s_sum%s %s"   % (name, with_labels(), _format_value(value['sum'])))
+			lines.append("%s_count%s %s" % (name, with_labels(), value['count']))
+		elif isinstance(value, (int, float)) and not isinstance(value, bool):
+			if key in Metrics.COUNTERS:
+				name += "_total"
+				lines.append("# TYPE %s counter" % name)
+			else:
+				lines.append("# TYPE %s gauge" % name)
+			lines.append("%s%s %s" % (name, with_labels(), _format_value(value)))
+	return "\n".join(lines) + "\n"
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+	def do_GET(self):
+		if self.path.split("?")[0] not in ("/", "/metrics"):
+			self.send_error(404)
+			return
+		body = self.server.render().encode("utf-8")
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, fmt, *args):
+		logging.getLogger("Main.Connector.Metrics").debug(fmt, *args)
+
+
+def start_exporter(stats, labels, host, port):
+	'''
+	Serve the dict returned by calling `stats()` in the Prometheus text
+	format on http://host:port/metrics, from a daemon thread. Returns the
+	server; call `shutdown()` on it to stop.
+	'''
+	server = http.server.ThreadingHTTPServer((host, port), _Handler)
+	server.daemon_threads = True
+	server.render = lambda: format_prometheus(stats(), labels)
+
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	logging.getLogger("Main.Connector.Metrics").info("Serving metrics on http://%s:%s/metrics", host, server.server_address[1])
+	return server
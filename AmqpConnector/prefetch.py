@@ -0,0 +1,106 @@
+import logging
+import time
+
+# Round trip assumed until the heartbeat probes have measured one.
+DEFAULT_RTT = 0.01
+
+class PrefetchTuner:
+	'''
+	Sizes the per-channel prefetch window from what the application is
+	actually doing, instead of a fixed `prefetch`.
+
+	Every `interval` seconds it samples the connector's `Metrics`:
+
+	 - rate: deliveries handed to the application per second (smoothed),
+	 - service: mean time from hand-out to ack (deferred acks only), which
+	   is how long each task holds a prefetch slot,
+	 - rtt: the broker round trip, from the heartbeat probes,
+	 - starved: whether the application asked for work and found the
+	   local queue empty while deliveries were still arriving.
+
+	By Little's law, keeping the application busy takes a window covering
+	the tasks in progress plus the ones it gets through while a refill is
+	in flight, so the target is
+
+		window = headroom * rate * (service + rtt) + 1
+
+	If the application was starved, the measured rate understates demand,
+	so the window doubles instead. It only shrinks once the target is below
+	half the window, and by at most half per interval. The result is
+	clamped to [minimum, maximum] and only applied when it moves by more
+	than 25%, so the window doesn't flap.
+
+	A worker whose tasks get slower sees its rate drop, and its window
+	shrinks, so it stops hoarding tasks that idle workers could take.
+	Intervals where the application fetched nothing at all are ignored.
+	'''
+
+	def __init__(self, initial, minimum, maximum, interval=1.0, headroom=2.0):
+		if not 1 <= minimum <= maximum:
+			raise ValueError("Prefetch bounds must satisfy 1 <= minimum <= maximum!")
+		self.log      = logging.getLogger("Main.Connector.Prefetch")
+		self.minimum  = minimum
+		self.maximum  = maximum
+		self.interval = interval
+		self.headroom = headroom
+		self.window   = min(max(initial, minimum), maximum)
+
+		self.rate     = None
+		self.last     = None
+		self.last_at  = None
+
+	@staticmethod
+	def _sample(metrics):
+		with metrics.lock:
+			return (
+				metrics.rx_dwell.count,
+				metrics.counters['rx_starved'],
+				metrics.counters['received'],
+				metrics.task_duration.count,
+				metrics.task_duration.sum,
+				metrics.gauges.get('heartbeat_last_rtt'),
+			)
+
+	def update(self, metrics):
+		'''
+		Take a sample if one is due. Returns the new window if it should
+		change, otherwise None.
+		'''
+		now = time.monotonic()
+		if self.last_at is not None and now - self.last_at < self.interval:
+			return None
+		sample = self._sample(metrics)
+		if self.last is None:
+			self.last, self.last_at = sample, now
+			return None
+
+		elapsed = now - self.last_at
+		handed, starved, received, settled, settled_time = [new - old for new, old in zip(sample[:5], self.last[:5])]
+		rtt = sample[5] or DEFAULT_RTT
+		self.last, self.last_at = sample, now
+		if not handed and not starved:
+			# The application didn't ask for anything, so there's nothing
+			# to go on. Anything already prefetched stays put regardless.
+			return None
+
+		rate = handed / elapsed
+		self.rate = rate if self.rate is None else (self.rate + rate) / 2
+		service = settled_time / settled if settled else 0.0
+
+		if starved and received:
+			target = self.window * 2
+		else:
+			target = int(self.headroom * self.rate * (service + rtt)) + 1
+			if target > self.window // 2:
+				# Only shrink once the window is well over what's needed, and
+				# then by half at most, so a noisy interval can't starve us.
+				target = max(target, self.window)
+			target = max(target, self.window // 2)
+		target = min(max(target, self.minimum), self.maximum)
+
+		if abs(target - self.window) <= self.window * 0.25:
+			return None
+		self.log.info("Adjusting prefetch from %s to %s (%0.1f tasks/s, %0.3fs per task, %0.3fs rtt%s).",
+			self.window, target, self.rate, service, rtt, ", starved" if starved and received else "")
+		self.window = target
+		return target
@@ -0,0 +1,241 @@
+import collections
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import traceback
+
+# How many times a task may take down a worker process before we give up on
+# it, in every ack mode.
+MAX_TASK_CRASHES = 3
+
+def _child_main(handler, task_q, result_q, idx):
+	'''
+	Worker process body. Runs tasks until it's sent None.
+	'''
+	# Ctrl+C goes to the whole process group. Leave shutdown to the parent,
+	# so in-flight tasks are finished rather than lost.
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+	while True:
+		job = task_q.get()
+		if job is None:
+			break
+		task_id, body = job
+		try:
+			result_q.put((idx, task_id, True, handler(body)))
+		except Exception:
+			result_q.put((idx, task_id, False, traceback.format_exc()))
+
+
+class _Child:
+	def __init__(self, ctx, handler, result_q, idx):
+		self.idx      = idx
+		self.task_q   = ctx.Queue()
+		self.inflight = collections.OrderedDict()
+		self.proc     = ctx.Process(target=_child_main, args=(handler, self.task_q, result_q, idx), daemon=True)
+		self.proc.start()
+
+
+class ProcessPoolServer:
+	'''
+	Feeds deliveries from one `Connector` through a pool of worker
+	processes, and publishes their results back through it.
+
+	Every task is assigned to a specific child, so if a child dies its
+	in-flight tasks are known. They are re-dispatched to another child,
+	until a task has taken down MAX_TASK_CRASHES of them. It's then dropped,
+	and nacked without requeueing (so dead-lettered, if the queue has a dead
+	letter exchange) when the connector defers acks. Tasks aren't nacked
+	back to the broker for retrying, as a redelivery can't be told apart
+	from a new message, so a poison message would kill children forever.
+	Dead children are replaced.
+
+	At most `max_in_flight` tasks are handed to the children at once; the
+	rest stay in the connector's local queue (and therefore count against
+	its prefetch), so the broker can still give them to other consumers.
+	'''
+
+	def __init__(self, connector, handler, processes=None, max_in_flight=None):
+		self.log       = logging.getLogger("Main.Connector.ProcPool")
+		self.connector = connector
+		self.handler   = handler
+		self.processes = processes or os.cpu_count() or 1
+
+		# Default to one task running and one queued per child.
+		self.max_in_flight = max_in_flight or self.processes * 2
+		if connector.ack_mode != 'receive' and connector.prefetch and connector.prefetch < self.max_in_flight:
+			self.log.warning("Prefetch (%s) is lower than the pool's in-flight limit (%s). Some worker processes will idle.",
+				connector.prefetch, self.max_in_flight)
+			self.max_in_flight = connector.prefetch
+
+		self.ctx       = multiprocessing.get_context()
+		self.result_q  = self.ctx.Queue()
+		self.children  = {}
+		self.retry     = collections.deque()
+		self.crashes   = collections.Counter()
+		self.task_ids  = itertools.count()
+
+		self.lock      = threading.Lock()
+		self.slot_free = threading.Condition(self.lock)
+		self.running   = False
+
+		self.completed = 0
+		self.failed    = 0
+		self.restarts  = 0
+
+	def _inflight(self):
+		return sum(len(child.inflight) for child in self.children.values())
+
+	def _spawn(self, idx):
+		self.children[idx] = _Child(self.ctx, self.handler, self.result_q, idx)
+
+	def _dispatch(self, delivery):
+		child = min(self.children.values(), key=lambda tmp: len(tmp.inflight))
+		task_id = next(self.task_ids)
+		child.inflight[task_id] = delivery
+		body = delivery.body
+		if isinstance(body, memoryview):
+			# Memoryviews can't be pickled across to the child.
+			body = body.tobytes()
+		child.task_q.put((task_id, body))
+
+	def _reapChildren(self):
+		'''
+		Check for dead children. Their tasks are handed back, and they're
+		replaced with fresh processes.
+		'''
+		for idx, child in list(self.children.items()):
+			if child.proc.is_alive():
+				continue
+
+			self.log.error("Worker process %s died (exit code %s) with %s task(s) in flight!",
+				idx, child.proc.exitcode, len(child.inflight))
+			for delivery in child.inflight.values():
+				self._requeue(delivery)
+			child.inflight.clear()
+
+			self.restarts += 1
+			if self.running:
+				self._spawn(idx)
+			else:
+				del self.children[idx]
+			self.slot_free.notify_all()
+
+	def _requeue(self, delivery):
+		self.crashes[id(delivery)] += 1
+		if self.crashes[id(delivery)] >= MAX_TASK_CRASHES:
+			self.log.error("Task crashed %s worker processes. Dropping it.", MAX_TASK_CRASHES)
+			del self.crashes[id(delivery)]
+			self.failed += 1
+			delivery.nack(requeue=False)
+			return
+		# While it's unsettled the broker still holds it, so it's redelivered
+		# if this connector goes away before a child gets through it.
+		self.retry.append(delivery)
+
+	def _collectResults(self):
+		'''
+		Result thread. Publishes results as children return them.
+		'''
+		while True:
+			with self.lock:
+				if not self.running and not self._inflight():
+					return
+
+			try:
+				idx, task_id, ok, result = self.result_q.get(timeout=self.connector.poll_rate)
+			except queue.Empty:
+				with self.lock:
+					self._reapChildren()
+				continue
+
+			with self.lock:
+				child = self.children.get(idx)
+				delivery = child.inflight.pop(task_id, None) if child else None
+				self.slot_free.notify_all()
+
+			if delivery is None:
+				# The child was already reaped, and the task handed back.
+				continue
+
+			self.crashes.pop(id(delivery), None)
+			if ok:
+				self.completed += 1
+				if result is not None:
+					self.connector.putMessage(result, ack=delivery if not delivery.settled else False,
+							correlation_id=delivery.correlation_id)
+				else:
+					delivery.ack()
+			else:
+				self.failed += 1
+				self.log.error("Task handler raised an exception:")
+				for line in result.split("\n"):
+					self.log.error("	%s", line)
+				delivery.nack(requeue=False)
+
+	def _shouldRun(self, stop_event):
+		return self.connector.runstate.value and not (stop_event and stop_event.is_set())
+
+	def serve(self, stop_event=None):
+		self.log.info("Starting %s worker processes.", self.processes)
+		with self.lock:
+			self.running = True
+			for idx in range(self.processes):
+				self._spawn(idx)
+
+		collector = threading.Thread(target=self._collectResults, daemon=True)
+		collector.start()
+
+		try:
+			while self._shouldRun(stop_event):
+				with self.lock:
+					self._reapChildren()
+					while self.retry and self._inflight() < self.max_in_flight:
+						self._dispatch(self.retry.popleft())
+					free = self.max_in_flight - self._inflight()
+					if free <= 0:
+						self.slot_free.wait(self.connector.poll_rate)
+						continue
+
+				for delivery in self.connector._fetch(free, timeout=self.connector.poll_rate):
+					with self.lock:
+						self._dispatch(delivery)
+
+		finally:
+			self.log.info("Waiting for %s in-flight task(s) to finish.", self._inflight())
+			with self.lock:
+				self.running = False
+			collector.join()
+
+			for child in self.children.values():
+				child.task_q.put(None)
+			for child in self.children.values():
+				child.proc.join()
+			self.children = {}
+
+			# Anything not yet handed to a child goes back as well.
+			for delivery in self.retry:
+				delivery.nack(requeue=True)
+			self.retry.clear()
+
+			self.log.info("Worker processes halted. %s tasks completed, %s failed, %s process restarts.",
+				self.completed, self.failed, self.restarts)
+
+
+def serve(connector, handler, processes=None, max_in_flight=None, stop_event=None):
+	'''
+	Run `connector`'s received messages through `handler(body)` on a pool
+	of `processes` worker processes (default: one per core), and publish
+	each non-None return value as the response. Returns once `stop_event`
+	is set or the connector is stopped, after in-flight tasks finish.
+
+	`handler` runs in the child processes, so it must be picklable (a
+	module-level function) on platforms that don't fork.
+	'''
+	server = ProcessPoolServer(connector, handler, processes=processes, max_in_flight=max_in_flight)
+	server.serve(stop_event=stop_event)
+	return server
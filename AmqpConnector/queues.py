@@ -0,0 +1,193 @@
+import heapq
+import itertools
+import queue
+import time
+
+def _sizeof(item):
+	nbytes = getattr(item, 'nbytes', None)
+	if nbytes is not None:
+		return nbytes
+	try:
+		return len(item)
+	except TypeError:
+		return 0
+
+
+class BatchQueue(queue.Queue):
+	'''
+	queue.Queue with bulk put/get, so a whole batch crosses the thread
+	boundary under one lock acquisition and one wake-up.
+
+	Also tracks the total size of the queued items in `bytes`, and lets
+	producers wait for the queue to drain below a count or size limit.
+	'''
+
+	# True for subclasses that spill to disk rather than grow without limit.
+	bounded_memory = False
+
+	def _init(self, maxsize):
+		super()._init(maxsize)
+		self.bytes = 0
+
+	def _put(self, item):
+		super()._put(item)
+		self.bytes += _sizeof(item)
+
+	def _get(self):
+		item = super()._get()
+		self.bytes -= _sizeof(item)
+		# get() only wakes a single waiter. Anything waiting for room may
+		# be waiting on a byte limit, so let them all re-check.
+		self.not_full.notify_all()
+		return item
+
+	def qbytes(self):
+		with self.mutex:
+			return self.bytes
+
+	def put_many(self, items):
+		'''
+		Put every item in `items` into the queue. Blocks while the queue is
+		full, if it has a maxsize.
+		'''
+		count = 0
+		with self.not_full:
+			for item in items:
+				if self.maxsize > 0:
+					while self._qsize() >= self.maxsize:
+						self.not_full.wait()
+				self._put(item)
+				count += 1
+			if count:
+				self.unfinished_tasks += count
+				self.not_empty.notify(count)
+		return count
+
+	def put_front(self, items):
+		'''
+		Put `items` back at the head of the queue, in order, ahead of
+		anything already queued. Ignores maxsize, as the items were in the
+		queue before.
+		'''
+		items = list(items)
+		with self.not_full:
+			for item in reversed(items):
+				self._put_front(item)
+				self.bytes += _sizeof(item)
+			if items:
+				self.unfinished_tasks += len(items)
+				self.not_empty.notify(len(items))
+		return len(items)
+
+	def _put_front(self, item):
+		self.queue.appendleft(item)
+
+	def get_many(self, max_n, timeout=None):
+		'''
+		Remove and return up to `max_n` items as a list.
+
+		If `timeout` is None, doesn't block, and may return an empty list.
+		Otherwise, blocks for up to `timeout` seconds for at least one item
+		to become available.
+		'''
+		with self.not_empty:
+			if timeout is not None:
+				endtime = time.monotonic() + timeout
+				while not self._qsize():
+					remaining = endtime - time.monotonic()
+					if remaining <= 0.0:
+						break
+					self.not_empty.wait(remaining)
+
+			ret = []
+			while self._qsize() and len(ret) < max_n:
+				ret.append(self._get())
+			return ret
+
+	def wait_below(self, size, timeout=None):
+		'''
+		Block until the queue holds no more than `size` items. Returns
+		False if `timeout` passed first.
+		'''
+		return self.wait_for_room(max_items=size, timeout=timeout)
+
+	def wait_for_room(self, max_items=None, max_bytes=None, timeout=None):
+		'''
+		Block until the queue holds no more than `max_items` items and
+		`max_bytes` bytes (either can be None for no limit). Returns False
+		if `timeout` passed first.
+		'''
+		def has_room():
+			if max_items is not None and self._qsize() > max_items:
+				return False
+			if max_bytes is not None and self.bytes > max_bytes:
+				return False
+			return True
+
+		with self.not_full:
+			return self.not_full.wait_for(has_room, timeout)
+
+	def put_within(self, item, max_bytes, timeout=None, cancelled=None):
+		'''
+		Put `item` once it fits without taking the queue over `max_bytes`
+		bytes (or, for an item bigger than that on its own, once the queue
+		is empty). The check and the put happen under the one lock, so two
+		producers can't both claim the same room. Returns False, without
+		queueing the item, if `timeout` passed first, or if `cancelled()`
+		returned True by the time there was room.
+		'''
+		room = max(0, max_bytes - _sizeof(item))
+		def has_room():
+			if self.maxsize > 0 and self._qsize() >= self.maxsize:
+				return False
+			return self.bytes <= room
+
+		with self.not_full:
+			if not self.not_full.wait_for(has_room, timeout):
+				return False
+			if cancelled is not None and cancelled():
+				return False
+			self._put(item)
+			self.unfinished_tasks += 1
+			self.not_empty.notify()
+			return True
+
+	def published(self, items):
+		'''
+		Called by the interface thread once the broker has taken `items`
+		(confirmed them, with publisher confirms). Nothing to do here;
+		`SpoolQueue` uses it to move its cursor.
+		'''
+		pass
+
+
+class PriorityBatchQueue(BatchQueue):
+	'''
+	BatchQueue that hands out items with a higher `priority` attribute
+	first, and items of the same priority in FIFO order. Items without a
+	priority count as 0.
+	'''
+
+	def _init(self, maxsize):
+		super()._init(maxsize)
+		# Heap of (-priority, sequence, item).
+		self.queue = []
+		self.seq   = itertools.count()
+		# put_front() items go ahead of everything else at their priority.
+		self.front = itertools.count(-1, -1)
+
+	def _qsize(self):
+		return len(self.queue)
+
+	def _put(self, item):
+		heapq.heappush(self.queue, (-(getattr(item, 'priority', None) or 0), next(self.seq), item))
+		self.bytes += _sizeof(item)
+
+	def _put_front(self, item):
+		heapq.heappush(self.queue, (-(getattr(item, 'priority', None) or 0), next(self.front), item))
+
+	def _get(self):
+		item = heapq.heappop(self.queue)[2]
+		self.bytes -= _sizeof(item)
+		self.not_full.notify_all()
+		return item
@@ -0,0 +1,166 @@
+import concurrent.futures
+import heapq
+import logging
+import threading
+import time
+import uuid
+
+class RpcClient:
+	'''
+	Request/response on top of a master `Connector`.
+
+	`submit()` publishes a task with a fresh `correlation_id` and returns a
+	`concurrent.futures.Future`, which a background thread resolves with the
+	body of the response carrying the same id. Workers echo the id when
+	they pass the Delivery they answer as `ack` (see `Connector.putMessage()`).
+
+	At most `max_in_flight` requests are outstanding at once; `submit()`
+	blocks for a free slot past that. Requests that aren't answered within
+	their timeout fail with `TimeoutError`, and any response that turns up
+	for them later is dropped.
+
+	The client takes over fetching from the connector, so don't call
+	`getMessage()` on it as well. From asyncio code, wrap the returned
+	futures with `asyncio.wrap_future()` to await them.
+	'''
+
+	def __init__(self, connector, max_in_flight=1000, timeout=None):
+		if not connector.master:
+			raise ValueError("RPC requests can only be submitted from a master connector!")
+
+		self.log           = logging.getLogger("Main.Connector.Rpc")
+		self.connector     = connector
+		self.max_in_flight = max_in_flight
+		self.timeout       = timeout
+
+		self.lock      = threading.Lock()
+		self.slot_free = threading.Condition(self.lock)
+		# correlation id -> Future
+		self.pending   = {}
+		# (deadline, correlation id) heap
+		self.deadlines = []
+		self.running   = True
+
+		self.completed = 0
+		self.timed_out = 0
+		self.orphaned  = 0
+
+		self.thread = threading.Thread(target=self._collectResponses, daemon=True)
+		self.thread.start()
+
+	def submit(self, body, timeout=None, serializer=None, priority=None):
+		'''
+		Publish `body` as a task, and return a Future for the response.
+		`timeout` (seconds) overrides the client default for this request.
+		It's also the task's ttl, so workers skip it once nobody is waiting.
+		'''
+		cid = uuid.uuid4().hex
+		future = concurrent.futures.Future()
+		timeout = self.timeout if timeout is None else timeout
+
+		with self.lock:
+			while self.running and len(self.pending) >= self.max_in_flight:
+				self.slot_free.wait()
+			if not self.running:
+				raise RuntimeError("RPC client is closed!")
+			self.pending[cid] = future
+			if timeout is not None:
+				heapq.heappush(self.deadlines, (time.monotonic() + timeout, cid))
+
+		# Cancelling a request frees its slot straight away.
+		future.add_done_callback(lambda tmp: tmp.cancelled() and self._forget(cid))
+		try:
+			self.connector.putMessage(body, serializer=serializer, correlation_id=cid, priority=priority, ttl=timeout)
+		except Exception as e:
+			# Nothing was published, so no response is coming. Give the slot back.
+			self._forget(cid)
+			if not future.done():
+				future.set_exception(e)
+			raise
+		return future
+
+	def call(self, body, timeout=None, serializer=None, priority=None):
+		'''
+		Submit a request, and block until its response arrives.
+		'''
+		return self.submit(body, timeout=timeout, serializer=serializer, priority=priority).result()
+
+	def _forget(self, cid):
+		with self.lock:
+			self._release(cid)
+
+	def _release(self, cid):
+		# Caller holds the lock.
+		future = self.pending.pop(cid, None)
+		self.slot_free.notify()
+		return future
+
+	def _expire(self):
+		now = time.monotonic()
+		expired = []
+		with self.lock:
+			while self.deadlines and self.deadlines[0][0] <= now:
+				_, cid = heapq.heappop(self.deadlines)
+				future = self._release(cid)
+				if future:
+					expired.append(future)
+					self.timed_out += 1
+		for future in expired:
+			try:
+				future.set_exception(TimeoutError("No response within the request timeout"))
+			except concurrent.futures.InvalidStateError:
+				# Cancelled in the meantime.
+				pass
+
+	def _resolve(self, delivery):
+		cid = delivery.correlation_id
+		with self.lock:
+			future = self._release(cid) if cid else None
+			if future:
+				self.completed += 1
+			else:
+				self.orphaned += 1
+
+		if future is None:
+			self.log.warning("Dropping response with unknown correlation id '%s' (timed out, or not ours?)", cid)
+		else:
+			try:
+				future.set_result(delivery.body)
+			except concurrent.futures.InvalidStateError:
+				pass
+		delivery.ack()
+
+	def _collectResponses(self):
+		'''
+		Response thread. Matches responses to their futures, and expires
+		requests past their deadline.
+		'''
+		while self.running:
+			try:
+				deliveries = self.connector._fetch(self.max_in_flight, timeout=self.connector.poll_rate)
+			except ValueError:
+				# Session fetch limit reached.
+				deliveries = []
+				time.sleep(self.connector.poll_rate)
+			for delivery in deliveries:
+				self._resolve(delivery)
+			self._expire()
+
+	def close(self):
+		'''
+		Stop collecting responses, and cancel every outstanding request.
+		'''
+		with self.lock:
+			self.running = False
+			pending, self.pending = self.pending, {}
+			self.deadlines = []
+			self.slot_free.notify_all()
+		self.thread.join()
+		for future in pending.values():
+			future.cancel()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
@@ -0,0 +1,81 @@
+import json
+import logging
+import marshal
+import pickle
+
+log = logging.getLogger("Main.Connector.Serializers")
+
+RAW = 'application/octet-stream'
+
+def _json_dumps(obj):
+	return json.dumps(obj, separators=(',', ':')).encode("utf-8")
+
+def _pickle_dumps(obj):
+	return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+# content_type value -> (dumps(obj), loads(body)). Raw bodies go through untouched.
+SERIALIZERS = {
+	RAW                            : (None,          None),
+	'application/json'             : (_json_dumps,   json.loads),
+	'application/x-python-pickle'  : (_pickle_dumps, pickle.loads),
+	'application/x-python-marshal' : (marshal.dumps, marshal.loads),
+}
+
+# Short names accepted for the `serializer` connector and putMessage() arguments.
+ALIASES = {
+	'raw'     : RAW,
+	'bytes'   : RAW,
+	'json'    : 'application/json',
+	'pickle'  : 'application/x-python-pickle',
+	'marshal' : 'application/x-python-marshal',
+}
+
+# Content types deserialized unless `accept_content` says otherwise.
+# Unpickling runs arbitrary code, and marshal isn't safe against malformed
+# input, so both have to be opted into explicitly.
+DEFAULT_ACCEPT = (RAW, 'application/json')
+
+def get_content_type(name):
+	'''
+	Resolve a serializer name (or full content type) to its content type.
+	'''
+	if name is None:
+		return None
+	name = ALIASES.get(name, name)
+	if name not in SERIALIZERS:
+		raise ValueError("Unknown serializer: '%s'. Valid options: %s" % (name, sorted(ALIASES)))
+	return name
+
+def dumps(message, content_type):
+	'''
+	Serialize `message` as `content_type`. Returns (body, content_type), where
+	content_type is None if no serializer was requested.
+	'''
+	if content_type is None:
+		return message, None
+	encode = SERIALIZERS[content_type][0]
+	if encode is None:
+		if isinstance(message, str):
+			message = message.encode("utf-8")
+		return message, content_type
+	return encode(message), content_type
+
+def loads(body, properties, accept, as_memoryview=False):
+	'''
+	Deserialize a received body according to `properties['content_type']`,
+	if that's a known type listed in `accept`. A body that fails to decode
+	raises whatever its decoder raised.
+
+	Anything else (raw bodies, and unknown or unaccepted types) is returned
+	as-is, wrapped in a memoryview if `as_memoryview` is set.
+	'''
+	content_type = properties.get('content_type') if properties else None
+	decode = SERIALIZERS[content_type][1] if content_type in SERIALIZERS else None
+	if decode is not None:
+		if content_type in accept:
+			return decode(body)
+		log.warning("Received %s message, which isn't in accept_content. Passing it through as bytes.", content_type)
+
+	if as_memoryview and isinstance(body, (bytes, bytearray)):
+		return memoryview(body)
+	return body
@@ -0,0 +1,82 @@
+import hashlib
+import itertools
+import threading
+
+def shard_queue_name(task_queue_name, shard):
+	'''
+	Name of task queue shard `shard`. Shard 0 is the plain task queue, so
+	an unsharded setup is just shard 0 of 1.
+	'''
+	if shard == 0:
+		return task_queue_name
+	return "%s-shard%d.q" % (task_queue_name[:-2], shard)
+
+def routing_key(queue_name):
+	# Same convention as the unsharded queues.
+	return queue_name.split(".")[0]
+
+def shard_routing_key(task_queue_name, shard):
+	'''
+	Routing key task queue shard `shard` is bound with. The shard number is
+	added to the unsharded key rather than derived from the shard's queue
+	name, as a dotted task queue name would give every shard the same key.
+	'''
+	if shard == 0:
+		return routing_key(task_queue_name)
+	return "%s-shard%d" % (routing_key(task_queue_name), shard)
+
+def key_hash(key):
+	'''
+	Stable 64 bit hash of a shard key. `hash()` is salted per process, so
+	it can't be used to route consistently across masters.
+	'''
+	if isinstance(key, str):
+		key = key.encode("utf-8")
+	elif not isinstance(key, (bytes, bytearray)):
+		key = repr(key).encode("utf-8")
+	return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big")
+
+def jump_hash(key, buckets):
+	'''
+	Jump consistent hash (Lamping & Veach). Maps a 64 bit key to one of
+	`buckets` buckets, such that growing from n to n+1 buckets only moves
+	1/(n+1) of the keys, all of them into the new bucket.
+	'''
+	b, j = -1, 0
+	while j < buckets:
+		b = j
+		key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+		j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+	return b
+
+
+class ShardRouter:
+	'''
+	Picks the task queue shard for each outgoing task: by consistent hash
+	of the shard key if one is given, round-robin otherwise.
+	'''
+
+	def __init__(self, task_queue_name, shards):
+		self.task_queue_name = task_queue_name
+		self.lock   = threading.Lock()
+		self.rr     = itertools.count()
+		self.resize(shards)
+
+	def resize(self, shards):
+		if shards < 1:
+			raise ValueError("There must be at least one task shard!")
+		keys = [shard_routing_key(self.task_queue_name, shard) for shard in range(shards)]
+		with self.lock:
+			self.shards = shards
+			self.keys   = keys
+
+	def route(self, shard_key=None):
+		'''
+		Return the routing key of the shard to publish a task to.
+		'''
+		with self.lock:
+			if self.shards == 1:
+				return self.keys[0]
+			if shard_key is None:
+				return self.keys[next(self.rr) % self.shards]
+			return self.keys[jump_hash(key_hash(shard_key), self.shards)]
@@ -0,0 +1,280 @@
+import collections
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+from . import queues
+from .delivery import Outgoing
+
+# Record header: metadata length, body length, crc32 of both. The metadata
+# is JSON: [properties, routing key].
+RECORD = struct.Struct("!III")
+
+class Spool:
+	'''
+	Append-only on-disk message log, split into numbered segment files.
+
+	Records are appended to the newest segment, and a new segment is
+	started once it passes `segment_size` bytes. Reads use mmap, and go
+	through an in-memory read position. The cursor (segment, offset) saved
+	to disk only moves when the caller commits a position, once the records
+	before it are safely published. Segments are deleted once the saved
+	cursor is past them.
+
+	On startup the cursor is loaded and the records after it counted, so
+	anything left by a previous process, including records it had read but
+	not committed, is picked up again. A torn record
+	at the end of the last segment (from a crash mid-write) is truncated.
+
+	Not thread safe; `SpoolQueue` only calls it with its mutex held.
+	'''
+
+	def __init__(self, directory, segment_size=64 * 1024 * 1024):
+		self.log          = logging.getLogger("Main.Connector.Spool")
+		self.directory    = directory
+		self.segment_size = segment_size
+		os.makedirs(directory, exist_ok=True)
+
+		segments = self._segments()
+		self.read_seg, self.read_off = self._loadCursor(segments[0] if segments else 0)
+		self.saved_seg = self.read_seg
+
+		# Anything before the cursor was read by a previous process.
+		for seg in segments:
+			if seg < self.read_seg:
+				os.remove(self._path(seg))
+		segments = [seg for seg in segments if seg >= self.read_seg]
+
+		self.write_seg = segments[-1] if segments else self.read_seg
+		self.count = 0
+		for seg in segments:
+			self.count += self._countRecords(seg, self.read_off if seg == self.read_seg else 0, truncate=seg == self.write_seg)
+		if self.count:
+			self.log.info("Resuming spool in '%s' with %s message(s) pending.", directory, self.count)
+
+		self.writer = open(self._path(self.write_seg), "ab")
+
+	def _segments(self):
+		return sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".seg"))
+
+	def _path(self, seg):
+		return os.path.join(self.directory, "%010d.seg" % seg)
+
+	def _loadCursor(self, default_seg):
+		try:
+			with open(os.path.join(self.directory, "cursor"), "r") as fp:
+				seg, off = fp.read().split()
+				return int(seg), int(off)
+		except (OSError, ValueError):
+			return default_seg, 0
+
+	def _saveCursor(self, seg, off):
+		path = os.path.join(self.directory, "cursor")
+		with open(path + ".tmp", "w") as fp:
+			fp.write("%s %s" % (seg, off))
+		os.replace(path + ".tmp", path)
+
+	@staticmethod
+	def _parse(buf, offset):
+		'''
+		Decode the record at `offset`. Returns ((body, properties, routing
+		key), next offset), or (None, offset) if the record is incomplete or
+		corrupt.
+		'''
+		if offset + RECORD.size > len(buf):
+			return None, offset
+		props_len, body_len, crc = RECORD.unpack_from(buf, offset)
+		start = offset + RECORD.size
+		end   = start + props_len + body_len
+		if end > len(buf):
+			return None, offset
+		data = buf[start:end]
+		if zlib.crc32(data) != crc:
+			return None, offset
+		properties, routing_key = json.loads(data[:props_len].decode("utf-8"))
+		return (data[props_len:], properties, routing_key), end
+
+	def _countRecords(self, seg, offset, truncate):
+		path = self._path(seg)
+		size = os.path.getsize(path)
+		if size <= offset:
+			return 0
+		count = 0
+		with open(path, "rb") as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+			while offset < size:
+				rec, nxt = self._parse(buf, offset)
+				if rec is None:
+					break
+				count += 1
+				offset = nxt
+		if offset < size:
+			if truncate:
+				self.log.warning("Truncating %s bytes of incomplete data from the end of '%s'.", size - offset, path)
+				os.truncate(path, offset)
+			else:
+				self.log.error("Corrupt record in '%s' at offset %s! The rest of the segment will be skipped.", path, offset)
+		return count
+
+	def append(self, body, properties, routing_key=None):
+		if isinstance(body, str):
+			body = body.encode("utf-8")
+		props = json.dumps([properties, routing_key]).encode("utf-8")
+		data  = props + bytes(body)
+		self.writer.write(RECORD.pack(len(props), len(body), zlib.crc32(data)))
+		self.writer.write(data)
+		# Flushed to the OS, so it survives the process dying, if not the machine.
+		self.writer.flush()
+		self.count += 1
+
+		if self.writer.tell() >= self.segment_size:
+			self.writer.close()
+			self.write_seg += 1
+			self.writer = open(self._path(self.write_seg), "ab")
+
+	def read(self, max_n, max_bytes=None):
+		'''
+		Return up to `max_n` (body, properties, routing key, position)
+		records, oldest first, stopping once their bodies add up to
+		`max_bytes`, if given (at least one record is always returned).
+		`position` is where the record ends, to pass to `commit()` once it's
+		published. Until then, a restarted Spool reads it again.
+		'''
+		ret = []
+		nbytes = 0
+		while self.count and len(ret) < max_n:
+			path = self._path(self.read_seg)
+			size = os.path.getsize(path)
+			if self.read_off < size:
+				with open(path, "rb") as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+					while self.read_off < size and len(ret) < max_n:
+						rec, nxt = self._parse(buf, self.read_off)
+						if rec is None:
+							# Already reported when it was counted.
+							self.read_off = size
+							break
+						if max_bytes is not None and ret and nbytes + len(rec[0]) > max_bytes:
+							return ret
+						ret.append(rec + ((self.read_seg, nxt), ))
+						nbytes += len(rec[0])
+						self.read_off = nxt
+						self.count -= 1
+
+			if self.read_off >= size and self.read_seg < self.write_seg:
+				self.read_seg += 1
+				self.read_off  = 0
+			elif self.read_off >= size:
+				# Anything counted but unreadable is gone.
+				self.count = 0
+
+		return ret
+
+	def commit(self, position):
+		'''
+		Save the cursor at `position` (from `read()`), so a restarted Spool
+		doesn't read anything before it again, and delete the segments
+		before it.
+		'''
+		seg, off = position
+		self._saveCursor(seg, off)
+		while self.saved_seg < seg:
+			try:
+				os.remove(self._path(self.saved_seg))
+			except FileNotFoundError:
+				pass
+			self.saved_seg += 1
+
+	def close(self):
+		self.writer.close()
+
+
+class SpoolQueue(queues.BatchQueue):
+	'''
+	Outgoing queue that keeps at most `max_items` messages (and
+	`max_bytes` bytes, if set) in memory, and spools the rest to a `Spool`
+	in `directory`. Once anything has been spooled, new messages go to
+	disk behind it until it's drained, so ordering is kept.
+
+	Spooled messages are read back `refill_size` at a time (and no more
+	than `max_bytes`). The spool's cursor only moves past a message once
+	the connector reports it published (see `published()`), so if the
+	process dies, anything read back but not yet published is read again
+	by the next Connector, and may be published twice.
+
+	`close()` moves whatever is still in memory to disk (after the spooled
+	messages, so across a restart ordering isn't kept), so nothing queued is
+	lost on shutdown, and it's published by the next Connector using the
+	same directory.
+	'''
+
+	bounded_memory = True
+
+	def __init__(self, directory, max_items=10000, max_bytes=None, segment_size=64 * 1024 * 1024, refill_size=100):
+		self.spool       = Spool(directory, segment_size)
+		self.max_items   = max_items
+		self.max_bytes   = max_bytes
+		self.refill_size = refill_size
+		# Spool position of every message read back and not yet published,
+		# in spool order -> whether it's been published.
+		self.outstanding = collections.OrderedDict()
+		super().__init__()
+
+	def _qsize(self):
+		return len(self.queue) + self.spool.count
+
+	def _put(self, item):
+		if self.spool.count or len(self.queue) >= self.max_items or (
+				self.max_bytes is not None and self.bytes + queues._sizeof(item) > self.max_bytes):
+			self.spool.append(item.body, item.properties, item.routing_key)
+			# A message read back from the spool and nacked is on disk
+			# again, so its old record needn't hold the cursor back.
+			self._settle([item])
+		else:
+			super()._put(item)
+
+	def _get(self):
+		if not self.queue:
+			for body, properties, routing_key, position in self.spool.read(min(self.max_items, self.refill_size), self.max_bytes):
+				item = Outgoing(body, properties, routing_key)
+				item.spool_position = position
+				self.outstanding[position] = False
+				super()._put(item)
+		return super()._get()
+
+	def published(self, items):
+		with self.mutex:
+			self._settle(items)
+
+	def _settle(self, items):
+		# Caller holds the mutex. Commits the spool up to the first message
+		# read back that still isn't published.
+		for item in items:
+			if item.spool_position in self.outstanding:
+				self.outstanding[item.spool_position] = True
+		position = None
+		while self.outstanding:
+			head, done = next(iter(self.outstanding.items()))
+			if not done:
+				break
+			self.outstanding.popitem(last=False)
+			position = head
+		if position is not None:
+			self.spool.commit(position)
+
+	def spooled(self):
+		with self.mutex:
+			return self.spool.count
+
+	def close(self):
+		with self.mutex:
+			if self.queue:
+				self.spool.log.info("Spooling %s in-memory message(s) to disk on shutdown.", len(self.queue))
+			while self.queue:
+				item = super()._get()
+				# Messages read back from the spool are still on disk past the
+				# cursor, so they'd be published twice if appended again.
+				if item.spool_position not in self.outstanding:
+					self.spool.append(item.body, item.properties, item.routing_key)
+			self.spool.close()
@@ -0,0 +1,122 @@
+import threading
+import time
+
+def _freeze(arguments):
+	if not arguments:
+		return None
+	return tuple(sorted((key, repr(val)) for key, val in arguments.items()))
+
+
+class TopologyCache:
+	'''
+	Process-wide record of the exchanges, queues and bindings already
+	declared on each broker (transport, host and vhost), so reconnecting
+	and newly started Connectors in the same process can skip declares
+	the broker has already seen.
+
+	Declares are idempotent, so skipping one only matters if the broker has
+	lost the entity since. To limit that:
+	 - auto-delete entities are never cached, as they can vanish at any time,
+	 - entries expire after the caller's ttl,
+	 - when a connection breaks, the non-durable entries for its broker are
+	   forgotten (the broker may have restarted), and
+	 - when a connection breaks before it got going, everything for its
+	   broker is forgotten (a skipped declare may be why it broke).
+	'''
+
+	def __init__(self):
+		self.lock    = threading.Lock()
+		# target key -> {entity : (declared at, durable)}
+		self.targets = {}
+
+	@staticmethod
+	def key(config):
+		return (
+			config['transport'] if callable(config['transport']) else str(config['transport']),
+			config['host'],
+			config['virtual_host'],
+		)
+
+	def known(self, key, entity, ttl):
+		with self.lock:
+			entry = self.targets.get(key, {}).get(entity)
+			return entry is not None and time.monotonic() - entry[0] < ttl
+
+	def add(self, key, entity, durable):
+		with self.lock:
+			self.targets.setdefault(key, {})[entity] = (time.monotonic(), durable)
+
+	def forget(self, key, durable=False):
+		'''
+		Forget the non-durable entities declared on `key`, or all of them if
+		`durable` is true.
+		'''
+		with self.lock:
+			entities = self.targets.get(key)
+			if not entities:
+				return
+			if durable:
+				del self.targets[key]
+				return
+			for entity in [tmp for tmp, (_, is_durable) in entities.items() if not is_durable]:
+				del entities[entity]
+
+	def clear(self):
+		with self.lock:
+			self.targets = {}
+
+
+_cache = TopologyCache()
+
+def get_cache():
+	return _cache
+
+
+class Declarer:
+	'''
+	Declares exchanges, queues and bindings on `channel`, skipping the ones
+	`TopologyCache` says are already there. Counts what was sent to the
+	broker and what was skipped.
+
+	With a falsy `ttl`, everything is declared.
+	'''
+
+	def __init__(self, channel, config, ttl):
+		self.channel = channel
+		self.key     = TopologyCache.key(config)
+		self.ttl     = ttl
+		self.sent    = 0
+		self.cached  = 0
+
+	def _needed(self, entity, cacheable):
+		if cacheable and self.ttl and _cache.known(self.key, entity, self.ttl):
+			self.cached += 1
+			return False
+		self.sent += 1
+		return True
+
+	def exchange(self, exchange, exchange_type, durable=False, auto_delete=False, arguments=None):
+		entity = ('exchange', exchange, exchange_type, durable, auto_delete, _freeze(arguments))
+		if self._needed(entity, not auto_delete):
+			self.channel.exchange_declare(exchange, exchange_type=exchange_type, auto_delete=auto_delete, durable=durable, arguments=arguments)
+			if not auto_delete:
+				_cache.add(self.key, entity, durable)
+
+	def queue(self, queue, durable=False, auto_delete=False, arguments=None):
+		entity = ('queue', queue, durable, auto_delete, _freeze(arguments))
+		if self._needed(entity, not auto_delete):
+			self.channel.queue_declare(queue, auto_delete=auto_delete, durable=durable, arguments=arguments)
+			if not auto_delete:
+				_cache.add(self.key, entity, durable)
+
+	def bind(self, queue, exchange, routing_key, durable=False, auto_delete=False):
+		'''
+		Bind `queue` to `exchange`. `durable` and `auto_delete` describe the
+		binding's queue and exchange: it's durable if both of them are, and
+		gone if either is auto-deleted.
+		'''
+		entity = ('bind', queue, exchange, routing_key)
+		if self._needed(entity, not auto_delete):
+			self.channel.queue_bind(queue, exchange=exchange, routing_key=routing_key)
+			if not auto_delete:
+				_cache.add(self.key, entity, durable)
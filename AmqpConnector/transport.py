@@ -0,0 +1,218 @@
+import rabbitpy
+import urllib.parse
+import logging
+
+class Transport:
+	'''
+	A single connection to a broker.
+
+	`ConnectorManager` only talks to the broker through this interface (and
+	the `TransportChannel` objects it hands out), so the wire library can be
+	swapped out. Subclasses are constructed with the connector config dict,
+	and shouldn't touch the network until `connect()` is called.
+	'''
+
+	def __init__(self, config):
+		self.config = config
+
+	def connect(self):
+		raise NotImplementedError
+
+	def channel(self):
+		'''
+		Open and return a new `TransportChannel` on this connection.
+		'''
+		raise NotImplementedError
+
+	def close(self):
+		raise NotImplementedError
+
+
+class TransportChannel:
+	'''
+	A channel on a `Transport` connection. Method names and arguments follow
+	the AMQP methods they map to.
+
+	Messages yielded by `consume()` must provide `body`, `properties`,
+	`delivery_tag` and `redelivered`, plus `ack()` and `nack(requeue)`,
+	the same as a `rabbitpy.Message`.
+	'''
+
+	def exchange_declare(self, exchange, exchange_type='direct', durable=False, auto_delete=False, arguments=None):
+		raise NotImplementedError
+
+	def queue_declare(self, queue, durable=False, auto_delete=False, arguments=None):
+		raise NotImplementedError
+
+	def queue_bind(self, queue, exchange, routing_key=''):
+		raise NotImplementedError
+
+	def queue_purge(self, queue):
+		raise NotImplementedError
+
+	def basic_qos(self, prefetch_count):
+		raise NotImplementedError
+
+	def confirm_select(self):
+		raise NotImplementedError
+
+	def wait_for_confirm(self):
+		'''
+		Block until the broker confirms a publish.
+		Returns a (acked, delivery_tag, multiple) tuple.
+		'''
+		raise NotImplementedError
+
+	def basic_publish(self, exchange, routing_key, body, properties=None):
+		raise NotImplementedError
+
+	def basic_ack(self, delivery_tag, multiple=False):
+		raise NotImplementedError
+
+	def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+		raise NotImplementedError
+
+	def consume(self, queue, no_ack=False):
+		'''
+		Start consuming from `queue`. Returns an iterator of messages that
+		ends once `stop_consuming()` is called.
+		'''
+		raise NotImplementedError
+
+	def stop_consuming(self):
+		raise NotImplementedError
+
+	def close(self):
+		raise NotImplementedError
+
+
+class RabbitpyTransport(Transport):
+	'''
+	Transport backed by a real broker, through `rabbitpy`.
+	'''
+
+	def __init__(self, config):
+		super().__init__(config)
+		self.log = logging.getLogger("Main.Connector.Transport")
+		self.connection = None
+
+	def _build_uri(self):
+
+		host, port = self.config['host'].split(":")
+
+		query = {
+			'heartbeat'            : self.config['heartbeat'],
+			'connection_timeout'   : self.config['socket_timeout'],
+		}
+
+		if self.config['sslopts']:
+			scheme = 'amqps'
+			query.update({
+				'cacertfile'           :self.config['sslopts']['ca_certs'],
+				'certfile'             :self.config['sslopts']['certfile'],
+				'keyfile'              :self.config['sslopts']['keyfile'],
+
+				'verify'               : 'ignore',
+				})
+		else:
+			scheme = 'amqp'
+
+		return '{scheme}://{username}:{password}@{host}:{port}/{virtual_host}?{query_str}'.format(
+			scheme       = scheme,
+			username     = self.config['userid'],
+			password     = self.config['password'],
+			host         = host,
+			port         = port,
+			virtual_host = self.config['virtual_host'],
+			query_str    = urllib.parse.urlencode(query),
+			)
+
+	def connect(self):
+		self.connection = rabbitpy.Connection(self._build_uri())
+
+	def channel(self):
+		return RabbitpyChannel(self.connection.channel(blocking_read = True))
+
+	def close(self):
+		try:
+			self.connection.close()
+		except rabbitpy.exceptions.RabbitpyException as e:
+			# We don't really care about exceptions on teardown
+			self.log.error("Error on connection teardown!")
+			self.log.error("	%s", e)
+
+
+class RabbitpyChannel(TransportChannel):
+
+	def __init__(self, channel):
+		self.channel  = channel
+		self.amqp     = rabbitpy.AMQP(channel)
+		self.consumer = None
+
+	def exchange_declare(self, exchange, exchange_type='direct', durable=False, auto_delete=False, arguments=None):
+		self.amqp.exchange_declare(exchange, exchange_type=exchange_type, auto_delete=auto_delete, durable=durable, arguments=arguments)
+
+	def queue_declare(self, queue, durable=False, auto_delete=False, arguments=None):
+		self.amqp.queue_declare(queue, auto_delete=auto_delete, durable=durable, arguments=arguments)
+
+	def queue_bind(self, queue, exchange, routing_key=''):
+		self.amqp.queue_bind(queue, exchange=exchange, routing_key=routing_key)
+
+	def queue_purge(self, queue):
+		self.amqp.queue_purge(queue)
+
+	def basic_qos(self, prefetch_count):
+		self.amqp.basic_qos(
+				prefetch_size  = 0,
+				prefetch_count = prefetch_count,
+				global_flag    = False
+			)
+
+	def confirm_select(self):
+		# Note: this deliberately doesn't go through
+		# `Channel.enable_publisher_confirms()`, as that makes every publish
+		# block on its own confirm.
+		self.amqp.confirm_select()
+
+	def wait_for_confirm(self):
+		frame = self.channel.wait_for_confirmation()
+		return frame.name == 'Basic.Ack', frame.delivery_tag, frame.multiple
+
+	def basic_publish(self, exchange, routing_key, body, properties=None):
+		if isinstance(body, memoryview):
+			body = body.tobytes()
+		self.amqp.basic_publish(body=body, exchange=exchange, routing_key=routing_key, properties=properties or {})
+
+	def basic_ack(self, delivery_tag, multiple=False):
+		self.amqp.basic_ack(delivery_tag=delivery_tag, multiple=multiple)
+
+	def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+		self.amqp.basic_nack(delivery_tag=delivery_tag, multiple=multiple, requeue=requeue)
+
+	def consume(self, queue, no_ack=False):
+		self.consumer = rabbitpy.Queue(self.channel, queue)
+		return self.consumer.consume(no_ack=no_ack)
+
+	def stop_consuming(self):
+		if self.consumer:
+			self.consumer.stop_consuming()
+
+	def close(self):
+		self.channel.close()
+
+
+def get_transport(transport):
+	'''
+	Resolve the `transport` connector option to a `Transport` factory.
+	Either a registered backend name, or a callable taking the config dict.
+	'''
+	if callable(transport):
+		return transport
+
+	if transport == 'rabbitpy':
+		return RabbitpyTransport
+	if transport == 'loopback':
+		from . import loopback
+		return loopback.LoopbackTransport
+
+	raise ValueError("Unknown transport: '%s'" % (transport, ))
@@ -37,7 +37,7 @@ setup(
 	author_email="github@imaginaryindustries.com",
 
 	# Packages
-	packages=["AmqpConnector"],
+	packages=["AmqpConnector", "AmqpConnector.bench"],
 
 	# Include additional files into the package
 	include_package_data=True,
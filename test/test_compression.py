@@ -0,0 +1,42 @@
+import os
+import unittest
+
+from AmqpConnector import compression
+
+
+class TestCompression(unittest.TestCase):
+
+	def test_codec_names(self):
+		self.assertEqual(compression.get_encoding('zlib'), 'deflate')
+		self.assertEqual(compression.get_encoding('lzma'), 'xz')
+		self.assertIsNone(compression.get_encoding(None))
+		with self.assertRaises(ValueError):
+			compression.get_encoding('snappy')
+
+	def test_round_trips(self):
+		body = b'the same few words, over and over. ' * 100
+		for encoding in compression.CODECS:
+			packed, got = compression.compress(body, encoding)
+			self.assertEqual(got, encoding)
+			self.assertLess(len(packed), len(body))
+			unpacked, properties = compression.decompress(packed, {'content_encoding' : encoding, 'priority' : 3})
+			self.assertEqual(unpacked, body)
+			self.assertEqual(properties, {'priority' : 3})
+
+	def test_threshold(self):
+		body = b'a' * 100
+		self.assertEqual(compression.compress(body, 'deflate', threshold=101), (body, None))
+		self.assertEqual(compression.compress(body, 'deflate', threshold=100)[1], 'deflate')
+
+	def test_incompressible_bodies_are_left_alone(self):
+		body = os.urandom(2000)
+		self.assertEqual(compression.compress(body, 'deflate'), (body, None))
+
+	def test_unknown_encodings_pass_through(self):
+		properties = {'content_encoding' : 'br'}
+		self.assertEqual(compression.decompress(b'as is', properties), (b'as is', properties))
+		self.assertEqual(compression.decompress(b'as is', None), (b'as is', None))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,605 @@
+
+import asyncio
+import collections
+import gc
+import itertools
+import os
+import threading
+import time
+import unittest
+import urllib.request
+
+import AmqpConnector
+from AmqpConnector import aio
+from AmqpConnector import loopback
+from AmqpConnector import procpool
+
+_vhosts = itertools.count()
+
+
+class LoopbackTestCase(unittest.TestCase):
+	'''
+	Runs connectors against a fresh in-process loopback broker per test.
+	'''
+
+	def setUp(self):
+		self.vhost = "test-%s" % next(_vhosts)
+		self.connectors = []
+
+	def tearDown(self):
+		for con in self.connectors:
+			con.stop()
+		loopback.reset_brokers()
+
+	def config(self, **kwargs):
+		config = dict(
+				host                     = 'loop',
+				virtual_host             = self.vhost,
+				transport                = 'loopback',
+				poll_rate                = 0.02,
+				hearbeat_packet_interval = None,
+				reconnect_delay          = 0.02,
+			)
+		config.update(kwargs)
+		return config
+
+	def connector(self, master, **kwargs):
+		con = AmqpConnector.Connector(master=master, **self.config(**kwargs))
+		self.connectors.append(con)
+		return con
+
+	def broker(self):
+		return loopback.get_broker('loop:5672', self.vhost)
+
+	def wait_for_queue(self, name, timeout=2):
+		deadline = time.monotonic() + timeout
+		while name not in self.broker().queues:
+			self.assertLess(time.monotonic(), deadline, "Queue '%s' was never declared." % name)
+			time.sleep(0.01)
+
+	def fetch(self, con, count, timeout=2):
+		ret = []
+		deadline = time.monotonic() + timeout
+		while len(ret) < count and time.monotonic() < deadline:
+			ret.extend(con.getMessages(count - len(ret), timeout=0.05))
+		return ret
+
+
+class TestRoundTrip(LoopbackTestCase):
+
+	def test_tasks_and_responses(self):
+		master = self.connector(True)
+		worker = self.connector(False)
+		self.wait_for_queue('task.q')
+
+		master.putMessages([b'task-%d' % num for num in range(20)])
+		tasks = self.fetch(worker, 20)
+		self.assertEqual(tasks, [b'task-%d' % num for num in range(20)])
+		for body in tasks:
+			worker.putMessage(b'done-' + body)
+		self.assertEqual(sorted(self.fetch(master, 20)), sorted(b'done-' + body for body in tasks))
+
+	def test_priority_lanes(self):
+		master = self.connector(True, max_priority=9)
+		worker = self.connector(False, max_priority=9)
+		self.wait_for_queue('task.q')
+		worker.stop()
+
+		master.putMessages([b'bulk-%d' % num for num in range(10)])
+		master.putMessage(b'urgent', priority=9)
+		deadline = time.monotonic() + 2
+		while self.broker().queue_depth('task.q') < 11 and time.monotonic() < deadline:
+			time.sleep(0.01)
+
+		worker = self.connector(False, max_priority=9, prefetch=20)
+		got = self.fetch(worker, 11)
+		self.assertEqual(got[0], b'urgent')
+		self.assertEqual(got[1:], [b'bulk-%d' % num for num in range(10)])
+
+	def test_compressed_bodies(self):
+		master = self.connector(True, compression='zlib', compression_threshold=100)
+		worker = self.connector(False)
+		self.wait_for_queue('task.q')
+
+		tasks = [b'task-%d ' % num * 100 for num in range(10)] + [b'short']
+		master.putMessages(tasks)
+		self.assertEqual(self.fetch(worker, 11), tasks)
+		self.assertLess(self.broker().published_bytes, sum(len(body) for body in tasks) / 10)
+
+	def test_reconnecting_worker_skips_cached_declares(self):
+		master = self.connector(True)
+		first  = self.connector(False)
+		self.wait_for_queue('task.q')
+		first.stop()
+		second = self.connector(False)
+		master.putMessage(b'task')
+		self.assertEqual(self.fetch(second, 1), [b'task'])
+		# Counted once the connection is ready, just after consuming starts.
+		deadline = time.monotonic() + 2
+		while not second.stats()['declares_cached'] and time.monotonic() < deadline:
+			time.sleep(0.01)
+		self.assertGreater(second.stats()['declares_cached'], 0)
+
+	def test_metrics_endpoint(self):
+		master = self.connector(True)
+		worker = self.connector(False, metrics_port=0)
+		self.wait_for_queue('task.q')
+		master.putMessages([b'a', b'b'])
+		self.assertEqual(len(self.fetch(worker, 2)), 2)
+
+		url = 'http://127.0.0.1:%s/metrics' % worker.metricsServer.server_address[1]
+		with urllib.request.urlopen(url, timeout=5) as resp:
+			text = resp.read().decode("utf-8")
+		self.assertIn('amqpconnector_received_total{queue="task.q",vhost="%s"} 2\n' % self.vhost, text)
+
+
+class TestFetching(LoopbackTestCase):
+
+	def test_get_message_waits_up_to_the_timeout(self):
+		master = self.connector(True)
+		worker = self.connector(False)
+		self.wait_for_queue('task.q')
+		self.assertIsNone(worker.getMessage())
+		started = time.monotonic()
+		self.assertIsNone(worker.getMessage(timeout=0.2))
+		self.assertGreaterEqual(time.monotonic() - started, 0.2)
+		self.assertGreaterEqual(worker.stats()['rx_starved'], 2)
+
+		threading.Timer(0.1, master.putMessage, args=(b'late', )).start()
+		started = time.monotonic()
+		self.assertEqual(worker.getMessage(timeout=2), b'late')
+		self.assertLess(time.monotonic() - started, 1)
+
+	def test_get_messages_batches(self):
+		master = self.connector(True)
+		worker = self.connector(False, prefetch=10)
+		self.wait_for_queue('task.q')
+		self.assertEqual(worker.getMessages(10), [])
+
+		master.putMessages([b'%d' % num for num in range(5)])
+		time.sleep(0.2)
+		self.assertEqual(worker.getMessages(3), [b'0', b'1', b'2'])
+		self.assertEqual(worker.getMessages(10), [b'3', b'4'])
+
+		threading.Timer(0.1, master.putMessage, args=(b'late', )).start()
+		self.assertEqual(worker.getMessages(10, timeout=2), [b'late'])
+
+
+class TestConsumerChannels(LoopbackTestCase):
+
+	def test_deliveries_are_spread_and_acked_per_channel(self):
+		master = self.connector(True)
+		worker = self.connector(False, ack_mode='manual', prefetch=2, consumer_channels=3)
+		self.wait_for_queue('task.q')
+		master.putMessages([b'%d' % num for num in range(30)])
+
+		got = []
+		deadline = time.monotonic() + 2
+		while len(got) < 30 and time.monotonic() < deadline:
+			for delivery in worker.getMessages(30, timeout=0.05):
+				delivery.ack()
+				got.append(delivery.body)
+		self.assertEqual(sorted(got), sorted(b'%d' % num for num in range(30)))
+
+		managers = [obj for obj in gc.get_objects() if isinstance(obj, AmqpConnector.ConnectorManager)
+				and obj.config and obj.config['virtual_host'] == self.vhost and not obj.config['master']]
+		deadline = time.monotonic() + 2
+		while sum(tmp['acked'] for tmp in managers[0].channelStats()) < 30 and time.monotonic() < deadline:
+			time.sleep(0.01)
+		stats = managers[0].channelStats()
+		self.assertEqual([tmp['queue'] for tmp in stats], ['task.q'] * 3)
+		self.assertTrue(all(tmp['received'] for tmp in stats), stats)
+		self.assertEqual(sum(tmp['acked'] for tmp in stats), 30)
+		self.assertEqual(sum(tmp['unacked'] for tmp in stats), 0)
+
+	def test_at_least_one_channel(self):
+		with self.assertRaises(ValueError):
+			self.connector(False, consumer_channels=0)
+
+
+class TestDeadlines(LoopbackTestCase):
+
+	def test_expired_tasks_are_skipped(self):
+		worker = self.connector(False)
+		self.wait_for_queue('task.q')
+		self.broker().publish('tasks.e', 'task', b'stale', {'headers' : {'x-deadline' : time.time() - 1}})
+		self.broker().publish('tasks.e', 'task', b'fresh', {'headers' : {'x-deadline' : time.time() + 10}})
+
+		self.assertEqual(self.fetch(worker, 1), [b'fresh'])
+		self.assertEqual(worker.stats()['expired'], 1)
+
+	def test_expired_in_local_buffer(self):
+		master = self.connector(True)
+		worker = self.connector(False, ack_mode='manual', prefetch=10)
+		self.wait_for_queue('task.q')
+		master.putMessages([b'short-%d' % num for num in range(3)], ttl=0.2)
+		master.putMessage(b'long')
+		time.sleep(0.4)
+
+		got = self.fetch(worker, 1)
+		self.assertEqual([tmp.body for tmp in got], [b'long'])
+		got[0].ack()
+		self.assertEqual(worker.stats()['expired'], 3)
+		time.sleep(0.2)
+		self.assertEqual(self.broker().queue_depth('task.q'), 0)
+
+
+class TestReceiveErrors(LoopbackTestCase):
+
+	def test_undecodable_messages_are_rejected(self):
+		master = self.connector(True)
+		worker = self.connector(False)
+		self.wait_for_queue('task.q')
+		self.broker().publish('tasks.e', 'task', b'garbage', {'content_encoding' : 'deflate'})
+		self.broker().publish('tasks.e', 'task', b'chunk', {'headers' : {'x-transfer-id' : 'tid', 'x-transfer-offset' : 'nope'}})
+		master.putMessage(b'good')
+
+		self.assertEqual(self.fetch(worker, 1), [b'good'])
+		self.assertEqual(worker.stats()['rejected'], 2)
+
+	def test_undeserializable_messages_are_rejected(self):
+		master = self.connector(True, serializer='json')
+		worker = self.connector(False)
+		self.wait_for_queue('task.q')
+		self.broker().publish('tasks.e', 'task', b'{"truncated', {'content_type' : 'application/json'})
+		master.putMessage({'good' : [1, 2]})
+
+		self.assertEqual(self.fetch(worker, 1), [{'good' : [1, 2]}])
+		self.assertEqual(worker.stats()['rejected'], 1)
+		time.sleep(0.1)
+		self.assertEqual(self.broker().queue_depth('task.q'), 0)
+
+
+class TestSharding(LoopbackTestCase):
+
+	def test_dotted_queue_name_delivers_each_task_once(self):
+		common  = dict(task_queue='foo.bar.q', task_shards=3)
+		workers = [self.connector(False, consume_shards=[shard], **common) for shard in range(3)]
+		master  = self.connector(True, **common)
+		for shard in ('foo.bar.q', 'foo.bar-shard1.q', 'foo.bar-shard2.q'):
+			self.wait_for_queue(shard)
+
+		master.putMessages([b'%d' % num for num in range(30)])
+		got = collections.Counter()
+		for worker in workers:
+			for body in self.fetch(worker, 10, timeout=1):
+				got[body] += 1
+		self.assertEqual(len(got), 30)
+		self.assertEqual(set(got.values()), {1})
+
+	def test_shards_need_a_direct_exchange(self):
+		for exchange_type in ('fanout', 'topic'):
+			with self.assertRaises(ValueError):
+				AmqpConnector.Connector(master=True, task_shards=2, task_exchange_type=exchange_type, **self.config())
+			with self.assertRaises(ValueError):
+				AmqpConnector.Connector(master=False, consume_shards=[0, 1], task_exchange_type=exchange_type, **self.config())
+
+		master = self.connector(True, task_exchange_type='fanout')
+		with self.assertRaises(ValueError):
+			master.setTaskShards(2)
+		self.assertEqual(len(master.router.keys), 1)
+
+
+class TestRpc(LoopbackTestCase):
+
+	def test_failed_submit_frees_its_slot(self):
+		master = self.connector(True)
+		worker = self.connector(False, ack_mode='response')
+		self.wait_for_queue('task.q')
+		rpc = master.rpcClient(max_in_flight=2)
+		for _ in range(3):
+			with self.assertRaises(TypeError):
+				rpc.submit(object(), serializer='json')
+		self.assertEqual(len(rpc.pending), 0)
+
+		future = rpc.submit(b'ping')
+		task = self.fetch(worker, 1)[0]
+		worker.putMessage(b'pong-' + task.body, ack=task)
+		self.assertEqual(future.result(2), b'pong-ping')
+		rpc.close()
+
+	def test_out_of_order_responses_reach_their_callers(self):
+		master = self.connector(True)
+		worker = self.connector(False, ack_mode='manual', prefetch=20)
+		self.wait_for_queue('task.q')
+		rpc = master.rpcClient()
+		futures = [rpc.submit(b'req-%d' % num) for num in range(10)]
+
+		tasks = self.fetch(worker, 10)
+		for task in reversed(tasks):
+			worker.putMessage(b'ans-' + task.body, ack=task)
+		self.assertEqual([tmp.result(2) for tmp in futures], [b'ans-req-%d' % num for num in range(10)])
+		rpc.close()
+
+	def test_uncorrelated_response_is_logged(self):
+		master = self.connector(True)
+		worker = self.connector(False)
+		self.wait_for_queue('task.q')
+		rpc = master.rpcClient(timeout=0.2)
+		future = rpc.submit(b'ping')
+
+		body = self.fetch(worker, 1)[0]
+		with self.assertLogs("Main.Connector", "ERROR"):
+			worker.putMessage(b'pong-' + body)
+		with self.assertRaises(TimeoutError):
+			future.result(2)
+		rpc.close()
+
+
+class TestChunking(LoopbackTestCase):
+
+	def test_master_refuses_chunk_size(self):
+		with self.assertRaises(ValueError):
+			AmqpConnector.Connector(master=True, host='loop', virtual_host=self.vhost, transport='loopback', chunk_size=1000)
+
+	def test_chunked_response(self):
+		master = self.connector(True)
+		worker = self.connector(False, chunk_size=1000)
+		self.wait_for_queue('response.q')
+		payload = bytes(range(256)) * 40
+		worker.putMessage(payload)
+		got = self.fetch(master, 1)
+		self.assertEqual(len(got), 1)
+		self.assertEqual(got[0].read(), payload)
+
+
+class ClosingChannel(loopback.LoopbackChannel):
+	# Publishing on a closed channel fails, like it does on a real broker.
+	def basic_publish(self, *args, **kwargs):
+		if self.closed:
+			raise IOError("Channel closed")
+		return super().basic_publish(*args, **kwargs)
+
+class ClosingTransport(loopback.LoopbackTransport):
+	def channel(self):
+		chan = ClosingChannel(self.broker)
+		self.channels.append(chan)
+		return chan
+
+
+class TestBufferBudgets(LoopbackTestCase):
+
+	def test_rx_budget(self):
+		master = self.connector(True)
+		worker = self.connector(False, prefetch=100, max_buffered_bytes_in=3000)
+		self.wait_for_queue('task.q')
+		master.putMessages([b'x' * 1000] * 10)
+		time.sleep(0.3)
+		self.assertLessEqual(worker.stats()['rx_queue_bytes'], 3000)
+		self.assertEqual(len(self.fetch(worker, 10)), 10)
+		self.assertGreater(worker.stats()['rx_paused_seconds'], 0)
+
+	def test_rx_budget_is_shared_by_the_consumer_channels(self):
+		master = self.connector(True)
+		worker = self.connector(False, prefetch=100, consumer_channels=4, max_buffered_bytes_in=3000)
+		self.wait_for_queue('task.q')
+		master.putMessages([b'x' * 1000] * 20)
+		time.sleep(0.3)
+		self.assertLessEqual(worker.stats()['rx_queue_bytes'], 3000)
+		self.assertEqual(len(self.fetch(worker, 20)), 20)
+
+	def test_paused_delivery_is_dropped_when_the_channel_dies(self):
+		master = self.connector(True)
+		worker = self.connector(False, transport=ClosingTransport, prefetch=10, max_buffered_bytes_in=1000)
+		self.wait_for_queue('task.q')
+		master.putMessages([b'%03d' % num + b'x' * 597 for num in range(5)])
+		time.sleep(0.3)
+		self.assertEqual(worker.stats()['rx_queue_depth'], 1)
+
+		managers = [obj for obj in gc.get_objects() if isinstance(obj, AmqpConnector.ConnectorManager)
+				and obj.config and obj.config['virtual_host'] == self.vhost and not obj.config['master']]
+		managers[0].close(broken=True)
+		# Publishing on the dead channel makes the interface thread reconnect.
+		worker.putMessage(b'kick')
+
+		got = collections.Counter(body[:3] for body in self.fetch(worker, 5))
+		time.sleep(0.2)
+		got.update(body[:3] for body in worker.getMessages(10))
+		self.assertEqual(got, {b'%03d' % num : 1 for num in range(5)})
+
+
+class OutageChannel(loopback.LoopbackChannel):
+	def basic_publish(self, *args, **kwargs):
+		if OutageTransport.down:
+			raise IOError("Broker unreachable")
+		return super().basic_publish(*args, **kwargs)
+
+class OutageTransport(loopback.LoopbackTransport):
+	# Flip to make every connect and publish fail.
+	down = False
+
+	def connect(self):
+		if self.down:
+			raise IOError("Broker unreachable")
+		super().connect()
+
+	def channel(self):
+		chan = OutageChannel(self.broker)
+		self.channels.append(chan)
+		return chan
+
+
+class TestStop(LoopbackTestCase):
+
+	def stop(self, con, timeout=5):
+		thread = threading.Thread(target=con.stop, daemon=True)
+		thread.start()
+		thread.join(timeout)
+		self.assertFalse(thread.is_alive(), "stop() never returned.")
+
+	def test_stop_with_unfetched_tasks_flushes_responses(self):
+		master = self.connector(True)
+		worker = self.connector(False, prefetch=5)
+		self.wait_for_queue('task.q')
+		master.putMessages([b'task-%d' % num for num in range(8)])
+		tasks = self.fetch(worker, 2)
+		for body in tasks:
+			worker.putMessage(b'done-' + body)
+
+		self.stop(worker)
+		self.assertEqual(sorted(self.fetch(master, 2)), [b'done-task-0', b'done-task-1'])
+
+	def test_stop_gives_up_when_the_broker_stays_down(self):
+		worker = self.connector(False, transport=OutageTransport, reconnect_max_delay=0.05, reconnect_attempts_on_stop=1000)
+		self.wait_for_queue('task.q')
+		OutageTransport.down = True
+		self.addCleanup(setattr, OutageTransport, 'down', False)
+		worker.putMessage(b'lost')
+		time.sleep(0.2)
+
+		self.stop(worker)
+		self.assertEqual(worker.stats()['tx_queue_depth'], 1)
+
+
+class TestAsyncConnector(LoopbackTestCase):
+
+	def run_worker(self, handle, **kwargs):
+		'''
+		Run `handle(worker)` on an AsyncConnector worker in a fresh event loop.
+		'''
+		async def main():
+			worker = aio.AsyncConnector(master=False, **self.config(**kwargs))
+			try:
+				return await handle(worker)
+			finally:
+				await worker.stop()
+		return asyncio.run(main())
+
+	def test_get_message(self):
+		master = self.connector(True)
+
+		async def handle(worker):
+			self.assertIsNone(await worker.get_message(timeout=0.05))
+			master.putMessages([b'a', b'b'])
+			return [await worker.get_message(timeout=2), await worker.get_message(timeout=2)]
+		self.assertEqual(self.run_worker(handle), [b'a', b'b'])
+
+	def check_concurrent_replies(self, synchronous):
+		master = self.connector(True)
+		self.wait_for_queue('response.q')
+		rpc = master.rpcClient()
+
+		async def reply(worker, task, delay):
+			await asyncio.sleep(delay)
+			await worker.put_message(b'ans-' + task.body, synchronous=synchronous, ack=task)
+
+		async def handle(worker):
+			futures = [rpc.submit(b'req-%d' % num) for num in range(8)]
+			tasks = [await worker.get_message(timeout=2) for _ in range(8)]
+			# Each handler answers later than the one after it.
+			await asyncio.gather(*[reply(worker, task, (8 - num) * 0.01) for num, task in enumerate(tasks)])
+			return [await asyncio.wrap_future(tmp) for tmp in futures]
+
+		got = self.run_worker(handle, ack_mode='manual', prefetch=8)
+		self.assertEqual(got, [b'ans-req-%d' % num for num in range(8)])
+		rpc.close()
+
+	def test_concurrent_replies_reach_their_callers(self):
+		self.check_concurrent_replies(False)
+
+	def test_concurrent_replies_off_the_loop(self):
+		self.check_concurrent_replies(10)
+
+
+def crash_on_poison(body):
+	if body == b'poison':
+		os._exit(1)
+	return b'ok-' + body
+
+
+class TestProcessPool(LoopbackTestCase):
+
+	def check_poison_is_dropped(self, ack_mode):
+		master = self.connector(True)
+		worker = self.connector(False, ack_mode=ack_mode)
+		self.wait_for_queue('task.q')
+		server = procpool.ProcessPoolServer(worker, crash_on_poison, processes=2)
+		stop = threading.Event()
+		thread = threading.Thread(target=server.serve, args=(stop, ), daemon=True)
+		thread.start()
+
+		master.putMessages([b'poison', b'good'])
+		self.assertEqual(self.fetch(master, 1, timeout=5), [b'ok-good'])
+		deadline = time.monotonic() + 5
+		while not server.failed and time.monotonic() < deadline:
+			time.sleep(0.01)
+		stop.set()
+		thread.join(5)
+
+		self.assertEqual((server.completed, server.failed, server.restarts), (1, 1, procpool.MAX_TASK_CRASHES))
+		# Nothing was left unacked for the broker to hand out again.
+		worker.stop()
+		self.assertEqual(self.broker().queue_depth('task.q'), 0)
+
+	def test_poison_task_is_dropped_with_receive_acks(self):
+		self.check_poison_is_dropped('receive')
+
+	def test_poison_task_is_dropped_with_deferred_acks(self):
+		self.check_poison_is_dropped('manual')
+
+
+class BlackholeChannel(loopback.LoopbackChannel):
+	def basic_publish(self, exchange, routing_key, body, properties=None):
+		if BlackholeTransport.probes_lost and exchange.startswith('keepalive'):
+			return
+		return super().basic_publish(exchange, routing_key, body, properties)
+
+class BlackholeTransport(loopback.LoopbackTransport):
+	# Flip to lose every liveness probe, like a half-open connection would.
+	probes_lost = False
+
+	def channel(self):
+		chan = BlackholeChannel(self.broker)
+		self.channels.append(chan)
+		return chan
+
+
+class TestHeartbeat(LoopbackTestCase):
+
+	def wait_for_stat(self, con, name, timeout=3):
+		deadline = time.monotonic() + timeout
+		while not con.stats().get(name) and time.monotonic() < deadline:
+			time.sleep(0.01)
+		return con.stats().get(name)
+
+	def lose_probes(self):
+		BlackholeTransport.probes_lost = True
+		self.addCleanup(setattr, BlackholeTransport, 'probes_lost', False)
+
+	def test_probing_is_opt_in(self):
+		worker = AmqpConnector.Connector(master=False, host='loop', virtual_host=self.vhost, transport='loopback')
+		self.connectors.append(worker)
+		self.wait_for_queue('task.q')
+		time.sleep(0.1)
+		self.assertEqual([name for name in self.broker().queues if name.startswith('nak.')], [])
+
+	def test_probes_measure_rtt(self):
+		worker = self.connector(False, hearbeat_packet_interval=0.02)
+		self.assertIsNotNone(self.wait_for_stat(worker, 'heartbeat_last_rtt'))
+		self.assertEqual(worker.stats()['heartbeat_timeouts'], 0)
+
+	def test_lost_probe_forces_a_reconnect(self):
+		worker = self.connector(False, transport=BlackholeTransport, hearbeat_packet_interval=0.02, hearbeat_packet_timeout=0.1)
+		self.wait_for_queue('task.q')
+		self.lose_probes()
+		self.assertGreater(self.wait_for_stat(worker, 'heartbeat_timeouts'), 0)
+		self.assertGreater(self.wait_for_stat(worker, 'reconnects'), 0)
+
+	def test_lost_probe_leaves_a_shared_connection_open(self):
+		common = dict(transport=BlackholeTransport, share_connection=True)
+		master = self.connector(True)
+		other  = self.connector(False, **common)
+		prober = self.connector(True, response_queue='other.q', hearbeat_packet_interval=0.02, hearbeat_packet_timeout=0.1, **common)
+		self.wait_for_queue('task.q')
+		self.wait_for_queue('other.q')
+		self.lose_probes()
+		self.assertGreater(self.wait_for_stat(prober, 'heartbeat_timeouts'), 0)
+
+		# The connector sharing the connection carries on undisturbed.
+		master.putMessage(b'task')
+		self.assertEqual(self.fetch(other, 1), [b'task'])
+		self.assertEqual(other.stats()['reconnects'], 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+
+from AmqpConnector import connpool
+from AmqpConnector import transport
+
+
+class CountingTransport(transport.Transport):
+	'''
+	Transport that only records being opened and closed.
+	'''
+
+	def __init__(self, config):
+		super().__init__(config)
+		self.connected = False
+		self.closed    = False
+
+	def connect(self):
+		self.connected = True
+
+	def close(self):
+		self.closed = True
+
+
+def config(**kwargs):
+	ret = dict(
+			transport      = CountingTransport,
+			host           = 'broker:5672',
+			virtual_host   = '/',
+			userid         = 'guest',
+			password       = 'guest',
+			sslopts        = None,
+			heartbeat      = 60,
+			socket_timeout = 10,
+		)
+	ret.update(kwargs)
+	return ret
+
+
+class TestConnectionPool(unittest.TestCase):
+
+	def setUp(self):
+		self.pool = connpool.ConnectionPool()
+
+	def test_matching_configs_share_a_connection(self):
+		first  = self.pool.acquire(config())
+		second = self.pool.acquire(config())
+		self.assertIs(first, second)
+		self.assertTrue(first.connected)
+		self.assertEqual([tmp['users'] for tmp in self.pool.stats()], [2])
+
+		self.assertIsNot(self.pool.acquire(config(virtual_host='other')), first)
+		self.assertIsNot(self.pool.acquire(config(sslopts={'ca_certs' : 'ca.pem'})), first)
+		self.assertEqual(len(self.pool.stats()), 3)
+
+	def test_closed_when_the_last_user_releases_it(self):
+		conn = self.pool.acquire(config())
+		self.pool.acquire(config())
+		self.pool.release(conn)
+		self.assertFalse(conn.closed)
+		self.pool.release(conn)
+		self.assertTrue(conn.closed)
+		self.assertEqual(self.pool.stats(), [])
+
+		# Releasing it again is harmless.
+		self.pool.release(conn)
+		self.assertIsNot(self.pool.acquire(config()), conn)
+
+	def test_broken_connection_is_replaced(self):
+		conn = self.pool.acquire(config())
+		self.pool.acquire(config())
+		self.pool.release(conn, broken=True)
+		# The other user still holds it, but new users get a fresh one.
+		self.assertFalse(conn.closed)
+		fresh = self.pool.acquire(config())
+		self.assertIsNot(fresh, conn)
+		self.assertEqual(sorted(tmp['pooled'] for tmp in self.pool.stats()), [False, True])
+
+		self.pool.release(conn)
+		self.assertTrue(conn.closed)
+		self.assertFalse(fresh.closed)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,184 @@
+
+import collections
+import logging
+import multiprocessing
+import threading
+import unittest
+
+import AmqpConnector
+from AmqpConnector import metrics
+from AmqpConnector import queues
+from AmqpConnector.delivery import Delivery
+from AmqpConnector.delivery import Outgoing
+
+
+class RecordingChannel:
+	'''
+	Stands in for a transport channel, recording the acks, nacks and qos
+	changes sent, and handing out queued publisher confirms.
+	'''
+
+	def __init__(self, confirms=()):
+		self.sent     = []
+		self.confirms = collections.deque(confirms)
+
+	def basic_ack(self, delivery_tag, multiple=False):
+		self.sent.append(('ack', delivery_tag, multiple))
+
+	def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+		self.sent.append(('nack', delivery_tag, requeue))
+
+	def wait_for_confirm(self):
+		return self.confirms.popleft()
+
+	def basic_qos(self, prefetch_count):
+		self.sent.append(('qos', prefetch_count))
+
+
+def bare_manager(channel=None):
+	'''
+	A ConnectorManager with just enough state to settle acks and confirms,
+	without connecting anywhere.
+	'''
+	mgr = AmqpConnector.ConnectorManager.__new__(AmqpConnector.ConnectorManager)
+	mgr.log             = logging.getLogger("Main.Connector.Test")
+	mgr.active_lock     = threading.Lock()
+	mgr.metrics         = metrics.Metrics()
+	mgr.consumers       = []
+	mgr.channel         = channel
+	mgr.unconfirmed     = collections.OrderedDict()
+	mgr.response_queue  = queues.BatchQueue()
+	mgr.tx_event        = threading.Event()
+	mgr.active          = 0
+	mgr.nacked_messages = 0
+	# Only touched on teardown.
+	mgr.active_connections = multiprocessing.Value("b", 0)
+	mgr.rx_threads      = []
+	return mgr
+
+
+class TestDeferredAcks(unittest.TestCase):
+
+	def setUp(self):
+		self.chan     = RecordingChannel()
+		self.mgr      = bare_manager()
+		self.consumer = AmqpConnector.ConsumerChannel(0, self.chan, None, 'task.q')
+		self.mgr.consumers.append(self.consumer)
+		for tag in range(1, 6):
+			self.consumer.unacked[tag] = False
+
+	def settle(self, *tags, requeue=None):
+		self.mgr._processAcks([(Delivery(b'', {}, tag, False, self.chan), requeue) for tag in tags])
+
+	def test_head_run_is_coalesced(self):
+		self.settle(1, 2, 3)
+		self.assertEqual(self.chan.sent, [('ack', 3, True)])
+		self.assertEqual(list(self.consumer.unacked), [4, 5])
+		self.assertEqual(self.consumer.acked, 3)
+		self.assertEqual(self.consumer.ack_frames, 1)
+
+	def test_straggler_is_acked_alone(self):
+		self.settle(3)
+		self.assertEqual(self.chan.sent, [('ack', 3, False)])
+		self.assertEqual(list(self.consumer.unacked), [1, 2, 4, 5])
+
+		# Once the head is acked, the run up to the next gap goes in one frame.
+		self.settle(1, 2)
+		self.assertEqual(self.chan.sent[1:], [('ack', 2, True)])
+		self.assertEqual(list(self.consumer.unacked), [4, 5])
+
+	def test_nack(self):
+		self.settle(2, requeue=False)
+		self.assertEqual(self.chan.sent, [('nack', 2, False)])
+		self.assertNotIn(2, self.consumer.unacked)
+		self.assertEqual(self.consumer.nacked, 1)
+
+	def test_stale_delivery_is_dropped(self):
+		old = RecordingChannel()
+		self.mgr._processAcks([(Delivery(b'', {}, 1, False, old), None)])
+		self.assertEqual(self.chan.sent, [])
+		self.assertEqual(old.sent, [])
+		self.assertEqual(len(self.consumer.unacked), 5)
+
+
+class TestPublisherConfirms(unittest.TestCase):
+
+	def setUp(self):
+		self.chan = RecordingChannel()
+		self.mgr  = bare_manager(self.chan)
+		self.puts = [Outgoing(b'msg-%d' % num) for num in range(4)]
+		for seq, put in enumerate(self.puts, 1):
+			put.sent_at = 0
+			self.mgr.unconfirmed[seq] = put
+		self.mgr.active = len(self.puts)
+
+	def test_multiple_ack_settles_the_window_up_to_the_tag(self):
+		self.chan.confirms.append((True, 3, True))
+		self.mgr._processConfirm()
+		self.assertEqual(list(self.mgr.unconfirmed), [4])
+		self.assertEqual(self.mgr.active, 1)
+		self.assertEqual(self.mgr.response_queue.qsize(), 0)
+
+	def test_nack_requeues(self):
+		self.chan.confirms.extend([(False, 2, False), (True, 4, True)])
+		self.mgr._processConfirm()
+		self.assertEqual(list(self.mgr.unconfirmed), [1, 3, 4])
+		self.assertEqual(self.mgr.response_queue.get_nowait(), self.puts[1])
+		self.assertTrue(self.mgr.tx_event.is_set())
+		self.assertEqual(self.mgr.metrics.counters['publish_nacks'], 1)
+
+		self.mgr._processConfirm()
+		self.assertEqual(list(self.mgr.unconfirmed), [])
+		self.assertEqual(self.mgr.active, 1)
+
+	def test_unconfirmed_are_salvaged_in_order(self):
+		self.mgr.publishing = None
+		self.mgr.response_queue.put(Outgoing(b'later'))
+		self.mgr._salvageOutgoing()
+		self.assertEqual([self.mgr.response_queue.get_nowait().body for _ in range(5)], [b'msg-0', b'msg-1', b'msg-2', b'msg-3', b'later'])
+		self.assertEqual(self.mgr.metrics.counters['republished'], 4)
+
+
+class TestReconnectDelay(unittest.TestCase):
+
+	def test_jittered_exponential_backoff(self):
+		config = {'reconnect_delay' : 0.5, 'reconnect_max_delay' : 30}
+		for attempt, ceiling in [(1, 0.5), (2, 1), (3, 2), (7, 30), (20, 30)]:
+			delays = [AmqpConnector._reconnect_delay(config, attempt) for _ in range(200)]
+			self.assertTrue(all(ceiling / 2 <= tmp <= ceiling for tmp in delays), (attempt, min(delays), max(delays)))
+			# Jittered, so reconnecting clients don't all retry in step.
+			self.assertGreater(len(set(delays)), 100)
+
+
+class FixedTuner:
+	def __init__(self, window):
+		self.window = window
+
+	def update(self, metrics):
+		return self.window
+
+
+class TestPrefetchHandOff(unittest.TestCase):
+
+	def test_window_is_applied_by_the_rx_thread(self):
+		chan = RecordingChannel()
+		mgr  = bare_manager()
+		mgr.config   = {'rx_buffer_size' : 5}
+		mgr.prefetch = 10
+		mgr.tuner    = FixedTuner(20)
+		consumer = AmqpConnector.ConsumerChannel(0, chan, None, 'task.q', 10)
+		mgr.consumers.append(consumer)
+
+		# The interface thread only hands the window over.
+		mgr._tunePrefetch()
+		self.assertEqual(chan.sent, [])
+		self.assertEqual(consumer.next_prefetch, 20)
+
+		mgr._applyPrefetch(consumer)
+		mgr._applyPrefetch(consumer)
+		self.assertEqual(chan.sent, [('qos', 20)])
+		self.assertEqual(consumer.prefetch, 20)
+
+
+if __name__ == '__main__':
+	unittest.main()
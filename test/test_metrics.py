@@ -0,0 +1,86 @@
+import urllib.error
+import urllib.request
+import unittest
+
+from AmqpConnector import metrics
+
+
+class TestHistogram(unittest.TestCase):
+
+	def test_quantiles_and_buckets(self):
+		hist = metrics.Histogram(buckets=(0.1, 1.0))
+		self.assertIsNone(hist.quantile(0.5))
+		for value in (0.05, 0.05, 0.5, 5):
+			hist.observe(value)
+		snap = hist.snapshot()
+		self.assertEqual(snap['buckets'], [(0.1, 2), (1.0, 3), (float('inf'), 4)])
+		self.assertEqual((snap['count'], snap['sum']), (4, 5.6))
+		self.assertEqual(snap['p50'], 0.1)
+		self.assertEqual(snap['p99'], float('inf'))
+
+
+class TestMetrics(unittest.TestCase):
+
+	def test_snapshot(self):
+		stats = metrics.Metrics()
+		stats.incr(published=3, published_bytes=30)
+		stats.incr(published=1)
+		stats.set('heartbeat_last_rtt', 0.5)
+		stats.observe(stats.rx_dwell, 0.001, 0.002)
+
+		snap = stats.snapshot()
+		self.assertEqual(snap['published'], 4)
+		self.assertEqual(snap['published_bytes'], 30)
+		self.assertEqual(snap['received'], 0)
+		self.assertEqual(snap['heartbeat_last_rtt'], 0.5)
+		self.assertEqual(snap['rx_dwell']['count'], 2)
+		self.assertGreater(snap['publish_rate'], 0)
+
+
+class TestPrometheus(unittest.TestCase):
+
+	def test_format(self):
+		hist = metrics.Histogram(buckets=(0.5, ))
+		hist.observe(0.25)
+		stats = {
+			'published'      : 7,
+			'rx_queue_depth' : 2,
+			'publish_rate'   : 1.5,
+			'rx_dwell'       : hist.snapshot(),
+			'connected'      : True,
+			'rx_budget_bytes': None,
+		}
+		text = metrics.format_prometheus(stats, {'queue' : 'task.q', 'vhost' : 'a"b'})
+		labels = 'queue="task.q",vhost="a\\"b"'
+		self.assertEqual(text.splitlines(), [
+				'# TYPE amqpconnector_publish_rate gauge',
+				'amqpconnector_publish_rate{%s} 1.5' % labels,
+				'# TYPE amqpconnector_published_total counter',
+				'amqpconnector_published_total{%s} 7' % labels,
+				'# TYPE amqpconnector_rx_dwell_seconds histogram',
+				'amqpconnector_rx_dwell_seconds_bucket{%s,le="0.5"} 1' % labels,
+				'amqpconnector_rx_dwell_seconds_bucket{%s,le="+Inf"} 1' % labels,
+				'amqpconnector_rx_dwell_seconds_sum{%s} 0.25' % labels,
+				'amqpconnector_rx_dwell_seconds_count{%s} 1' % labels,
+				'# TYPE amqpconnector_rx_queue_depth gauge',
+				'amqpconnector_rx_queue_depth{%s} 2' % labels,
+			])
+
+	def test_exporter(self):
+		server = metrics.start_exporter(lambda: {'received' : 3}, {}, '127.0.0.1', 0)
+		try:
+			url = 'http://127.0.0.1:%s' % server.server_address[1]
+			with urllib.request.urlopen(url + '/metrics', timeout=5) as resp:
+				self.assertTrue(resp.headers['Content-Type'].startswith('text/plain'))
+				self.assertIn(b'amqpconnector_received_total 3\n', resp.read())
+			with self.assertRaises(urllib.error.HTTPError) as ctx:
+				urllib.request.urlopen(url + '/other', timeout=5)
+			self.assertEqual(ctx.exception.code, 404)
+			ctx.exception.close()
+		finally:
+			server.shutdown()
+			server.server_close()
+
+
+if __name__ == '__main__':
+	unittest.main()
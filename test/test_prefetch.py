@@ -0,0 +1,59 @@
+
+import unittest
+
+from AmqpConnector import metrics
+from AmqpConnector import prefetch
+
+
+class TestPrefetchTuner(unittest.TestCase):
+
+	def setUp(self):
+		self.metrics = metrics.Metrics()
+
+	def tuner(self, initial, minimum=1, maximum=1000):
+		tuner = prefetch.PrefetchTuner(initial, minimum, maximum, interval=1.0)
+		# The first call only takes a baseline sample.
+		self.assertIsNone(tuner.update(self.metrics))
+		return tuner
+
+	def interval(self, tuner, handed=0, starved=0, received=0, durations=()):
+		'''
+		Feed one interval's worth of activity, and pretend a second passed.
+		'''
+		self.metrics.observe(self.metrics.rx_dwell, *[0.0] * handed)
+		self.metrics.observe(self.metrics.task_duration, *durations)
+		self.metrics.incr(rx_starved=starved, received=received)
+		tuner.last_at -= 1.0
+		return tuner.update(self.metrics)
+
+	def test_starved_application_doubles_the_window(self):
+		tuner = self.tuner(10)
+		self.assertEqual(self.interval(tuner, handed=5, starved=3, received=5), 20)
+		self.assertEqual(self.interval(tuner, handed=5, starved=3, received=5), 40)
+
+	def test_window_is_clamped(self):
+		tuner = self.tuner(60, maximum=100)
+		self.assertEqual(self.interval(tuner, handed=5, starved=3, received=5), 100)
+
+		tuner = self.tuner(4, minimum=3)
+		self.assertIsNone(self.interval(tuner, handed=1, durations=[0.01]))
+
+	def test_shrinks_by_half_at_most(self):
+		tuner = self.tuner(64)
+		self.assertEqual(self.interval(tuner, handed=1, durations=[0.01]), 32)
+
+	def test_follows_littles_law(self):
+		# 50 tasks/s at 0.195s each, plus the 0.01s default rtt, with 2x
+		# headroom: int(2 * 50 * 0.205) + 1.
+		tuner = self.tuner(4)
+		self.assertEqual(self.interval(tuner, handed=50, durations=[0.195] * 50), 21)
+
+	def test_idle_and_small_changes_are_ignored(self):
+		tuner = self.tuner(10)
+		self.assertIsNone(self.interval(tuner))
+		# A target within 25% of the window isn't worth a qos round trip.
+		self.assertIsNone(self.interval(tuner, handed=1, durations=[5.5]))
+
+
+if __name__ == '__main__':
+	unittest.main()
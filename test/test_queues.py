@@ -0,0 +1,86 @@
+
+import threading
+import time
+import unittest
+
+from AmqpConnector import queues
+from AmqpConnector.delivery import Delivery
+
+
+def task(body, priority=None):
+	properties = {'priority' : priority} if priority is not None else {}
+	return Delivery(body, properties, 0, False, None)
+
+
+class TestBatchQueue(unittest.TestCase):
+
+	def test_byte_accounting(self):
+		q = queues.BatchQueue()
+		q.put_many([b'a' * 10, b'b' * 20])
+		self.assertEqual(q.qbytes(), 30)
+		self.assertEqual(q.get_many(1), [b'a' * 10])
+		self.assertEqual(q.qbytes(), 20)
+		q.put_front([b'c' * 5])
+		self.assertEqual(q.qbytes(), 25)
+		self.assertEqual(q.get_many(10), [b'c' * 5, b'b' * 20])
+		self.assertEqual(q.qbytes(), 0)
+
+	def test_wait_for_room(self):
+		q = queues.BatchQueue()
+		q.put_many([b'x' * 100] * 3)
+		self.assertFalse(q.wait_for_room(max_bytes=150, timeout=0))
+		self.assertFalse(q.wait_for_room(max_items=2, timeout=0))
+
+		def drain():
+			time.sleep(0.05)
+			q.get_many(2)
+		threading.Thread(target=drain).start()
+		self.assertTrue(q.wait_for_room(max_items=1, max_bytes=150, timeout=2))
+
+	def test_put_within_reserves_the_room(self):
+		q = queues.BatchQueue()
+		peak = []
+
+		def produce():
+			for _ in range(50):
+				q.put_within(b'x' * 100, 300)
+				peak.append(q.qbytes())
+		producers = [threading.Thread(target=produce) for _ in range(4)]
+		for thread in producers:
+			thread.start()
+		got = 0
+		while got < 200:
+			got += len(q.get_many(1, timeout=1))
+		for thread in producers:
+			thread.join()
+		self.assertLessEqual(max(peak), 300)
+
+	def test_put_within_oversized_waits_for_empty(self):
+		q = queues.BatchQueue()
+		q.put(b'x' * 10)
+		self.assertFalse(q.put_within(b'y' * 500, 300, timeout=0))
+		self.assertEqual(q.qsize(), 1)
+		q.get_many(1)
+		self.assertTrue(q.put_within(b'y' * 500, 300, timeout=0))
+		self.assertEqual(q.qbytes(), 500)
+
+
+class TestPriorityBatchQueue(unittest.TestCase):
+
+	def test_priority_then_fifo(self):
+		q = queues.PriorityBatchQueue()
+		q.put_many([task(b'low1'), task(b'high', 5), task(b'low2'), task(b'mid', 2)])
+		self.assertEqual([tmp.body for tmp in q.get_many(10)], [b'high', b'mid', b'low1', b'low2'])
+
+	def test_put_front_goes_ahead_of_its_priority(self):
+		q = queues.PriorityBatchQueue()
+		q.put_many([task(b'a'), task(b'b'), task(b'c')])
+		first, second = q.get_many(2)
+		q.put(task(b'urgent', 9))
+		q.put_front([first, second])
+		self.assertEqual([tmp.body for tmp in q.get_many(10)], [b'urgent', b'a', b'b', b'c'])
+		self.assertEqual(q.qbytes(), 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,48 @@
+
+import json
+import unittest
+
+from AmqpConnector import serializers
+
+
+class TestSerializers(unittest.TestCase):
+
+	def test_content_type_names(self):
+		self.assertEqual(serializers.get_content_type('json'), 'application/json')
+		self.assertEqual(serializers.get_content_type('application/json'), 'application/json')
+		self.assertIsNone(serializers.get_content_type(None))
+		with self.assertRaises(ValueError):
+			serializers.get_content_type('yaml')
+
+	def test_round_trips(self):
+		message = {'a' : [1, 2.5, "three"], 'b' : None}
+		for name in ('json', 'pickle', 'marshal'):
+			content_type = serializers.get_content_type(name)
+			body, got_type = serializers.dumps(message, content_type)
+			self.assertEqual(got_type, content_type)
+			self.assertEqual(serializers.loads(body, {'content_type' : content_type}, [content_type]), message)
+
+	def test_raw(self):
+		self.assertEqual(serializers.dumps("héllo", serializers.RAW), ("héllo".encode("utf-8"), serializers.RAW))
+		self.assertEqual(serializers.dumps(b'as is', None), (b'as is', None))
+		self.assertEqual(serializers.loads(b'body', {}, serializers.DEFAULT_ACCEPT), b'body')
+
+	def test_unaccepted_types_pass_through(self):
+		body, content_type = serializers.dumps([1, 2], serializers.get_content_type('pickle'))
+		with self.assertLogs("Main.Connector.Serializers", "WARNING"):
+			self.assertEqual(serializers.loads(body, {'content_type' : content_type}, serializers.DEFAULT_ACCEPT), body)
+
+	def test_memoryview_bodies(self):
+		got = serializers.loads(b'abcdef', {}, serializers.DEFAULT_ACCEPT, as_memoryview=True)
+		self.assertIsInstance(got, memoryview)
+		self.assertEqual(got[2:4].tobytes(), b'cd')
+		# Decoded bodies aren't wrapped.
+		self.assertEqual(serializers.loads(b'[1]', {'content_type' : 'application/json'}, serializers.DEFAULT_ACCEPT, as_memoryview=True), [1])
+
+	def test_decode_failure_raises(self):
+		with self.assertRaises(json.JSONDecodeError):
+			serializers.loads(b'{"truncated', {'content_type' : 'application/json'}, serializers.DEFAULT_ACCEPT)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,55 @@
+
+import collections
+import unittest
+
+from AmqpConnector import sharding
+
+
+class TestJumpHash(unittest.TestCase):
+
+	def test_in_range_and_stable(self):
+		for key in range(1000):
+			bucket = sharding.jump_hash(key, 7)
+			self.assertTrue(0 <= bucket < 7)
+			self.assertEqual(bucket, sharding.jump_hash(key, 7))
+
+	def test_growing_only_moves_keys_to_the_new_bucket(self):
+		keys = [sharding.key_hash("key-%d" % tmp) for tmp in range(2000)]
+		for buckets in range(1, 10):
+			moved = 0
+			for key in keys:
+				before = sharding.jump_hash(key, buckets)
+				after  = sharding.jump_hash(key, buckets + 1)
+				if before != after:
+					self.assertEqual(after, buckets)
+					moved += 1
+			# About 1/(n+1) of the keys should move.
+			self.assertLess(abs(moved / len(keys) - 1 / (buckets + 1)), 0.05)
+
+	def test_key_hash_is_stable(self):
+		self.assertEqual(sharding.key_hash("abc"), sharding.key_hash(b"abc"))
+		self.assertEqual(sharding.key_hash(("a", 1)), sharding.key_hash(("a", 1)))
+
+
+class TestShardNames(unittest.TestCase):
+
+	def test_queue_names(self):
+		self.assertEqual(sharding.shard_queue_name('task.q', 0), 'task.q')
+		self.assertEqual(sharding.shard_queue_name('task.q', 3), 'task-shard3.q')
+
+	def test_routing_keys_are_distinct(self):
+		for name in ('task.q', 'foo.bar.q'):
+			keys = sharding.ShardRouter(name, 4).keys
+			self.assertEqual(len(set(keys)), 4, keys)
+			self.assertEqual(keys[0], sharding.routing_key(name))
+
+	def test_router(self):
+		router = sharding.ShardRouter('task.q', 3)
+		self.assertEqual(collections.Counter(router.route() for _ in range(9)), {'task' : 3, 'task-shard1' : 3, 'task-shard2' : 3})
+		self.assertEqual(len({router.route("same key") for _ in range(10)}), 1)
+		with self.assertRaises(ValueError):
+			router.resize(0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,119 @@
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from AmqpConnector import spool
+from AmqpConnector.delivery import Outgoing
+
+
+class TestSpool(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory, True)
+
+	def test_read_in_order(self):
+		sp = spool.Spool(self.directory, segment_size=100)
+		for num in range(10):
+			sp.append(b'msg-%d' % num, {'n' : num}, 'key')
+		records = sp.read(100)
+		self.assertEqual([tmp[0] for tmp in records], [b'msg-%d' % num for num in range(10)])
+		self.assertEqual(records[3][1:3], ({'n' : 3}, 'key'))
+		self.assertEqual(sp.count, 0)
+		sp.close()
+
+	def test_torn_tail_is_truncated(self):
+		sp = spool.Spool(self.directory)
+		for num in range(3):
+			sp.append(b'msg-%d' % num, {})
+		sp.close()
+		path = os.path.join(self.directory, "%010d.seg" % 0)
+		size = os.path.getsize(path)
+		with open(path, "ab") as fp:
+			fp.write(spool.RECORD.pack(10, 10, 0) + b'partial')
+
+		sp = spool.Spool(self.directory)
+		self.assertEqual(sp.count, 3)
+		self.assertEqual(os.path.getsize(path), size)
+		self.assertEqual([tmp[0] for tmp in sp.read(10)], [b'msg-0', b'msg-1', b'msg-2'])
+		sp.close()
+
+	def test_uncommitted_records_are_read_again(self):
+		sp = spool.Spool(self.directory)
+		for num in range(4):
+			sp.append(b'msg-%d' % num, {})
+		records = sp.read(3)
+		sp.commit(records[0][3])
+		sp.close()
+
+		sp = spool.Spool(self.directory)
+		self.assertEqual(sp.count, 3)
+		self.assertEqual([tmp[0] for tmp in sp.read(10)], [b'msg-1', b'msg-2', b'msg-3'])
+		sp.close()
+
+	def test_commit_deletes_old_segments(self):
+		sp = spool.Spool(self.directory, segment_size=50)
+		for num in range(10):
+			sp.append(b'x' * 40, {})
+		records = sp.read(10)
+		self.assertGreater(len(sp._segments()), 5)
+		# Reading alone mustn't delete anything.
+		self.assertEqual(sp._segments()[0], 0)
+		sp.commit(records[-1][3])
+		self.assertEqual(sp._segments()[0], records[-1][3][0])
+		sp.close()
+
+	def test_read_byte_limit(self):
+		sp = spool.Spool(self.directory)
+		for num in range(10):
+			sp.append(b'x' * 100, {})
+		self.assertEqual(len(sp.read(100, max_bytes=350)), 3)
+		# A record bigger than the limit still comes back on its own.
+		self.assertEqual(len(sp.read(100, max_bytes=10)), 1)
+		sp.close()
+
+
+class TestSpoolQueue(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory, True)
+
+	def test_refill_stays_within_max_bytes(self):
+		q = spool.SpoolQueue(self.directory, max_items=1000, max_bytes=10000)
+		q.put_many([Outgoing(b'x' * 1000) for _ in range(100)])
+		self.assertLessEqual(q.qbytes(), 10000)
+		self.assertGreater(q.spooled(), 0)
+		for _ in range(100):
+			q.get_nowait()
+			self.assertLessEqual(q.qbytes(), 10000)
+		q.close()
+
+	def test_crash_replays_unpublished(self):
+		q = spool.SpoolQueue(self.directory, max_items=2)
+		q.put_many([Outgoing(b'msg-%d' % num) for num in range(6)])
+		got = [q.get_nowait() for _ in range(4)]
+		# Only the first two (kept in memory) and the next one were published.
+		q.published(got[:3])
+		q.spool.close()
+
+		q = spool.SpoolQueue(self.directory, max_items=2)
+		self.assertEqual([q.get_nowait().body for _ in range(q.qsize())], [b'msg-3', b'msg-4', b'msg-5'])
+		q.close()
+
+	def test_close_keeps_everything_once(self):
+		q = spool.SpoolQueue(self.directory, max_items=2)
+		q.put_many([Outgoing(b'msg-%d' % num) for num in range(5)])
+		got = [q.get_nowait() for _ in range(3)]
+		q.published(got)
+		q.close()
+
+		q = spool.SpoolQueue(self.directory, max_items=2)
+		self.assertEqual(sorted(q.get_nowait().body for _ in range(q.qsize())), [b'msg-3', b'msg-4'])
+		q.close()
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,91 @@
+import time
+import unittest
+
+from AmqpConnector import topology
+
+
+class DeclareChannel:
+	'''
+	Stands in for a transport channel, recording the declares sent.
+	'''
+
+	def __init__(self):
+		self.sent = []
+
+	def exchange_declare(self, exchange, **kwargs):
+		self.sent.append(('exchange', exchange))
+
+	def queue_declare(self, queue, **kwargs):
+		self.sent.append(('queue', queue))
+
+	def queue_bind(self, queue, exchange, routing_key):
+		self.sent.append(('bind', queue))
+
+
+CONFIG = {'transport' : 'loopback', 'host' : 'broker:5672', 'virtual_host' : '/'}
+
+
+class TestTopologyCache(unittest.TestCase):
+
+	def setUp(self):
+		topology.get_cache().clear()
+
+	def tearDown(self):
+		topology.get_cache().clear()
+
+	def declare(self, ttl=60, config=CONFIG, durable=False, arguments=None):
+		chan     = DeclareChannel()
+		declarer = topology.Declarer(chan, config, ttl)
+		declarer.exchange('tasks.e', 'direct', durable=durable)
+		declarer.queue('task.q', durable=durable, arguments=arguments)
+		declarer.bind('task.q', 'tasks.e', 'task', durable=durable)
+		declarer.queue('probe.q', auto_delete=True)
+		return chan, declarer
+
+	def test_repeat_declares_are_skipped(self):
+		chan, declarer = self.declare()
+		self.assertEqual(len(chan.sent), 4)
+		self.assertEqual((declarer.sent, declarer.cached), (4, 0))
+
+		# Auto-delete entities can vanish at any time, so they're always sent.
+		chan, declarer = self.declare()
+		self.assertEqual(chan.sent, [('queue', 'probe.q')])
+		self.assertEqual((declarer.sent, declarer.cached), (1, 3))
+
+	def test_cache_is_per_broker_and_per_definition(self):
+		self.declare()
+		chan, _ = self.declare(config=dict(CONFIG, virtual_host='other'))
+		self.assertEqual(len(chan.sent), 4)
+		chan, _ = self.declare(arguments={'x-max-priority' : 10})
+		self.assertEqual(chan.sent, [('queue', 'task.q'), ('queue', 'probe.q')])
+
+	def test_entries_expire(self):
+		self.declare(ttl=0.05)
+		time.sleep(0.1)
+		chan, _ = self.declare(ttl=0.05)
+		self.assertEqual(len(chan.sent), 4)
+
+		# Without a ttl, nothing is skipped.
+		chan, _ = self.declare(ttl=None)
+		self.assertEqual(len(chan.sent), 4)
+
+	def test_forget(self):
+		key = topology.TopologyCache.key(CONFIG)
+		self.declare(durable=True)
+		topology.get_cache().forget(key)
+		chan, _ = self.declare(durable=True)
+		self.assertEqual(chan.sent, [('queue', 'probe.q')])
+
+		topology.get_cache().forget(key, durable=True)
+		chan, _ = self.declare(durable=True)
+		self.assertEqual(len(chan.sent), 4)
+
+		topology.get_cache().clear()
+		self.declare()
+		topology.get_cache().forget(key)
+		chan, _ = self.declare()
+		self.assertEqual(len(chan.sent), 4)
+
+
+if __name__ == '__main__':
+	unittest.main()